@@ -0,0 +1,134 @@
+"""
+Streaming parser for the .ac configuration files.
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+
+import re
+
+_NAME_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+# Characters that can be escaped with a backslash inside double quotes (shell semantics).
+_DQUOTE_ESCAPES = '"\\$`'
+
+
+class AcSyntaxError(ValueError):
+    """Error raised if a line of the .ac file cannot be parsed."""
+
+    def __init__(self, msg, lineno, path=None):
+        self.msg, self.lineno, self.path = msg, lineno, path
+        super().__init__("%s:%s: %s" % (path if path is not None else "<ac file>", lineno, msg))
+
+
+def iter_ac_tokens(fh, path=None):
+    """
+    Generator over the tokens of an .ac file. Lines are read one at a time from
+    the file object (or any iterable of lines) `fh` so that the file is processed in a single pass.
+    Yield tuples (kind, lineno, data) where:
+
+        - kind == "meta": data is the string with the json dictionary found between the
+          first two `#---` markers. lineno is the line of the first marker.
+
+        - kind == "option": data is the tuple (name, value). lineno is the line
+          where the option starts.
+
+    Values follow the quoting rules of the shell: single and double quotes are removed,
+    a backslash at the end of the line continues the value on the next line,
+    a newline inside quotes is part of the value and `#` preceded by a blank starts a comment.
+
+    Args:
+        fh: File object.
+        path: Path of the file (used in error messages).
+
+    Raises:
+        AcSyntaxError
+    """
+    lines = enumerate(fh, start=1)
+    nmarkers, meta, meta_lineno = 0, [], None
+
+    for lineno, line in lines:
+        if nmarkers < 2 and line.startswith("#---"):
+            nmarkers += 1
+            if nmarkers == 1:
+                meta_lineno = lineno
+            else:
+                yield "meta", meta_lineno, "".join(meta)
+            continue
+
+        if nmarkers == 1:
+            meta.append(line.replace("#", "", 1))
+            continue
+
+        s = line.strip()
+        if not s or s.startswith("#"): continue
+        yield "option", lineno, _parse_option(line, lineno, lines, path)
+
+    if nmarkers == 1:
+        raise AcSyntaxError("Cannot find the end of the metadata section", meta_lineno, path)
+
+
+def _parse_option(line, lineno, lines, path):
+    """
+    Parse the `name=value` assignment starting at line `line`.
+    Additional lines are consumed from the iterator `lines` if the value continues on the next line.
+    Return (name, value)
+    """
+    i = line.find("=")
+    if i == -1:
+        raise AcSyntaxError("Expecting `name=value`, got: `%s`" % line.strip(), lineno, path)
+    name = line[:i].strip()
+    if not _NAME_RE.match(name):
+        raise AcSyntaxError("Invalid option name: `%s`" % name, lineno, path)
+
+    value, quote, text, pos = [], None, line, i + 1
+    while True:
+        if pos >= len(text):
+            if quote is None: break
+            # Quoted value continues on the next line.
+            text = next(lines, (None, None))[1]
+            if text is None:
+                raise AcSyntaxError("Unterminated %s quote" % quote, lineno, path)
+            pos = 0
+            continue
+
+        c = text[pos]
+        if quote is None:
+            if c in "\"'":
+                quote = c
+            elif c == "\\":
+                if text[pos+1:] in ("\n", ""):
+                    # Line continuation.
+                    text = next(lines, (None, ""))[1]
+                    pos = 0
+                    continue
+                value.append(text[pos+1])
+                pos += 1
+            elif c == "\n":
+                break
+            elif c == "#" and text[pos-1].isspace():
+                # Inline comment.
+                break
+            else:
+                value.append(c)
+
+        elif quote == "'":
+            if c == "'":
+                quote = None
+            else:
+                value.append(c)
+
+        else:
+            if c == '"':
+                quote = None
+            elif c == "\\" and text[pos+1:pos+2] == "\n":
+                # Line continuation inside double quotes.
+                pos += 2
+                continue
+            elif c == "\\" and text[pos+1:pos+2] and text[pos+1] in _DQUOTE_ESCAPES:
+                value.append(text[pos+1])
+                pos += 1
+            else:
+                value.append(c)
+
+        pos += 1
+
+    return name, "".join(value).strip()
@@ -0,0 +1,108 @@
+"""
+Generate the submission scripts and the workon scripts for a list of configuration files.
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+
+import os
+import re
+
+from collections import OrderedDict
+from abiconfig.core.cache import write_atomic
+
+# Lines that change at each invocation and must be ignored when comparing the scripts.
+_TIMESTAMP_RE = re.compile(r"^# Generated by abiconf\.py on .*$", re.MULTILINE)
+
+
+def same_script(old, new):
+    """True if the two scripts are equal apart from the generation timestamp."""
+    return _TIMESTAMP_RE.sub("", old) == _TIMESTAMP_RE.sub("", new)
+
+
+def write_if_changed(path, string):
+    """
+    Write string to path (atomically) if the content of the file differs. Return True if the file has been written.
+    """
+    try:
+        with open(path, "rt") as fh:
+            if same_script(fh.read(), string): return False
+    except (IOError, OSError):
+        pass
+    write_atomic(path, string)
+    return True
+
+
+def render_config(conf, build_top=None, jobs=1):
+    """
+    Return OrderedDict filename --> string with the scripts generated for the Config conf:
+    the submission script template, the runtests script and the workon script.
+
+    Args:
+        build_top: Directory where the workon script creates the build directory. Default: cwd.
+        jobs: Number of make jobs used in the workon script.
+    """
+    from abiconfig.core.workon import Build
+    build = Build.from_conf(conf, top=build_top)
+    scripts = OrderedDict()
+    scripts["template_job.sh"] = conf.get_script_str()
+    scripts["launch_runtests_job.sh"] = conf.get_runtests_script_str()
+    scripts[os.path.basename(build.script)] = build.get_script_str(jobs)
+    return scripts
+
+
+class ScriptGenerator(object):
+    """
+    Write the scripts of a list of configurations to outdir/<basename>/.
+    Files are written atomically and only if their content changed so that
+    the output tree can be synchronized cheaply (e.g. with rsync).
+    """
+
+    def __init__(self, outdir, build_top=None, jobs=1):
+        """
+        Args:
+            outdir: Output directory.
+            build_top: Directory where the workon scripts create the build directories. Default: cwd.
+            jobs: Number of make jobs used in the workon scripts.
+        """
+        self.outdir = os.path.abspath(outdir)
+        self.build_top = os.path.abspath(build_top if build_top is not None else os.getcwd())
+        self.jobs = jobs
+        self.written, self.unchanged, self.errors = [], [], []
+
+    def _generate(self, conf):
+        """Render and write the scripts of conf. Return list of (path, written)."""
+        results = []
+        for fname, s in render_config(conf, build_top=self.build_top, jobs=self.jobs).items():
+            path = os.path.join(self.outdir, conf.basename, fname)
+            results.append((path, write_if_changed(path, s)))
+        return results
+
+    def generate(self, configs, nprocs=1):
+        """
+        Generate the scripts for configs with nprocs threads.
+        Errors are stored in `errors` as (basename, message). Return number of errors.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        from abiconfig.core.utils import get_ncpus
+        if nprocs is None: nprocs = get_ncpus()
+
+        with ThreadPoolExecutor(max_workers=max(1, min(nprocs, len(configs)))) as pool:
+            futures = [pool.submit(self._generate, conf) for conf in configs]
+            for conf, future in zip(configs, futures):
+                try:
+                    for path, written in future.result():
+                        (self.written if written else self.unchanged).append(path)
+                except Exception as exc:
+                    self.errors.append((conf.basename, str(exc)))
+
+        return len(self.errors)
+
+    def print_summary(self, verbose=0):
+        """Print the list of files written and the errors."""
+        from abiconfig.core.termcolor import cprint
+        if verbose:
+            for path in self.written:
+                print("Written:", os.path.relpath(path, self.outdir))
+        for basename, err in self.errors:
+            cprint("Cannot generate scripts for %s:\n%s" % (basename, err), "red")
+        print("%d file(s) written, %d unchanged, %d error(s) in %s" % (
+              len(self.written), len(self.unchanged), len(self.errors), self.outdir))
@@ -0,0 +1,170 @@
+"""
+Persistent on-disk cache with the parsed content of the .ac files.
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+
+import os
+import json
+
+from abiconfig.core import release
+
+
+def get_cache_dir():
+    """
+    Return the directory used by abiconf to store cached data.
+    Default is ~/.abiconf, can be changed with the ABICONF_CACHE_DIR environment variable.
+    """
+    return os.environ.get("ABICONF_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".abiconf"))
+
+
+def file_sha1(path):
+    """Return the SHA1 hash of the content of file `path`."""
+    import hashlib
+    with open(path, "rb") as fh:
+        return hashlib.sha1(fh.read()).hexdigest()
+
+
+def _get_umask():
+    """Return the umask of the process (os.umask can only be read by setting it)."""
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+# Read once at import time since changing the umask is not thread-safe.
+_UMASK = _get_umask()
+
+
+def write_atomic(path, string):
+    """
+    Write string to path. The data is written to a temporary file in the same directory
+    that is then renamed so that readers never see a partially written file.
+    The file gets the permissions of a file created with open() (shell scripts are also executable).
+    """
+    import tempfile
+    dirname = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(dirname): os.makedirs(dirname)
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix=".tmp_")
+    try:
+        with os.fdopen(fd, "wt") as fh:
+            fh.write(string)
+        # mkstemp creates the file with mode 0600.
+        os.chmod(tmp_path, (0o777 if path.endswith(".sh") else 0o666) & ~_UMASK)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+        raise
+
+
+class ConfigCache(dict):
+    """
+    Mapping: absolute path of the .ac file --> entry with the parsed metadata and options.
+
+    An entry is reused if the mtime and the size of the file did not change.
+    If the mtime changed but the size is the same (e.g. after a `git checkout`),
+    the content hash is compared with the one stored in the entry before parsing the file again.
+    """
+    # Increase this number if the format of the entries or the parser changes.
+    VERSION = 4
+
+    @classmethod
+    def from_file(cls, filepath=None):
+        """
+        Read the cache from filepath. Default: configs.json in the abiconf cache directory.
+        Return empty cache if the file does not exist or it has been produced by another version.
+        """
+        if filepath is None:
+            filepath = os.path.join(get_cache_dir(), "configs.json")
+
+        new = cls()
+        new.filepath = filepath
+        try:
+            with open(filepath, "rt") as fh:
+                data = json.load(fh)
+        except (IOError, OSError, ValueError):
+            return new
+
+        if data.get("version") == cls.VERSION and data.get("abiconfig") == release.__version__:
+            new.update(data["entries"])
+
+        return new
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.filepath = None
+        self.modified = False
+
+    def get_config(self, path, lazy=False):
+        """
+        Return Config instance for the .ac file `path`.
+        Use the cached entry if the file did not change else parse the file and update the cache.
+
+        Args:
+            lazy: If True, only the metadata section is parsed on a cache miss (see Config.from_file)
+                and the entry stores only the metadata.
+        """
+        conf = self.lookup(path, lazy=lazy)
+        if conf is None:
+            from abiconfig.core.options import Config
+            conf = Config.from_file(path, lazy=lazy)
+            self.store(conf)
+        return conf
+
+    def lookup(self, path, lazy=False):
+        """
+        Return Config instance built from the cached entry. None if the file is not
+        in the cache or if it has been modified.
+        If the entry stores only the metadata, a lazy Config is returned if lazy else None.
+        """
+        path = os.path.abspath(path)
+        entry = self.get(path)
+        if entry is None: return None
+
+        st = os.stat(path)
+        hit = entry["mtime"] == st.st_mtime_ns and entry["size"] == st.st_size
+        if not hit and entry["size"] == st.st_size and entry["sha1"] == file_sha1(path):
+            # Same content, just touched.
+            entry["mtime"] = st.st_mtime_ns
+            self.modified = hit = True
+        if not hit: return None
+
+        from abiconfig.core.options import Config, ConfigMeta
+        if entry["options"] is None:
+            return Config.from_meta(path, entry["meta"]) if lazy else None
+        new = Config(entry["options"])
+        new.path = path
+        new.basename = os.path.basename(path)
+        new.meta = ConfigMeta(**entry["meta"])
+        return new
+
+    def store(self, conf):
+        """
+        Add (or replace) the entry associated to Config `conf`.
+        Only the metadata are stored if the options of conf have not been loaded (lazy object).
+        """
+        st = os.stat(conf.path)
+        self[conf.path] = dict(
+            mtime=st.st_mtime_ns,
+            size=st.st_size,
+            sha1=file_sha1(conf.path),
+            meta=dict(conf.meta),
+            options=list(conf.items()) if conf._loaded else None,
+        )
+        self.modified = True
+
+    def save(self):
+        """
+        Write the cache to file if it has been modified.
+        Entries associated to files that do not exist anymore are removed.
+        Errors are silently ignored since the cache is just an optimization.
+        """
+        if not self.modified or self.filepath is None: return
+        for path in [p for p in self if not os.path.exists(p)]:
+            self.pop(path)
+
+        data = {"version": self.VERSION, "abiconfig": release.__version__, "entries": self}
+        try:
+            write_atomic(self.filepath, json.dumps(data, separators=(",", ":")))
+            self.modified = False
+        except (IOError, OSError):
+            pass
@@ -0,0 +1,167 @@
+"""
+Compiler cache (ccache, sccache) used to speedup the compilation of workon builds.
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+
+import os
+import re
+import json
+
+# Variables of the .ac file wrapped with the compiler cache.
+COMPILER_VARS = ("FC", "CC", "CXX")
+
+_COMPILER_RE = re.compile(r"""^(\s*)(%s)(\s*=\s*)(["']?)(.*)$""" % "|".join(COMPILER_VARS))
+
+# Files written by the workon script in the build directory.
+CCACHE_STATSLOG = "ccache_stats.log"
+SCCACHE_STATS_START = ".sccache_stats_start.json"
+SCCACHE_STATS_END = ".sccache_stats_end.json"
+
+
+class CompilerCache(object):
+    """
+    Wrap the compilers specified in the .ac file with ccache or sccache.
+    The cache directory is shared by all the build directories and the statistics
+    (hits, misses) are computed for each build.
+    """
+    TOOLS = ("ccache", "sccache")
+
+    def __init__(self, tool, cache_dir=None, basedir=None):
+        """
+        Args:
+            tool: "ccache" or "sccache".
+            cache_dir: Directory of the cache. Default: ~/.abiconf/<tool>.
+            basedir: Paths below basedir are rewritten as relative paths by ccache so that
+                the objects compiled in different build directories can be shared.
+                Default: current working directory (the Abinit source tree).
+
+        Raise ValueError if the tool is not supported or it is not found in $PATH.
+        """
+        if tool not in self.TOOLS:
+            raise ValueError("Unsupported compiler cache: %s. Choose among %s" % (tool, str(self.TOOLS)))
+        import shutil
+        if shutil.which(tool) is None:
+            raise ValueError("Compiler cache %s not found in $PATH. Install it (or load the module) "
+                             "or build without --compiler-cache" % tool)
+        from abiconfig.core.cache import get_cache_dir
+        self.tool = tool
+        self.cache_dir = os.path.abspath(cache_dir if cache_dir is not None else os.path.join(get_cache_dir(), tool))
+        self.basedir = os.path.abspath(basedir if basedir is not None else os.getcwd())
+
+    def __repr__(self):
+        return "<%s: %s, cache_dir=%s>" % (self.__class__.__name__, self.tool, self.cache_dir)
+
+    def wrap_acfile_string(self, s):
+        """
+        Return new string with the content of the .ac file in which FC, CC and CXX are prefixed by the tool.
+        Return also the list of variables that have been wrapped.
+        """
+        lines, wrapped = [], []
+        for line in s.splitlines(True):
+            m = _COMPILER_RE.match(line)
+            if m and not m.group(5).startswith(self.tool + " "):
+                indent, name, eq, quote, rest = m.groups()
+                line = "%s%s%s%s%s %s" % (indent, name, eq, quote, self.tool, rest)
+                if not line.endswith("\n"): line += "\n"
+                wrapped.append(name)
+            lines.append(line)
+        return "".join(lines), wrapped
+
+    def get_env_lines(self, workdir):
+        """List of shell commands setting the environment used by the tool."""
+        if self.tool == "ccache":
+            return [
+                "export CCACHE_DIR=%s" % self.cache_dir,
+                "export CCACHE_BASEDIR=%s" % self.basedir,
+                "export CCACHE_NOHASHDIR=1",
+                "export CCACHE_STATSLOG=%s" % os.path.join(workdir, CCACHE_STATSLOG),
+            ]
+        else:
+            return [
+                "export SCCACHE_DIR=%s" % self.cache_dir,
+            ]
+
+    def get_pre_make_lines(self):
+        """Shell commands executed before make."""
+        if self.tool == "ccache":
+            return ["rm -f %s" % CCACHE_STATSLOG]
+        return ["sccache --show-stats --stats-format=json > %s 2>/dev/null" % SCCACHE_STATS_START]
+
+    def get_post_make_lines(self):
+        """Shell commands executed after make."""
+        if self.tool == "ccache": return []
+        return ["sccache --show-stats --stats-format=json > %s 2>/dev/null" % SCCACHE_STATS_END]
+
+    def get_stats(self, workdir):
+        """
+        Return dictionary with the number of hits, misses and uncacheable compilations
+        for the build in workdir. None if not available.
+        """
+        try:
+            if self.tool == "ccache":
+                with open(os.path.join(workdir, CCACHE_STATSLOG), "rt") as fh:
+                    return parse_ccache_statslog(fh)
+            else:
+                with open(os.path.join(workdir, SCCACHE_STATS_START), "rt") as fh:
+                    start = json.load(fh)
+                with open(os.path.join(workdir, SCCACHE_STATS_END), "rt") as fh:
+                    end = json.load(fh)
+                return diff_sccache_stats(start, end)
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+
+
+def parse_ccache_statslog(lines):
+    """
+    Parse the statistics log written by ccache when CCACHE_STATSLOG is set.
+    Each compilation adds a comment line with the path of the source file followed by the counters
+    e.g. `direct_cache_hit`, `cache_miss`, `unsupported_source_language` (recent versions
+    add counters for the storage backends that are ignored here).
+    """
+    stats = dict(hits=0, misses=0, uncacheable=0)
+
+    def add(counters):
+        if not counters: return
+        if counters & {"direct_cache_hit", "preprocessed_cache_hit"}:
+            stats["hits"] += 1
+        elif "cache_miss" in counters:
+            stats["misses"] += 1
+        else:
+            stats["uncacheable"] += 1
+
+    counters = set()
+    for line in lines:
+        line = line.strip()
+        if line.startswith("#"):
+            add(counters)
+            counters = set()
+        elif line and "_storage_" not in line:
+            counters.add(line)
+    add(counters)
+
+    return stats
+
+
+def diff_sccache_stats(start, end):
+    """
+    Compute the number of hits and misses from the output of `sccache --show-stats --stats-format=json`
+    executed before and after make. The sccache server is shared so the results include
+    the compilations of the builds executed at the same time.
+    """
+    def get(d, key):
+        value = d["stats"][key]
+        return sum(value["counts"].values()) if isinstance(value, dict) else value
+
+    return dict(
+        hits=get(end, "cache_hits") - get(start, "cache_hits"),
+        misses=get(end, "cache_misses") - get(start, "cache_misses"),
+        uncacheable=get(end, "requests_not_cacheable") - get(start, "requests_not_cacheable"),
+    )
+
+
+def format_stats(stats):
+    """String with the statistics returned by CompilerCache.get_stats."""
+    if stats is None: return "statistics not available"
+    ntot = stats["hits"] + stats["misses"]
+    rate = " (hit rate %.0f%%)" % (100 * stats["hits"] / ntot) if ntot else ""
+    return "%d hits, %d misses, %d uncacheable%s" % (stats["hits"], stats["misses"], stats["uncacheable"], rate)
@@ -0,0 +1,451 @@
+"""
+Coverage of the Abinit configure options in a list of configuration files.
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+
+import os
+import json
+
+from collections import OrderedDict
+from abiconfig.core import release
+from abiconfig.core.termcolor import cprint
+from abiconfig.core.cache import get_cache_dir, file_sha1, write_atomic
+
+# Options that are not checked.
+BUILTIN_OPTS = set(["CPP", "CC", "CFLAGS", "CXX", "FC", "FCFLAGS", "AR", "ARFLAGS_EXTRA",
+                    "MPI_RUNNER", "CFLAGS_EXTRA", "CXXFLAGS", "FCFLAGS_EXTRA", "RANLIB",
+                    "NM", "LD", "CPPFLAGS_EXTRA", "FC_LDFLAGS_EXTRA", "FPPFLAGS", "NVCC",
+                    "NVCC_CFLAGS", "CC_LIBS_EXTRA", "FC_LIBS_EXTRA",
+                    ])
+
+
+def popcount(mask):
+    """Number of bits set in the integer mask."""
+    try:
+        return mask.bit_count()
+    except AttributeError:
+        # py < 3.10
+        return bin(mask).count("1")
+
+
+def iter_bits(mask):
+    """Iterate over the positions of the bits set in mask (increasing order)."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def is_builtin_option(name):
+    """True if option name is not checked by the coverage engine."""
+    return name in BUILTIN_OPTS or name.startswith("fcflags_opt")
+
+
+class CoverageMatrix(object):
+    """
+    Boolean matrices options x configurations and option_values x configurations
+    stored as rows of integer bitsets: bit i is set if the i-th configuration uses the option (value).
+    The queries (unused options/values, contribution of a configuration, overlap between configurations)
+    are computed with bitwise operations on the rows.
+    """
+
+    def __init__(self, options, paths):
+        """
+        Args:
+            options: AbinitConfigureOptions.
+            paths: List with the paths of the configurations (columns of the matrix).
+        """
+        self.options = options
+        self.paths = list(paths)
+        # option name --> bitset
+        self.optmasks = OrderedDict((name, 0) for name in options)
+        # option name --> OrderedDict value --> bitset. Only for the options with a list of values.
+        self.valmasks = OrderedDict((name, OrderedDict((v, 0) for v in opt.values))
+                                    for name, opt in options.items() if opt.values)
+        # config path --> list_of_errors
+        self.config_errors = OrderedDict()
+
+    @classmethod
+    def from_configs(cls, configs, options):
+        """Build the matrices from a list of Config objects and AbinitConfigureOptions."""
+        new = cls(options, [conf.path for conf in configs])
+        for i, conf in enumerate(configs):
+            new.set_column(i, conf.items())
+        return new
+
+    def __len__(self):
+        return len(self.paths)
+
+    def set_column(self, i, items):
+        """
+        Set the entries of the i-th column from the list of (name, value) pairs of the configuration.
+        Errors (unknown options or values) are stored in config_errors.
+        """
+        bit, path = 1 << i, self.paths[i]
+        self.clear_column(i)
+        errors = []
+        for name, value in items:
+            if is_builtin_option(name): continue
+            if name not in self.optmasks:
+                errors.append("Unknown option: %s" % name)
+                continue
+            self.optmasks[name] |= bit
+            values = self.valmasks.get(name)
+            if values is None: continue
+            # handle "mkl+magma" case
+            for v in value.split("+"):
+                if v in values:
+                    values[v] |= bit
+                else:
+                    errors.append("Invalid value `%s` for option: %s" % (v, name))
+
+        if errors: self.config_errors[path] = errors
+
+    def add_column(self, path, items):
+        """Add a new configuration with path and list of (name, value) pairs."""
+        self.paths.append(path)
+        self.set_column(len(self.paths) - 1, items)
+
+    def remove_column(self, i):
+        """Remove the i-th configuration. The following columns are shifted to the left."""
+        self.remove_columns([i])
+
+    def remove_columns(self, indices):
+        """
+        Remove the configurations with the given column indices in a single pass over the rows.
+        The columns that are kept are shifted to the left.
+        """
+        indices = sorted(set(indices))
+        if not indices: return
+        # Ranges [start, stop) of the columns that are kept.
+        segments, start = [], 0
+        for i in indices:
+            if i > start: segments.append((start, i))
+            start = i + 1
+        if start < len(self.paths): segments.append((start, len(self.paths)))
+
+        def compact(mask):
+            if not mask: return 0
+            new, pos = 0, 0
+            for start, stop in segments:
+                new |= ((mask >> start) & ((1 << (stop - start)) - 1)) << pos
+                pos += stop - start
+            return new
+
+        for name, mask in self.optmasks.items():
+            self.optmasks[name] = compact(mask)
+        for values in self.valmasks.values():
+            for v, mask in values.items():
+                values[v] = compact(mask)
+
+        removed = set(indices)
+        for i in indices:
+            self.config_errors.pop(self.paths[i], None)
+        self.paths = [p for i, p in enumerate(self.paths) if i not in removed]
+
+    def clear_column(self, i):
+        """Reset the entries of the i-th column."""
+        keep = ~(1 << i)
+        for name, mask in self.optmasks.items():
+            if mask: self.optmasks[name] = mask & keep
+        for values in self.valmasks.values():
+            for v, mask in values.items():
+                if mask: values[v] = mask & keep
+        self.config_errors.pop(self.paths[i], None)
+
+    def as_dict(self):
+        """JSON-serializable dictionary. Bitsets are stored as hexadecimal strings."""
+        return dict(
+            paths=self.paths,
+            optmasks={k: "%x" % m for k, m in self.optmasks.items() if m},
+            valmasks={k: {v: "%x" % m for v, m in values.items() if m} for k, values in self.valmasks.items()},
+            config_errors=self.config_errors,
+        )
+
+    @classmethod
+    def from_dict(cls, d, options):
+        """Build the object from the dictionary produced by as_dict and AbinitConfigureOptions."""
+        new = cls(options, d["paths"])
+        for name, mask in d["optmasks"].items():
+            new.optmasks[name] = int(mask, 16)
+        for name, values in d["valmasks"].items():
+            for v, mask in values.items():
+                new.valmasks[name][v] = int(mask, 16)
+        new.config_errors.update(d["config_errors"])
+        return new
+
+    def count(self, name, value=None):
+        """Number of configurations using option name (with the given value if not None)."""
+        return popcount(self.optmasks[name] if value is None else self.valmasks[name][value])
+
+    def users(self, name, value=None):
+        """List with the paths of the configurations using option name (with value if not None)."""
+        mask = self.optmasks[name] if value is None else self.valmasks[name][value]
+        return [self.paths[i] for i in iter_bits(mask)]
+
+    def unused_options(self):
+        """List of options that are never used."""
+        return [name for name, mask in self.optmasks.items() if not mask]
+
+    def unused_values(self):
+        """
+        OrderedDict option name --> list of values that are never used.
+        Only the options that are used at least once are considered.
+        """
+        od = OrderedDict()
+        for name, values in self.valmasks.items():
+            if not self.optmasks[name]: continue
+            unused = [v for v, mask in values.items() if not mask]
+            if unused: od[name] = unused
+        return od
+
+    def diff(self, old):
+        """
+        Compare with the matrix old (previous state).
+        Return list of strings with the options and values that lost their last user or gained their first one.
+        """
+        lines = []
+        for name, mask in self.optmasks.items():
+            was_used = bool(old.optmasks.get(name))
+            if was_used and not mask:
+                lines.append("option %s lost its last user" % name)
+            elif not was_used and mask:
+                lines.append("option %s is now used" % name)
+
+        for name, values in self.valmasks.items():
+            old_values = old.valmasks.get(name, {})
+            for v, mask in values.items():
+                was_used = bool(old_values.get(v))
+                if was_used and not mask:
+                    lines.append("value %s of option %s lost its last user" % (v, name))
+                elif not was_used and mask:
+                    lines.append("value %s of option %s is now used" % (v, name))
+
+        return lines
+
+    def get_rows(self, i):
+        """List with the rows (option names and "name=value" strings) covered by the i-th configuration."""
+        bit = 1 << i
+        rows = [name for name, mask in self.optmasks.items() if mask & bit]
+        for name, values in self.valmasks.items():
+            rows.extend("%s=%s" % (name, v) for v, mask in values.items() if mask & bit)
+        return rows
+
+    def _all_masks(self):
+        """Iterate over all the rows of the two matrices."""
+        for mask in self.optmasks.values():
+            yield mask
+        for values in self.valmasks.values():
+            for mask in values.values():
+                yield mask
+
+    def contributions(self):
+        """
+        Return list with the number of rows (options and values) covered only by the i-th configuration
+        i.e. the coverage that would be lost if the configuration is removed.
+        """
+        counts = [0] * len(self.paths)
+        for mask in self._all_masks():
+            if mask and mask & (mask - 1) == 0:
+                counts[mask.bit_length() - 1] += 1
+        return counts
+
+    def overlap(self, i, j):
+        """Number of rows (options and values) covered by both the i-th and the j-th configuration."""
+        both = (1 << i) | (1 << j)
+        return sum(1 for mask in self._all_masks() if mask & both == both)
+
+    def overlap_matrix(self):
+        """Return the symmetric matrix (list of lists) with the overlap between all pairs of configurations."""
+        n = len(self.paths)
+        mat = [[0] * n for _ in range(n)]
+        for mask in self._all_masks():
+            cols = list(iter_bits(mask))
+            for a, i in enumerate(cols):
+                for j in cols[a:]:
+                    mat[i][j] += 1
+                    if i != j: mat[j][i] += 1
+        return mat
+
+    def print_report(self, verbose=0):
+        """
+        Print the errors detected in the configuration files, the options and the values that are never used.
+        Return exit code.
+        """
+        retcode = sum(len(errors) for errors in self.config_errors.values())
+
+        # Print errors detected in configuration files.
+        if self.config_errors:
+            retcode += 1
+            cprint("Found %d erroneous configuration files" % len(self.config_errors), "red")
+            for path, errors in self.config_errors.items():
+                cprint("In configuration file: %s" % path, "red")
+                for i, err in enumerate(errors):
+                    print("[%d] %s" % (i, err))
+                print(90 * "-")
+
+        # Print possible problems.
+        for name in self.unused_options():
+            retcode += 1
+            cprint("%s is never used" % name, "magenta")
+
+        unused_values = self.unused_values()
+        if unused_values:
+            print(" ")
+            cprint("The following values are never used in the config files", "yellow")
+            retcode += 1
+            for name, values in unused_values.items():
+                cprint("[%s]" % name, "yellow")
+                for v in values:
+                    cprint(v, "yellow")
+
+        if verbose:
+            print(" ")
+            cprint("Number of options and values covered only by this configuration file:", "blue")
+            for path, count in sorted(zip(self.paths, self.contributions()), key=lambda t: -t[1]):
+                print("%4d %s" % (count, path))
+
+        return retcode
+
+
+def options_signature(options):
+    """SHA1 hash of the option names and values. Used to invalidate the coverage state."""
+    import hashlib
+    s = json.dumps([(name, opt.values) for name, opt in options.items()])
+    return hashlib.sha1(s.encode("utf-8")).hexdigest()
+
+
+def get_state_path(top):
+    """Default path of the file with the coverage state of the .ac files in directory top."""
+    import hashlib
+    key = hashlib.sha1(os.path.abspath(top).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(get_cache_dir(), "bbcov_%s.json" % key)
+
+
+class IncrementalCoverage(object):
+    """
+    Coverage state saved to file between two runs of `abiconf.py bbcov --incremental`.
+    The state contains the CoverageMatrix and the size, mtime and SHA1 hash of the .ac files
+    so that only the files that have been added, modified or removed are parsed again.
+    """
+    # Increase this number if the format of the file changes.
+    VERSION = 1
+
+    @classmethod
+    def from_file(cls, filepath, options):
+        """
+        Read the state from filepath. Return object with empty state if the file does not exist,
+        if it has been produced by another version or if the options changed.
+        """
+        new = cls(filepath, options)
+        try:
+            with open(filepath, "rt") as fh:
+                data = json.load(fh)
+        except (IOError, OSError, ValueError):
+            return new
+
+        if (data.get("version") == cls.VERSION and data.get("abiconfig") == release.__version__ and
+            data.get("options") == new.signature):
+            new.files = data["files"]
+            new.matrix = CoverageMatrix.from_dict(data["matrix"], options)
+            new.previous = CoverageMatrix.from_dict(data["matrix"], options)
+
+        return new
+
+    def __init__(self, filepath, options):
+        """
+        Args:
+            filepath: File used to store the state.
+            options: AbinitConfigureOptions.
+        """
+        self.filepath = filepath
+        self.options = options
+        self.signature = options_signature(options)
+        # path --> [size, mtime_ns, sha1]
+        self.files = {}
+        self.matrix = CoverageMatrix(options, [])
+        # Matrix read from file, None if no previous state is available.
+        self.previous = None
+
+    def _is_unchanged(self, path):
+        """True if file path did not change since the last run."""
+        entry = self.files.get(path)
+        if entry is None: return False
+        st = os.stat(path)
+        if entry[0] == st.st_size and entry[1] == st.st_mtime_ns: return True
+        if entry[0] == st.st_size and entry[2] == file_sha1(path):
+            # Same content, just touched.
+            entry[1] = st.st_mtime_ns
+            return True
+        return False
+
+    def update(self, paths, use_cache=True, nprocs=1):
+        """
+        Update the coverage matrix for the list of .ac files `paths`.
+        Only the files that are not in the previous state or that have been modified are parsed.
+        Return (added, modified, removed, parse_errors) where the first three entries are list of paths
+        and parse_errors is a list of (path, error) tuples for the files that could not be parsed.
+        """
+        from abiconfig.core.options import ConfigList
+        paths = [os.path.abspath(p) for p in paths]
+        matrix = self.matrix
+
+        current = set(paths)
+        indices = [i for i, p in enumerate(matrix.paths) if p not in current]
+        removed = [matrix.paths[i] for i in indices]
+        matrix.remove_columns(indices)
+        for path in removed:
+            self.files.pop(path, None)
+
+        changed = [p for p in paths if not self._is_unchanged(p)]
+        added = [p for p in changed if p not in self.files]
+        modified = [p for p in changed if p in self.files]
+
+        configs = ConfigList.from_files(changed, use_cache=use_cache, nprocs=nprocs)
+        columns = {p: i for i, p in enumerate(matrix.paths)}
+        for conf in configs:
+            st = os.stat(conf.path)
+            self.files[conf.path] = [st.st_size, st.st_mtime_ns, file_sha1(conf.path)]
+            i = columns.get(conf.path)
+            if i is None:
+                matrix.add_column(conf.path, list(conf.items()))
+            else:
+                matrix.set_column(i, list(conf.items()))
+
+        # Files that cannot be parsed are removed from the state so that they are parsed again in the next run.
+        failed = set(os.path.abspath(path) for path, _ in configs.parse_errors)
+        matrix.remove_columns([i for i, p in enumerate(matrix.paths) if p in failed])
+        for path in failed:
+            self.files.pop(path, None)
+
+        return added, modified, removed, configs.parse_errors
+
+    def save(self):
+        """Write the state to file. Errors are ignored."""
+        data = dict(version=self.VERSION, abiconfig=release.__version__, options=self.signature,
+                    files=self.files, matrix=self.matrix.as_dict())
+        try:
+            write_atomic(self.filepath, json.dumps(data, separators=(",", ":")))
+        except (IOError, OSError):
+            pass
+
+    def print_changes(self, added, modified, removed):
+        """Print the files that changed and the effect on the coverage with respect to the previous run."""
+        if self.previous is None:
+            cprint("No previous coverage state found. All the files have been analyzed.", "yellow")
+            return
+
+        if not (added or modified or removed):
+            cprint("No configuration file changed since the last run.", "green")
+            return
+
+        for title, paths in (("Added", added), ("Modified", modified), ("Removed", removed)):
+            for path in paths:
+                cprint("%s: %s" % (title, path), "blue")
+
+        lines = self.matrix.diff(self.previous)
+        if not lines:
+            cprint("Coverage did not change.", "green")
+        for line in lines:
+            cprint(line, "red" if "lost" in line else "green")
+        print(90 * "-")
@@ -0,0 +1,217 @@
+"""
+Inverted index over a list of configuration files.
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+
+import os
+import json
+
+from collections import defaultdict
+from abiconfig.core.cache import file_sha1, write_atomic
+
+
+def get_clusters_dir():
+    """Absolute path of the abiconfig clusters directory."""
+    return os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "clusters"))
+
+
+def optval_key(name, value):
+    """Key used to index the option `name` with value `value`."""
+    return "%s=%s" % (name, value)
+
+
+class ConfigIndex(object):
+    """
+    Inverted index built from a ConfigList. Configurations are identified
+    by their position in the list and the index stores the following mappings:
+
+        basenames: basename --> position
+        hostnames: hostname --> sorted list of positions
+        keywords: keyword --> sorted list of positions (posting list)
+        optnames: option name --> sorted list of positions
+        optvals: "option=value" --> sorted list of positions
+
+    The index can be written to file (see write) and shipped with the .ac files
+    so that the lookups do not require parsing the configuration files.
+    """
+    # Name of the prebuilt index in the directory with the .ac files.
+    FILENAME = "index.json"
+
+    # Increase this number if the format of the json file or the parser changes.
+    VERSION = 3
+
+    def __init__(self, paths, metas, configs=None):
+        """
+        Args:
+            paths: List with the absolute paths of the .ac files.
+            metas: List of dictionaries with the metadata.
+            configs: ConfigList. None if the index has been read from file,
+                in this case the configurations are built on demand (see get_config).
+        """
+        self.paths = paths
+        self.metas = metas
+        self._configs = [None] * len(paths) if configs is None else configs
+        self.basenames = {}
+        self.hostnames = defaultdict(list)
+        self.keywords = defaultdict(list)
+        self._optnames, self._optvals = None, None
+        self._stats = None
+
+        for i, (path, meta) in enumerate(zip(paths, metas)):
+            self.basenames.setdefault(os.path.basename(path), i)
+            self.hostnames[meta["hostname"]].append(i)
+            for key in set(meta["keywords"]):
+                self.keywords[key].append(i)
+
+    @classmethod
+    def from_configs(cls, configs):
+        """Build the index from a ConfigList."""
+        return cls([c.path for c in configs], [c.meta for c in configs], configs=configs)
+
+    @classmethod
+    def get_clusters(cls, use_cache=True):
+        """Index for the configuration files in the abiconfig clusters directory."""
+        return cls.from_dir(get_clusters_dir(), use_cache=use_cache)
+
+    @classmethod
+    def from_dir(cls, top, use_cache=True):
+        """
+        Return the index for the .ac files located inside directory top.
+        Use the prebuilt index if present and up-to-date, else parse the files.
+        """
+        filepath = os.path.join(top, cls.FILENAME)
+        if os.path.exists(filepath):
+            try:
+                new = cls.from_file(filepath)
+                if new.is_uptodate(top): return new
+            except (ValueError, KeyError):
+                pass
+
+        from abiconfig.core.options import ConfigList
+        return cls.from_configs(ConfigList.from_dir(top, use_cache=use_cache, lazy=True))
+
+    @classmethod
+    def from_file(cls, filepath):
+        """Read the index from the json file produced by write."""
+        with open(filepath, "rt") as fh:
+            data = json.load(fh)
+        if data.get("version") != cls.VERSION:
+            raise ValueError("Wrong version in index file: %s" % filepath)
+
+        top = os.path.dirname(os.path.abspath(filepath))
+        files = data["files"]
+        new = cls([os.path.join(top, f["path"]) for f in files], [f["meta"] for f in files])
+        new._stats = [(f["size"], f["mtime"], f["sha1"]) for f in files]
+        new._optnames, new._optvals = data["optnames"], data["optvals"]
+        return new
+
+    def write(self, filepath):
+        """
+        Write the index to filepath in json format.
+        Paths are stored relative to the directory of filepath.
+        """
+        top = os.path.dirname(os.path.abspath(filepath))
+        files = []
+        for path, meta in zip(self.paths, self.metas):
+            st = os.stat(path)
+            files.append(dict(path=os.path.relpath(path, top), size=st.st_size, mtime=st.st_mtime_ns,
+                              sha1=file_sha1(path), meta=dict(meta)))
+
+        data = {"version": self.VERSION, "files": files, "optnames": self.optnames, "optvals": self.optvals}
+        write_atomic(filepath, json.dumps(data, indent=1))
+
+    def is_uptodate(self, top):
+        """
+        True if the index read from file is consistent with the .ac files in directory top.
+        The hash of the file is computed only if the modification time changed.
+        """
+        if self._stats is None: return True
+        from abiconfig.core.options import ConfigList
+        paths = ConfigList._find_acfiles(top)
+        if sorted(os.path.abspath(p) for p in paths) != sorted(os.path.abspath(p) for p in self.paths):
+            return False
+
+        for path, (size, mtime, sha1) in zip(self.paths, self._stats):
+            st = os.stat(path)
+            if st.st_size != size: return False
+            if st.st_mtime_ns != mtime and file_sha1(path) != sha1: return False
+
+        return True
+
+    def __len__(self):
+        return len(self.paths)
+
+    def get_config(self, i):
+        """Return the Config at position i."""
+        conf = self._configs[i]
+        if conf is None:
+            from abiconfig.core.options import Config
+            conf = self._configs[i] = Config.from_meta(self.paths[i], self.metas[i])
+        return conf
+
+    @property
+    def configs(self):
+        """List with all the configurations."""
+        return [self.get_config(i) for i in range(len(self))]
+
+    @property
+    def optnames(self):
+        """Mapping option name --> sorted list of positions."""
+        if self._optnames is None: self._build_optmaps()
+        return self._optnames
+
+    @property
+    def optvals(self):
+        """Mapping "option=value" --> sorted list of positions."""
+        if self._optvals is None: self._build_optmaps()
+        return self._optvals
+
+    def _build_optmaps(self):
+        # Done on first access since the options of all the configurations are needed.
+        optnames, optvals = defaultdict(list), defaultdict(list)
+        for i in range(len(self)):
+            for name, value in self.get_config(i).items():
+                optnames[name].append(i)
+                optvals[optval_key(name, value)].append(i)
+        self._optnames, self._optvals = dict(optnames), dict(optvals)
+
+    def find_basename(self, basename):
+        """Return the Config with the given basename (or absolute path). None if not found."""
+        i = self.basenames.get(basename)
+        if i is None:
+            if basename not in self.paths: return None
+            i = self.paths.index(basename)
+        return self.get_config(i)
+
+    def find_hostname(self, hostname):
+        """
+        Return list of configurations whose hostname contains the string `hostname`.
+        """
+        positions = self.hostnames.get(hostname, [])
+        others = [h for h in self.hostnames if h != hostname and hostname in h]
+        if others:
+            positions = sorted(set(positions).union(*[self.hostnames[h] for h in others]))
+        return [self.get_config(i) for i in positions]
+
+    def find_keywords(self, keys):
+        """Return list of configurations containing all the keywords in `keys`."""
+        return self._intersect([self.keywords.get(k, []) for k in set(keys)])
+
+    def find_options(self, optvals):
+        """
+        Return list of configurations with the given options.
+        optvals is a list of strings in the form "option=value" or "option".
+        In the second case, any value is accepted.
+        """
+        postings = [self.optvals.get(ov, []) if "=" in ov else self.optnames.get(ov, []) for ov in optvals]
+        return self._intersect(postings)
+
+    def _intersect(self, postings):
+        """Intersect posting lists starting from the shortest one. Return list of configurations."""
+        postings = sorted(postings, key=len)
+        if not postings or not postings[0]: return []
+        positions = set(postings[0])
+        for plist in postings[1:]:
+            positions.intersection_update(plist)
+            if not positions: return []
+        return [self.get_config(i) for i in sorted(positions)]
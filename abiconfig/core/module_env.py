@@ -0,0 +1,134 @@
+"""
+Cache of the environment produced by the `pre_configure` commands (e.g. `module load`).
+The commands are executed once, the environment variables that have been changed are
+written to a shell file that is sourced by the generated scripts instead of calling `module load`.
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+
+import os
+import json
+import hashlib
+
+# Variables that are not part of the environment produced by the commands.
+IGNORED_VARS = ("PWD", "OLDPWD", "SHLVL", "_")
+
+
+def parse_env(data):
+    """Parse the output of `env -0`. Return dictionary name --> value."""
+    env = {}
+    for item in data.split("\0"):
+        name, sep, value = item.partition("=")
+        if sep: env[name] = value
+    return env
+
+
+def diff_env(before, after):
+    """
+    Return (changed, removed) where changed is a dictionary with the variables
+    that have been set or modified and removed the list of the variables that have been unset.
+    Exported shell functions (BASH_FUNC_*) and invalid shell identifiers are ignored.
+    """
+    def keep(name):
+        return (name not in IGNORED_VARS and not name.startswith("BASH_FUNC_") and
+                name.replace("_", "a").isalnum() and not name[0].isdigit())
+
+    changed = dict((k, v) for k, v in after.items() if keep(k) and before.get(k) != v)
+    removed = sorted(k for k in before if keep(k) and k not in after)
+    return changed, removed
+
+
+class ModuleEnvironment(object):
+    """
+    Execute the `pre_configure` commands of a configuration once and cache the resulting environment
+    in `<cache_dir>/env_<sha1 of the commands>.sh`.
+    """
+
+    def __init__(self, cache_dir=None, refresh=False):
+        """
+        Args:
+            cache_dir: Directory with the environment files. Default: ~/.abiconf/module_env.
+            refresh: True if the environment should be captured again even if the file exists
+                (e.g. after an update of the module tree).
+        """
+        from abiconfig.core.cache import get_cache_dir
+        self.cache_dir = os.path.abspath(cache_dir if cache_dir is not None else
+                                         os.path.join(get_cache_dir(), "module_env"))
+        self.refresh = refresh
+        self._captured = set()
+
+    def __repr__(self):
+        return "<%s: cache_dir=%s>" % (self.__class__.__name__, self.cache_dir)
+
+    @staticmethod
+    def get_key(commands):
+        """Hash of the list of commands."""
+        return hashlib.sha1(json.dumps(list(commands)).encode("utf-8")).hexdigest()
+
+    def get_path(self, commands):
+        """Path of the environment file associated to commands."""
+        return os.path.join(self.cache_dir, "env_%s.sh" % self.get_key(commands))
+
+    def capture(self, commands):
+        """
+        Execute commands in bash and write the environment file. Return its path.
+        Raise RuntimeError if one of the commands fails.
+        """
+        import shlex
+        import shutil
+        import tempfile
+        import subprocess
+        from abiconfig.core.cache import write_atomic
+
+        tmpdir = tempfile.mkdtemp(prefix="abiconf_env_")
+        before, after = os.path.join(tmpdir, "before"), os.path.join(tmpdir, "after")
+        lines = ['env -0 > "%s"' % before]
+        lines.extend("%s || exit $?" % cmd for cmd in commands)
+        lines.append('env -0 > "%s"' % after)
+        try:
+            p = subprocess.run(["bash", "-c", "\n".join(lines)], stdin=subprocess.DEVNULL,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            if p.returncode != 0:
+                raise RuntimeError("pre_configure commands returned %d:\n%s" % (
+                                   p.returncode, p.stderr.decode("utf-8", errors="replace")))
+            with open(before, "rb") as fh:
+                env_before = parse_env(fh.read().decode("utf-8", errors="replace"))
+            with open(after, "rb") as fh:
+                env_after = parse_env(fh.read().decode("utf-8", errors="replace"))
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+        changed, removed = diff_env(env_before, env_after)
+        out = ["# Environment produced by the commands:"]
+        out.extend("#     %s" % cmd for cmd in commands)
+        out.extend("unset %s" % name for name in removed)
+        out.extend("export %s=%s" % (name, shlex.quote(changed[name])) for name in sorted(changed))
+
+        path = self.get_path(commands)
+        write_atomic(path, "\n".join(out) + "\n")
+        self._captured.add(path)
+        return path
+
+    def get_env_file(self, commands):
+        """Return the path of the environment file for commands. Capture the environment if needed."""
+        path = self.get_path(commands)
+        if not os.path.exists(path) or (self.refresh and path not in self._captured):
+            return self.capture(commands)
+        return path
+
+    def get_source_lines(self, commands, suffix=""):
+        """
+        Shell commands sourcing the cached environment.
+        The original commands are executed if the file has been removed.
+
+        Args:
+            suffix: String added to each command (e.g. to record the exit status).
+        """
+        if not commands: return []
+        path = self.get_path(commands)
+        lines = ["# Cached environment (see abiconf.py workon --module-env)",
+                 "if [ -f %s ]; then" % path,
+                 "    source %s%s" % (path, suffix),
+                 "else"]
+        lines.extend("    %s%s" % (cmd, suffix) for cmd in commands)
+        lines.append("fi")
+        return lines
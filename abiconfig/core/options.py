@@ -4,13 +4,12 @@ import sys
 import os
 import re
 import json
-import itertools
 
-from collections import OrderedDict, defaultdict
-from pprint import pformat
+from collections import OrderedDict
 from datetime import datetime, date
 from abiconfig.core.utils import is_string, marquee, find_abinit_toptree
 from abiconfig.core.termcolor import cprint, colored
+from abiconfig.core.acparser import iter_ac_tokens
 
 
 def rmquotes(s):
@@ -112,6 +111,17 @@ class Option:
         if len(self.values) == 1 and self.values[0].startswith("@"):
             self.values = []
 
+    @classmethod
+    def from_dict(cls, d):
+        """Build the object from the dictionary returned by as_dict (no parser is needed)."""
+        new = cls.__new__(cls)
+        new.__dict__.update(d)
+        return new
+
+    def as_dict(self):
+        """Return dictionary with the attributes (JSON-serializable)."""
+        return dict(self.__dict__)
+
     def __repr__(self):
         return "<name=%s, default=%s, status=%s>" % (self.name, self.default, self.status)
 
@@ -135,21 +145,28 @@ class Option:
     #    return errors
 
 
-try:
-    import ConfigParser as configparser
-except ImportError:
-    # py3k
-    import configparser
+def get_myconfigparser():
+    """
+    Return MyConfigParser instance used to read options.conf.
+    configparser is imported here since the options are usually read from the snapshot
+    (see AbinitConfigureOptions.from_snapshot).
+    """
+    try:
+        import ConfigParser as configparser
+    except ImportError:
+        # py3k
+        import configparser
 
+    class MyConfigParser(configparser.ConfigParser):
 
-class MyConfigParser(configparser.ConfigParser):
+        def myget(self, section, option, default):
+            """Return default if option is not present in section."""
+            try:
+                return self.get(section, option)
+            except configparser.NoOptionError:
+                return default
 
-    def myget(self, section, option, default):
-        """Return default if option is not present in section."""
-        try:
-            return self.get(section, option)
-        except configparser.NoOptionError:
-            return default
+    return MyConfigParser()
 
 
 class AbinitConfigureOptions(OrderedDict):
@@ -158,17 +175,55 @@ class AbinitConfigureOptions(OrderedDict):
     Dictionary: option_name --> Option instance
     """
 
+    # Increase this number if the format of the snapshot changes.
+    SNAPSHOT_VERSION = 1
+
     @classmethod
-    def from_myoptions_conf(cls):
-        """Read configure options from my internal copy of options.conf"""
+    def from_myoptions_conf(cls, use_cache=True):
+        """
+        Read configure options from my internal copy of options.conf
+        If use_cache, the options are read from the snapshot stored in the abiconf cache directory.
+        """
         options_conf = os.path.join(os.path.dirname(__file__), "options.conf")
-        return cls.from_file(options_conf)
+        if not use_cache:
+            return cls.from_file(options_conf)
+        from abiconfig.core.cache import get_cache_dir
+        return cls.from_snapshot(options_conf, os.path.join(get_cache_dir(), "options_conf.json"))
+
+    @classmethod
+    def from_snapshot(cls, path, snapshot_path):
+        """
+        Build the object from the JSON snapshot of the options.conf file `path`.
+        The snapshot stores the hash of options.conf and it is regenerated if the file changed.
+        """
+        from abiconfig.core.cache import file_sha1, write_atomic
+        sha1 = file_sha1(path)
+        try:
+            with open(snapshot_path, "rt") as fh:
+                data = json.load(fh)
+            if data["version"] == cls.SNAPSHOT_VERSION and data["sha1"] == sha1:
+                new = cls()
+                for d in data["options"]:
+                    new[d["name"]] = Option.from_dict(d)
+                return new
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+
+        # Parse options.conf and write new snapshot. Errors are ignored since this is just an optimization.
+        new = cls.from_file(path)
+        data = {"version": cls.SNAPSHOT_VERSION, "sha1": sha1, "options": [opt.as_dict() for opt in new.values()]}
+        try:
+            write_atomic(snapshot_path, json.dumps(data, separators=(",", ":")))
+        except (IOError, OSError):
+            pass
+
+        return new
 
     @classmethod
     def from_file(cls, path):
         """Build the object from the options.conf file."""
         # Init INI parser
-        parser = MyConfigParser()
+        parser = get_myconfigparser()
         parser.read(path)
 
         new = cls()
@@ -214,6 +269,8 @@ class ConfigMeta(dict):
     post_make
     qtype
     qkwargs
+    runtests (optional): dictionary with the options of the runtests script:
+        ncores (cores of the node), mpi_procs, omp_threads (lists) and order ("largest" or "given").
     """
 
     reqkey_validator = [
@@ -293,6 +350,19 @@ class ConfigMeta(dict):
 
         return errors
 
+    def get_warnings(self):
+        """
+        Return list of warnings (strings) for entries that do not prevent the use of the file
+        e.g. qkwargs parameters not supported by the template of the qtype (with the closest matches).
+        """
+        qkwargs = self.get("qkwargs")
+        if self.get("qtype") is None or not isinstance(qkwargs, dict) or not qkwargs: return []
+        from .qtemplates import QueueTemplate
+        try:
+            return QueueTemplate.from_qtype(self["qtype"]).validate_qkwargs(qkwargs)
+        except ValueError as exc:
+            return [str(exc)]
+
 
 class Config(OrderedDict):
     """
@@ -307,59 +377,141 @@ class Config(OrderedDict):
 
         meta: dictionary with metadata (see ConfigMeta)
     """
+    def __init__(self, *args, **kwargs):
+        # False if only the metadata section has been read (see from_file with lazy=True)
+        self._loaded = True
+        super().__init__(*args, **kwargs)
+        self.path, self.basename = None, None
+        self.meta = {}
+        self._string = None
+
     @classmethod
-    def from_file(cls, path):
+    def from_file(cls, path, lazy=False):
         """
         Initialize the object from an .ac file.
+
+        Args:
+            path: Path to the .ac file.
+            lazy: If True, only the metadata section at the beginning of the file is read.
+                The options and the text of the file are loaded on first access.
         """
         path = os.path.abspath(path)
         new = cls()
         new.path = path
         new.basename = os.path.basename(path)
 
-        with open(path, "rt") as fh:
-            lines = fh.readlines()
-            new.string = "".join(lines)
-
-            # Read header with metadata.
-            inmeta, meta = 0, []
-            for line in lines:
-                if line.startswith("#---"): inmeta += 1
-                if inmeta == 2: break
-                if inmeta and not line.startswith("#---"):
-                    meta.append(line.replace("#", "", 1))
+        if not lazy:
+            new._loaded = False
+            new._load()
+        else:
+            # The tokenizer reads one line at a time so we stop reading at the second #--- marker.
+            with open(path, "rt") as fh:
+                for kind, lineno, data in iter_ac_tokens(fh, path=path):
+                    if kind == "meta":
+                        new._parse_meta_section(data)
+                        break
+            if not new.meta:
+                raise ValueError("Cannot find metadata section in file: %s" % path)
+            new._loaded = False
 
-            try:
-                new._parse_meta("".join(meta))
-            except Exception as exc:
-                # FIXME: This is to support config file with metadata (e.g. buildbot ac files)
-                #raise
-                print(f"Exception in {path}")
-                raise exc
-                print(exc)
-                new.meta = {}
-
-            # FIXME: Add support for
-            """
-            with_linalg_libs="-L${EBROOTIMKL}/mkl/lib/intel64 \
-                -Wl,--start-group -lmkl_intel_lp64 -lmkl_sequential -lmkl_core -Wl,--end-group -lpthread -lm"
-            """
-
-            for line in lines:
-                line = line.strip()
-                if line.startswith("#") or not line: continue
-                i = line.index("=")
-                name, value = line[:i], line[i+1:]
-                # Remove double quote from string.
-                # Call it twice to handle optname=""value""
-                for i in range(2): value = rmquotes(value)
-                new[name] = value
+        return new
 
+    @classmethod
+    def from_meta(cls, path, meta):
+        """
+        Build a lazy object from the path of the .ac file and the metadata
+        (e.g. stored in a ConfigIndex). The file is read on first access to the options.
+        """
+        new = cls()
+        new.path = os.path.abspath(path)
+        new.basename = os.path.basename(new.path)
+        new.meta = ConfigMeta(**meta)
+        new._loaded = False
         return new
 
+    def _load(self):
+        """
+        Parse the options (and the metadata if not already done) in a single pass over the file.
+        The text of the file is not stored, see the string property.
+        The options are parsed first and the object is filled at the end so that
+        a lazy object shared by several threads is never seen half-loaded.
+        """
+        has_meta = bool(self.meta)
+        items = []
+        with open(self.path, "rt") as fh:
+            for kind, lineno, data in iter_ac_tokens(fh, path=self.path):
+                if kind == "option":
+                    items.append(data)
+                elif not has_meta:
+                    self._parse_meta_section(data)
+                    has_meta = True
+
+        if not has_meta:
+            raise ValueError("Cannot find metadata section in file: %s" % self.path)
+
+        # Another thread may have completed the loading in the meantime.
+        if self._loaded: return
+        for key, value in items:
+            OrderedDict.__setitem__(self, key, value)
+        self._loaded = True
+
+    def _parse_meta_section(self, s):
+        """Parse the string with the metadata section."""
+        try:
+            self._parse_meta(s)
+        except Exception as exc:
+            # FIXME: This is to support config file with metadata (e.g. buildbot ac files)
+            #raise
+            print(f"Exception in {self.path}")
+            raise exc
+            print(exc)
+            self.meta = {}
+
+    # Mapping methods trigger the parsing of the options if lazy initialization.
+
+    def __getitem__(self, key):
+        if not self._loaded: self._load()
+        return super().__getitem__(key)
+
+    def __contains__(self, key):
+        if not self._loaded: self._load()
+        return super().__contains__(key)
+
+    def __iter__(self):
+        if not self._loaded: self._load()
+        return super().__iter__()
+
+    def __len__(self):
+        if not self._loaded: self._load()
+        return super().__len__()
+
+    def get(self, key, default=None):
+        if not self._loaded: self._load()
+        return super().get(key, default)
+
+    def keys(self):
+        if not self._loaded: self._load()
+        return super().keys()
+
+    def values(self):
+        if not self._loaded: self._load()
+        return super().values()
+
+    def items(self):
+        if not self._loaded: self._load()
+        return super().items()
+
     def __repr__(self):
         return "<%s: %s>" % (self.__class__.__name__, self.path)
 
+    @property
+    def string(self):
+        """String with the content of the .ac file. Read from disk if not already loaded."""
+        if self._string is None:
+            with open(self.path, "rt") as fh:
+                self._string = fh.read()
+        return self._string
+
     def __str__(self):
         return self.string
 
@@ -390,19 +542,25 @@ class Config(OrderedDict):
         if errors:
             raise ValueError("Wrong metadata section in file: %s\n%s" % (self.path, "\n".join(errors)))
 
-    def get_script_str(self, with_abinit=True):
+    def get_script_str(self, with_abinit=True, module_env=None, qkwargs=None):
         """
         Return string with submission script template.
 
         Args:
             with_abinit: True if script should contain section invoking abinit.
+            module_env: ModuleEnvironment. If not None, the cached environment is sourced
+                instead of executing the pre_configure commands.
+            qkwargs: Dictionary with the parameters of the resource manager.
+                Added to (and overriding) the qkwargs of the metadata.
         """
         from .qtemplates import QueueTemplate
         qtype = self.meta.get("qtype")
         if qtype is None: return "!#/bin/bash"
         template = QueueTemplate.from_qtype(qtype)
         #print(template.supported_qparams)
-        lines = template.substitute(self.meta.get("qkwargs", {})).splitlines()
+        params = dict(self.meta.get("qkwargs", {}))
+        if qkwargs: params.update(qkwargs)
+        lines = template.substitute(params).splitlines()
         app = lines.append
 
         # Stask size
@@ -417,8 +575,11 @@ class Config(OrderedDict):
         app("\n")
 
         # Load modules.
-        for l in self.meta.get("pre_configure", []):
-            app(l)
+        if module_env is not None:
+            lines.extend(module_env.get_source_lines(self.meta.get("pre_configure", [])))
+        else:
+            for l in self.meta.get("pre_configure", []):
+                app(l)
 
         # Abinit section
         #if with_abinit:
@@ -428,28 +589,32 @@ class Config(OrderedDict):
         app(" ")
         return "\n".join(lines)
 
-    def get_runtests_script_str(self):
+    def get_runtests_script_str(self, module_env=None, ncores=None, mpi_procs=None, omp_threads=None, order=None):
         """
         Return string with submission script to execute
         the Abinit test suite with runtests.py
-        """
-        lines = self.get_script_str(with_abinit=False).splitlines()
-        app = lines.append
-
-        mpiprocs_list = [1, 2, 4, 8, 10]
-        ompthreads_list = [1, 2]
+        The MPI x OpenMP combinations are packed into waves of concurrent runs that fit the node.
+        The default values of the arguments are taken from the `runtests` dictionary of the metadata.
 
-        app("# Runtests section")
-        app("RUNTESTS='../../tests/runtests.py'")
+        Args:
+            module_env: ModuleEnvironment (see get_script_str).
+            ncores: Number of cores of the node. Default: metadata or the cores of the largest combination.
+                In the latter case, the smaller combinations are still packed into concurrent waves
+                that fit in these cores (pass ncores=1 to execute the combinations one after the other).
+            mpi_procs, omp_threads: List of MPI processes and OpenMP threads.
+            order: Ordering of the combinations: "largest" (default) or "given".
+        """
+        from abiconfig.core.runtests import get_runtests_lines, MPI_PROCS, OMP_THREADS
+        lines = self.get_script_str(with_abinit=False, module_env=module_env).splitlines()
 
-        for mpi_nprocs, omp_nthreads in itertools.product(mpiprocs_list, ompthreads_list):
-            stdout = "runtests_MPI%s_OMP%s.stdout" % (mpi_nprocs, omp_nthreads)
-            stderr = "runtests_MPI%s_OMP%s.stderr" % (mpi_nprocs, omp_nthreads)
-            cmd = "$RUNTESTS -n{} -o{} -j1 > {} 2> {}".format(
-                mpi_nprocs, omp_nthreads, stdout, stderr)
-            app(cmd)
+        opts = self.meta.get("runtests", {})
+        mpi_procs = mpi_procs or opts.get("mpi_procs", MPI_PROCS)
+        omp_threads = omp_threads or opts.get("omp_threads", OMP_THREADS)
+        order = order or opts.get("order", "largest")
+        ncores = ncores or opts.get("ncores", max(mpi_procs) * max(omp_threads))
+        lines.extend(get_runtests_lines(ncores, mpi_procs=mpi_procs, omp_threads=omp_threads, order=order))
 
-        app(" ")
+        lines.append(" ")
         return "\n".join(lines)
 
 
@@ -457,19 +622,28 @@ class ConfigList(list):
     """
     List of Config object. It's usually initialized from a directory containing .ac files.
     """
+    # Pool used to parse the files in parallel: "thread" or "process".
+    # Threads are fine if the cost is dominated by the latency of the (network) filesystem.
+    parallel_executor = "thread"
+
     @classmethod
-    def get_clusters(cls):
+    def get_clusters(cls, use_cache=True, lazy=False):
         """
         Parse the configuration files found in the abiconfig clusters directory.
         """
-        return cls.from_mydirs(["clusters"])
+        return cls.from_mydirs(["clusters"], use_cache=use_cache, lazy=lazy)
 
     @classmethod
-    def get_buildbot_configs(cls, start_path="."):
+    def get_buildbot_dir(cls, start_path="."):
+        """Directory with the buildbot .ac files in the Abinit source tree containing start_path."""
         abinit_top = find_abinit_toptree(start_path=start_path)
-        bbconfig_dir = os.path.join(abinit_top, "doc", "build", "config-examples")
+        return os.path.join(abinit_top, "doc", "build", "config-examples")
+
+    @classmethod
+    def get_buildbot_configs(cls, start_path=".", use_cache=True, lazy=False, nprocs=1):
+        bbconfig_dir = cls.get_buildbot_dir(start_path=start_path)
         cprint("Looking for buildbot AC files in %s" % bbconfig_dir, "yellow")
-        return cls.from_dir(bbconfig_dir)
+        return cls.from_dir(bbconfig_dir, use_cache=use_cache, lazy=lazy, nprocs=nprocs)
 
     @classmethod
     def get_config_from_name(cls, acname):
@@ -479,125 +653,134 @@ class ConfigList(list):
         raise ValueError("Cannot find %s in internal list.")
 
     @classmethod
-    def from_mydirs(cls, dir_basenames):
+    def from_mydirs(cls, dir_basenames, use_cache=True, lazy=False, nprocs=1):
         """
         Initialize ConfiList from abiconf directories.
 
         Args:
             dir_basenames: List with directory basenames e.g. ["clusters"]
+            use_cache: False to bypass the on-disk cache with the parsed files.
+            lazy: True if only the metadata section should be read (see Config.from_file).
+                Ignored for the files found in the cache as the options are already available.
+            nprocs: Number of workers used to parse the files. None to use all the CPUs.
+                If != 1, the files are parsed in parallel and the exceptions
+                are stored in `parse_errors` instead of being raised (see print_parse_errors).
         """
         root = os.path.join(os.path.dirname(__file__), "..")
 
-        new = ConfigList()
+        paths = []
         for d in dir_basenames:
-            dirpath = os.path.join(root, d)
-            new.extend(cls.from_dir(dirpath))
-        return new
+            paths.extend(cls._find_acfiles(os.path.join(root, d)))
+        return cls._from_paths(paths, use_cache, lazy, nprocs)
 
     @classmethod
-    def from_dir(cls, top):
-        """Parse all .ac files starting located inside directory top."""
-        new = cls()
+    def from_dir(cls, top, use_cache=True, lazy=False, nprocs=1):
+        """
+        Parse all .ac files starting located inside directory top.
+        See from_mydirs for the meaning of the other arguments.
+        """
+        return cls._from_paths(cls._find_acfiles(top), use_cache, lazy, nprocs)
+
+    @classmethod
+    def from_files(cls, files, use_cache=True, lazy=False, nprocs=1):
+        return cls._from_paths([f for f in files if f.endswith(".ac")], use_cache, lazy, nprocs)
 
+    @staticmethod
+    def _find_acfiles(top):
+        """Return list with the .ac files located inside directory top (sorted by path)."""
+        paths = []
         for dirpath, dirnames, filenames in os.walk(top):
-            for f in filenames:
+            dirnames.sort()
+            for f in sorted(filenames):
                 if not f.endswith(".ac"): continue
-                path = os.path.join(dirpath, f)
+                paths.append(os.path.join(dirpath, f))
+        return paths
+
+    @classmethod
+    def _from_paths(cls, paths, use_cache, lazy, nprocs=1):
+        from abiconfig.core.cache import ConfigCache
+        cache = ConfigCache.from_file() if use_cache else None
+        if nprocs != 1:
+            return cls._from_paths_parallel(paths, cache, lazy, nprocs)
+
+        new = cls()
+        try:
+            for path in paths:
                 #print(path)
                 try:
-                    new.append(Config.from_file(path))
+                    if cache is None:
+                        new.append(Config.from_file(path, lazy=lazy))
+                    else:
+                        new.append(cache.get_config(path, lazy=lazy))
                 except Exception as exc:
                     cprint("Exception while parsing %s:\n%s" % (path, str(exc)), "red")
                     raise
+        finally:
+            # Entries for the files parsed so far are still valid.
+            if cache is not None: cache.save()
 
         return new
 
     @classmethod
-    def from_files(cls, files):
-        new = cls()
-        for f in files:
-            if not f.endswith(".ac"): continue
+    def _from_paths_parallel(cls, paths, cache, lazy, nprocs):
+        """
+        Parse the files with a pool of workers. The order of paths is preserved.
+        Files found in the cache are not submitted to the pool.
+        """
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+        from abiconfig.core.utils import get_ncpus
+        if nprocs is None: nprocs = get_ncpus()
+
+        configs, todo, errors = [None] * len(paths), [], {}
+        for i, path in enumerate(paths):
             try:
-                new.append(Config.from_file(f))
+                configs[i] = cache.lookup(path, lazy=lazy) if cache is not None else None
             except Exception as exc:
-                cprint("Exception while parsing %s:\n%s" % (f, str(exc)), "red")
-                raise
+                errors[i] = str(exc)
+                continue
+            if configs[i] is None: todo.append(i)
+
+        if todo:
+            pool_cls = {"thread": ThreadPoolExecutor, "process": ProcessPoolExecutor}[cls.parallel_executor]
+            with pool_cls(max_workers=max(1, min(nprocs, len(todo)))) as pool:
+                futures = [pool.submit(Config.from_file, paths[i], lazy=lazy) for i in todo]
+                for i, future in zip(todo, futures):
+                    try:
+                        configs[i] = future.result()
+                        if cache is not None: cache.store(configs[i])
+                    except Exception as exc:
+                        errors[i] = str(exc)
+
+        if cache is not None: cache.save()
+        new = cls(c for c in configs if c is not None)
+        new.parse_errors = [(paths[i], errors[i]) for i in sorted(errors)]
         return new
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # List of (path, error_message) filled when the files are parsed in parallel.
+        self.parse_errors = []
+
+    def print_parse_errors(self):
+        """Print the errors found while parsing the files. Return number of errors."""
+        for path, err in self.parse_errors:
+            cprint("Exception while parsing %s:\n%s" % (path, err), "red")
+        if self.parse_errors:
+            cprint("%d file(s) could not be parsed" % len(self.parse_errors), "red")
+        return len(self.parse_errors)
+
+    def get_coverage_matrix(self, options):
+        """Return CoverageMatrix with the options (and values) used in the configurations."""
+        from abiconfig.core.coverage import CoverageMatrix
+        return CoverageMatrix.from_configs(self, options)
+
     def buildbot_coverage(self, options, verbose=0):
-        # Init mapping option.name --> [(config0.path, value0), (config1.path, value1), ...]
-        # This dict is used to test if all the options are tested in the configuration files:
-        #       - empty list --> the option is never used.
-        #       - non-empty list --> the option is used in len(list) files.
-        #         An additional check on the values may be required at the end.
-        retcode = 0
-        optmap = {optname: [] for optname in options}
-
-        # Mapping: config.path --> list_of_errors
-        config_errors = defaultdict(list)
-
-        # Ignore these options.
-        builtin_opts = set(["CPP", "CC", "CFLAGS", "CXX", "FC", "FCFLAGS", "AR", "ARFLAGS_EXTRA",
-                            "MPI_RUNNER", "CFLAGS_EXTRA", "CXXFLAGS", "FCFLAGS_EXTRA", "RANLIB",
-                            "NM", "LD", "CPPFLAGS_EXTRA", "FC_LDFLAGS_EXTRA", "FPPFLAGS", "NVCC",
-                            "NVCC_CFLAGS", "CC_LIBS_EXTRA", "FC_LIBS_EXTRA",
-			    ])
-
-        for conf in self:
-            for name, value in conf.items():
-                if name in builtin_opts or name.startswith("fcflags_opt"): continue
-                if name not in options:
-                    config_errors[conf.path].append("Unknown option: %s" % name)
-                    retcode += 1
-                    continue
-                opt = options[name]
-                #if opt.status in ("dropped", "removed"):
-                #value_errors = opt.validate(value)
-                #if value_errors: config_errors[conf.path].extend(value_errors)
-                optmap[name].append((conf.path, value))
-
-        # Print errors detected in configuration files.
-        if config_errors:
-            retcode += 1
-            cprint("Found %d erroneous configuration files" % len(config_errors), "red")
-            for path, errors in config_errors.items():
-                cprint("In configuration file: %s" % path, "red")
-                for i, err in enumerate(errors):
-                    print("[%d] %s" % (i, err))
-                print(90 * "-")
-
-        # Print possible problems detected in optmap.
-        optval_usage = {}
-        for name, tuples in optmap.items():
-            #count[name] = len(tuples)
-            if not tuples:
-                retcode += 1
-                cprint("%s is never used" % name, "magenta")
-            else:
-                #print("%s is used in %s configuration files" % (name, len(tuples)))
-                opt = options[name]
-                if opt.values:
-		    # Test if all values are tested in the config file.
-                    optval_usage[name] = {v: [] for v in opt.values}
-                    #print(d[name])
-                    for path, val in tuples:
-                        if "+" not in val:
-                            optval_usage[name][val].append(path)
-                        else:
-			    # handle "mkl+magma" case
-                            for v in val.split("+"):
-                                optval_usage[name][v].append(path)
-
-        i = 0
-        for name, d in optval_usage.items():
-            if all(l for l in d.values()): continue
-            i += 1
-            if i == 1:
-                print(" ")
-                cprint("The following values are never used in the config files", "yellow")
-                retcode += 1
-            cprint("[%s]" % name, "yellow")
-            for k, l in d.items():
-                if not l: cprint(k, "yellow")
-
-        return retcode
+        """
+        Test if all the options (and their values) are used in the configuration files.
+        Print a report and return exit code (number of problems found).
+
+        Args:
+            options: AbinitConfigureOptions.
+            verbose: Verbosity level.
+        """
+        return self.get_coverage_matrix(options).print_report(verbose=verbose)
@@ -1,9 +1,18 @@
 """Template strings used to generate scripts for resource managers."""
 from __future__ import unicode_literals, division, print_function, absolute_import
 
+import re
 import string
 
+_PARAM_RE = re.compile(r"\$\$\{(\w+)\}")
+
+
 class QueueTemplate(string.Template):
+    """
+    Template for the header of a submission script. Parameters are specified with `$${name}`.
+    The template is parsed once per class into a table of lines: a line with parameters
+    (e.g. a directive) is rendered only if all its parameters are given, otherwise it is removed.
+    """
     delimiter = '$$'
 
     @classmethod
@@ -12,27 +21,64 @@ class QueueTemplate(string.Template):
             if c.QTYPE == qtype: return c(c.QTEMPLATE)
         raise ValueError("Cannot find QueueTemplate associated to qtype: %s" % qtype)
 
+    @classmethod
+    def _compile(cls):
+        """
+        Parse QTEMPLATE. Return list of (parts, params) where parts is the list of strings obtained
+        by splitting the line at the parameters (literal strings at even positions, parameter names at odd positions)
+        and params is the tuple with the names of the parameters of the line.
+        """
+        table = cls.__dict__.get("_table")
+        if table is None:
+            table = []
+            for line in cls.QTEMPLATE.splitlines():
+                parts = _PARAM_RE.split(line)
+                table.append((parts, tuple(parts[1::2])))
+            cls._table = table
+        return table
+
     @property
     def supported_qparams(self):
         """
-        Dictionary with the supported parameters that can be passed to the
+        List with the supported parameters that can be passed to the
         queue manager (obtained by parsing QTEMPLATE).
         """
-        import re
-        return re.findall("\$\$\{(\w+)\}", self.QTEMPLATE)
+        return [p for parts, params in self._compile() for p in params]
 
     def substitute(self, subs_dict):
-        # might contain unused parameters as leftover $$.
-        unclean_template = self.safe_substitute(subs_dict)
-        return unclean_template
-
-        # Remove lines with leftover $$.
-        clean_template = []
-        for line in unclean_template.split('\n'):
-            if '$$' not in line:
-                clean_template.append(line)
-
-        return '\n'.join(clean_template)
+        """
+        Return string with the template in which the parameters are replaced by the values in subs_dict.
+        Lines with parameters that are not in subs_dict (or whose value is None or empty) are removed.
+        """
+        lines = []
+        for parts, params in self._compile():
+            if not params:
+                lines.append(parts[0])
+                continue
+            values = [subs_dict.get(p) for p in params]
+            if any(v is None or v == "" for v in values): continue
+            parts = list(parts)
+            parts[1::2] = [str(v) for v in values]
+            lines.append("".join(parts))
+
+        return "\n".join(lines) + "\n"
+
+    def validate_qkwargs(self, qkwargs):
+        """
+        Return list of strings with the problems found in the parameters qkwargs
+        (parameters not supported by the template with the closest matches).
+        The unsupported parameters are ignored by substitute.
+        """
+        import difflib
+        supported = self.supported_qparams
+        errors = []
+        for key in qkwargs:
+            if key in supported: continue
+            msg = "Unknown %s parameter: %s." % (self.QTYPE, key)
+            matches = difflib.get_close_matches(key, supported, n=3)
+            if matches: msg += " Did you mean: %s?" % ", ".join(matches)
+            errors.append(msg)
+        return errors
 
 
 class ShellTemplate(QueueTemplate):
@@ -0,0 +1,204 @@
+"""
+Probe the resources available to the process (CPU affinity, cgroup limits, memory)
+to compute the number of make jobs used by `abiconf.py workon -j auto`.
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+
+import os
+import math
+
+# Default estimate of the memory used by a compilation job in GB.
+# The big Fortran modules of Abinit may require more than 1 GB with optimization.
+DEFAULT_MEM_PER_JOB = 2.0
+
+_GB = 1024 ** 3
+
+
+def _read(path):
+    """Return the content of the file stripped. None if the file cannot be read."""
+    try:
+        with open(path, "rt") as fh:
+            return fh.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def _read_int(path):
+    """Return the integer in file path. None if not available or the limit is `max`."""
+    s = _read(path)
+    try:
+        return int(s)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_meminfo(lines):
+    """Return dictionary key --> bytes from the lines of /proc/meminfo."""
+    info = {}
+    for line in lines:
+        key, sep, value = line.partition(":")
+        tokens = value.split()
+        if not sep or not tokens: continue
+        try:
+            info[key.strip()] = int(tokens[0]) * (1024 if tokens[1:] == ["kB"] else 1)
+        except ValueError:
+            continue
+    return info
+
+
+def parse_proc_cgroup(lines):
+    """
+    Parse /proc/self/cgroup. Return dictionary controller --> path.
+    The path of the unified hierarchy (cgroup v2) is stored with key "".
+    """
+    d = {}
+    for line in lines:
+        tokens = line.strip().split(":", 2)
+        if len(tokens) != 3: continue
+        if tokens[0] == "0" and not tokens[1]:
+            d[""] = tokens[2]
+        else:
+            for controller in tokens[1].split(","):
+                d[controller] = tokens[2]
+    return d
+
+
+class Resources(object):
+    """
+    Resources available to the process. Attributes:
+
+        ncpus_online: Number of CPUs of the machine.
+        affinity: Number of CPUs in the affinity mask (e.g. taskset, SLURM allocation). None if not available.
+        cgroup_cpus: CPU quota of the cgroup in units of CPUs (can be fractional). None if no limit.
+        mem_available: MemAvailable from /proc/meminfo in bytes. None if not available.
+        cgroup_mem_available: Memory limit of the cgroup minus current usage in bytes. None if no limit.
+    """
+
+    def __init__(self, ncpus_online, affinity=None, cgroup_cpus=None, mem_available=None, cgroup_mem_available=None):
+        self.ncpus_online = ncpus_online
+        self.affinity = affinity
+        self.cgroup_cpus = cgroup_cpus
+        self.mem_available = mem_available
+        self.cgroup_mem_available = cgroup_mem_available
+
+    @classmethod
+    def probe(cls, root="/"):
+        """
+        Build the object from the affinity of the process and the files in /proc and /sys/fs/cgroup.
+
+        Args:
+            root: Root of the filesystem (used for testing).
+        """
+        from abiconfig.core.utils import get_ncpus
+        try:
+            affinity = len(os.sched_getaffinity(0))
+        except (AttributeError, OSError):
+            affinity = None
+
+        proc = os.path.join(root, "proc")
+        lines = (_read(os.path.join(proc, "meminfo")) or "").splitlines()
+        mem_available = parse_meminfo(lines).get("MemAvailable")
+
+        cgroups = parse_proc_cgroup((_read(os.path.join(proc, "self", "cgroup")) or "").splitlines())
+        cgroup_cpus, cgroup_mem = None, None
+        for path in cls._iter_cgroup_dirs(os.path.join(root, "sys", "fs", "cgroup"), cgroups):
+            cpus, mem = cls._read_cgroup_limits(path)
+            if cpus is not None: cgroup_cpus = cpus if cgroup_cpus is None else min(cpus, cgroup_cpus)
+            if mem is not None: cgroup_mem = mem if cgroup_mem is None else min(mem, cgroup_mem)
+
+        return cls(get_ncpus(), affinity=affinity, cgroup_cpus=cgroup_cpus,
+                   mem_available=mem_available, cgroup_mem_available=cgroup_mem)
+
+    @staticmethod
+    def _iter_cgroup_dirs(mount, cgroups):
+        """
+        Yield the directories of the cgroup hierarchy (from the cgroup of the process up to the mount point).
+        In containers the cgroup of the process is usually mounted as the root of the hierarchy.
+        """
+        candidates = []
+        if "" in cgroups:
+            candidates.append((mount, cgroups[""]))
+        for controller in ("cpu", "memory"):
+            if controller not in cgroups: continue
+            for name in os.listdir(mount) if os.path.isdir(mount) else []:
+                if controller in name.split(","):
+                    candidates.append((os.path.join(mount, name), cgroups[controller]))
+
+        seen = set()
+        for top, path in candidates:
+            path = path.strip("/")
+            while True:
+                d = os.path.join(top, path) if path else top
+                if os.path.isdir(d) and d not in seen:
+                    seen.add(d)
+                    yield d
+                if not path: break
+                path = os.path.dirname(path)
+
+    @staticmethod
+    def _read_cgroup_limits(path):
+        """Return (cpus, available_memory) from the files of the cgroup in path. None if no limit."""
+        cpus, mem = None, None
+        # cgroup v2
+        cpu_max = _read(os.path.join(path, "cpu.max"))
+        if cpu_max is not None:
+            tokens = cpu_max.split()
+            if tokens and tokens[0] != "max":
+                cpus = int(tokens[0]) / int(tokens[1] if len(tokens) > 1 else 100000)
+        limit = _read_int(os.path.join(path, "memory.max"))
+        if limit is not None:
+            mem = limit - (_read_int(os.path.join(path, "memory.current")) or 0)
+
+        # cgroup v1
+        quota = _read_int(os.path.join(path, "cpu.cfs_quota_us"))
+        period = _read_int(os.path.join(path, "cpu.cfs_period_us"))
+        if quota is not None and quota > 0 and period:
+            cpus = quota / period
+        limit = _read_int(os.path.join(path, "memory.limit_in_bytes"))
+        # v1 reports a huge number (page counter max) if there is no limit.
+        if limit is not None and limit < 2 ** 60:
+            mem = limit - (_read_int(os.path.join(path, "memory.usage_in_bytes")) or 0)
+
+        return cpus, mem
+
+    @property
+    def ncpus(self):
+        """Number of CPUs that can be used by the process."""
+        ncpus = self.affinity if self.affinity is not None else self.ncpus_online
+        if self.cgroup_cpus is not None:
+            # Round up fractional quotas (e.g. 1.5 CPUs) but never go below one.
+            ncpus = min(ncpus, max(1, int(math.ceil(self.cgroup_cpus))))
+        return ncpus
+
+    @property
+    def mem(self):
+        """Available memory in bytes. None if unknown."""
+        values = [m for m in (self.mem_available, self.cgroup_mem_available) if m is not None]
+        return max(0, min(values)) if values else None
+
+    def get_jobs(self, mem_per_job=DEFAULT_MEM_PER_JOB):
+        """
+        Return the number of make jobs that can be executed without oversubscribing
+        the CPUs and the memory.
+
+        Args:
+            mem_per_job: Estimate of the memory used by a compilation job in GB.
+        """
+        jobs = self.ncpus
+        if self.mem is not None and mem_per_job > 0:
+            jobs = min(jobs, int(self.mem // (mem_per_job * _GB)))
+        return max(1, jobs)
+
+    def to_string(self, mem_per_job=DEFAULT_MEM_PER_JOB):
+        """String with the resources and the number of jobs."""
+        def fmt_mem(m):
+            return "%.1f GB" % (m / _GB) if m is not None else "unknown"
+
+        return ("ncpus: %d (online: %d, affinity: %s, cgroup quota: %s), available memory: %s, "
+                "jobs: %d (%.1f GB per job)" % (
+                self.ncpus, self.ncpus_online, self.affinity,
+                "%.1f" % self.cgroup_cpus if self.cgroup_cpus is not None else "none",
+                fmt_mem(self.mem), self.get_jobs(mem_per_job), mem_per_job))
+
+    def __str__(self):
+        return self.to_string()
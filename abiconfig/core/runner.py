@@ -0,0 +1,150 @@
+"""
+Execution of external commands with the output streamed to log files and to the terminal.
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+
+import sys
+import os
+import time
+import signal
+import threading
+import subprocess
+
+# Lock used to avoid mixing lines written to the terminal by different processes.
+_TERMINAL_LOCK = threading.Lock()
+
+
+class Process(object):
+    """
+    Wrapper around subprocess.Popen. stdout and stderr are read line by line by two threads
+    so that the pipes never fill up, each line is written to the log file and (optionally) to the terminal.
+    The command is executed in a new process group so that cancel kills the children
+    (e.g. the compilers started by make) as well.
+
+    Example:
+
+        p = Process(["bash", "script.sh"], cwd=workdir, stdout_path="out.log", stderr_path="err.log")
+        retcode = p.run(timeout=3600)
+    """
+
+    def __init__(self, args, cwd=None, env=None, stdout_path=None, stderr_path=None, echo=True, prefix=""):
+        """
+        Args:
+            args: List with the command and its arguments.
+            cwd: Working directory of the process. The working directory of the caller is not changed.
+            env: Environment. None to inherit the environment of the caller.
+            stdout_path, stderr_path: Log files for stdout and stderr. None if not needed.
+            echo: True if the output should be shown in the terminal.
+            prefix: String added at the beginning of the lines shown in the terminal.
+        """
+        self.args, self.cwd, self.env = args, cwd, env
+        self.stdout_path, self.stderr_path = stdout_path, stderr_path
+        self.echo, self.prefix = echo, prefix
+        self.popen = None
+        self.returncode = None
+        self.timed_out = False
+        self.cancelled = False
+        self.deadline = None
+        self._threads = []
+
+    def __repr__(self):
+        return "<%s: %s, returncode=%s>" % (self.__class__.__name__, " ".join(self.args), self.returncode)
+
+    def start(self, timeout=None):
+        """
+        Start the process and the threads reading the output.
+
+        Args:
+            timeout: The process is killed if it runs for more than timeout seconds (see poll).
+        """
+        self.popen = subprocess.Popen(self.args, cwd=self.cwd, env=self.env, stdin=subprocess.DEVNULL,
+                                      stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+        if timeout is not None: self.deadline = time.time() + timeout
+
+        for pipe, path, stream in ((self.popen.stdout, self.stdout_path, sys.stdout),
+                                   (self.popen.stderr, self.stderr_path, sys.stderr)):
+            thread = threading.Thread(target=self._pump, args=(pipe, path, stream if self.echo else None))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+        return self
+
+    def _pump(self, pipe, path, stream):
+        """Copy the lines read from pipe to the file path and to stream."""
+        fh = open(path, "wb") if path is not None else None
+        try:
+            for line in iter(pipe.readline, b""):
+                if fh is not None:
+                    fh.write(line)
+                    fh.flush()
+                if stream is not None:
+                    text = line.decode("utf-8", errors="replace")
+                    with _TERMINAL_LOCK:
+                        stream.write(self.prefix + text)
+                        stream.flush()
+        finally:
+            pipe.close()
+            if fh is not None: fh.close()
+
+    def poll(self):
+        """
+        Return the exit status of the process or None if it is still running.
+        The process is cancelled if the deadline has been reached.
+        """
+        if self.returncode is not None or self.popen is None: return self.returncode
+        if self.popen.poll() is None:
+            if self.deadline is not None and time.time() > self.deadline:
+                self.timed_out = True
+                self.cancel()
+            else:
+                return None
+
+        return self._finalize()
+
+    def _finalize(self):
+        """Wait for the reader threads and set the exit status."""
+        # Background processes started by the command may keep the pipes open
+        # so we don't wait forever for the threads (they are daemons).
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self.returncode = exit_status(self.popen.returncode)
+        return self.returncode
+
+    def wait(self, poll_interval=0.1):
+        """Wait for the process (taking into account the deadline). Return exit status."""
+        while self.poll() is None:
+            time.sleep(poll_interval)
+        return self.returncode
+
+    def run(self, timeout=None):
+        """Start the process and wait for it. Return exit status."""
+        return self.start(timeout=timeout).wait()
+
+    def cancel(self, grace=5.0):
+        """
+        Send SIGTERM to the process group, SIGKILL if the processes are still alive after grace seconds.
+        """
+        if self.popen is None or self.popen.poll() is not None: return
+        self.cancelled = True
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            try:
+                os.killpg(self.popen.pid, sig)
+            except OSError:
+                # Process group already gone.
+                break
+            try:
+                self.popen.wait(timeout=grace)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+
+
+def exit_status(returncode):
+    """
+    Convert the returncode of Popen to the exit status reported by the shell
+    (128 + signal number if the process has been killed by a signal).
+    """
+    if returncode is not None and returncode < 0:
+        return 128 - returncode
+    return returncode
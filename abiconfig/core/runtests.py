@@ -0,0 +1,503 @@
+"""
+Objects used to generate the scripts executing the Abinit test suite with runtests.py.
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+
+import os
+import re
+import json
+import itertools
+
+# Default MPI x OpenMP combinations used in the runtests script.
+MPI_PROCS = [1, 2, 4, 8, 10]
+OMP_THREADS = [1, 2]
+
+# Orderings of the combinations before packing:
+#   "largest": combinations with more cores first (first-fit decreasing, less waves).
+#   "given": order of MPI_PROCS x OMP_THREADS.
+ORDERS = ("largest", "given")
+
+
+def pack_waves(combos, ncores, order="largest"):
+    """
+    Pack the (mpi_procs, omp_threads) combinations into waves of concurrent runs
+    whose total number of cores does not exceed ncores.
+    The cores left in a wave are used to increase the number of tests executed
+    in parallel by runtests.py (-j option).
+
+    Args:
+        combos: List of (mpi_procs, omp_threads) tuples.
+        ncores: Number of cores available.
+        order: "largest" or "given" (see ORDERS).
+
+    Return:
+        List of waves. Each wave is a list of (mpi_procs, omp_threads, jobs) tuples.
+        A combination requiring more than ncores cores is executed alone.
+    """
+    if order not in ORDERS:
+        raise ValueError("Wrong order: %s. Choose among %s" % (order, str(ORDERS)))
+    combos = list(combos)
+    if order == "largest":
+        combos.sort(key=lambda c: c[0] * c[1], reverse=True)
+
+    # First-fit: each combination goes to the first wave with enough free cores.
+    waves, free = [], []
+    for mpi, omp in combos:
+        cost = mpi * omp
+        for i, f in enumerate(free):
+            if cost <= f:
+                waves[i].append([mpi, omp, 1])
+                free[i] -= cost
+                break
+        else:
+            waves.append([[mpi, omp, 1]])
+            free.append(max(0, ncores - cost))
+
+    # Distribute the cores left in each wave round-robin among its runs.
+    for wave, f in zip(waves, free):
+        added = True
+        while added:
+            added = False
+            for run in wave:
+                cost = run[0] * run[1]
+                if cost <= f:
+                    run[2] += 1
+                    f -= cost
+                    added = True
+
+    return [[tuple(run) for run in wave] for wave in waves]
+
+
+def get_runtests_lines(ncores, mpi_procs=None, omp_threads=None, order="largest", runtests="../../tests/runtests.py"):
+    """
+    Return list of shell commands executing runtests.py for the product of mpi_procs and omp_threads.
+    The runs of a wave are executed in background, each one in its own working directory.
+
+    Args:
+        ncores: Number of cores of the allocation.
+        mpi_procs, omp_threads: List of MPI processes and OpenMP threads. Default: MPI_PROCS, OMP_THREADS.
+        order: Ordering of the combinations (see ORDERS).
+        runtests: Path of runtests.py.
+    """
+    mpi_procs = MPI_PROCS if mpi_procs is None else mpi_procs
+    omp_threads = OMP_THREADS if omp_threads is None else omp_threads
+    waves = pack_waves(itertools.product(mpi_procs, omp_threads), ncores, order=order)
+
+    lines = ["# Runtests section", "RUNTESTS='%s'" % runtests]
+    for i, wave in enumerate(waves):
+        lines.append("# Wave %d: %d cores out of %d" % (i + 1, sum(n * o * j for n, o, j in wave), ncores))
+        for mpi, omp, jobs in wave:
+            suffix = "MPI%s_OMP%s" % (mpi, omp)
+            lines.append("$RUNTESTS -n%s -o%s -j%s -w Test_suite_%s > runtests_%s.stdout 2> runtests_%s.stderr &" % (
+                         mpi, omp, jobs, suffix, suffix, suffix))
+        lines.append("wait")
+    return lines
+
+
+# Parameters of the queue script requesting `ncores` cores on a single node.
+# The number of cores of an element of the array is passed on the command line by the driver.
+_ARRAY_QKWARGS = {
+    "slurm": dict(nodes=1, cpus_per_task=1, time="{walltime}"),
+    "pbspro": dict(walltime="{walltime}"),
+}
+
+# Options of the submission command setting the cores of a group of elements and the indices of the array.
+_ARRAY_SUBMIT = {
+    "slurm": "sbatch --array={first}-{last} --ntasks={ncores}",
+    "pbspro": "qsub -J {first}-{last} -l select=1:ncpus={ncores}:mpiprocs={ncores}",
+}
+
+# Submission of a single element (PBS does not accept arrays with one element).
+_ELEMENT_SUBMIT = {
+    "slurm": "sbatch --array={first} --ntasks={ncores}",
+    "pbspro": ("qsub -v ABICONF_ARRAY_INDEX={first} -l select=1:ncpus={ncores}:mpiprocs={ncores} "
+               "-o runtests_array_{first}.qout -e runtests_array_{first}.qerr"),
+}
+
+# Parameters of the queue script of a single combination (per-combination scripts).
+_SCRIPT_QKWARGS = {
+    "shell": {},
+    "slurm": dict(nodes=1, ntasks="{ncores}", cpus_per_task=1, time="{walltime}"),
+    "pbspro": dict(select="1:ncpus={ncores}:mpiprocs={ncores}", walltime="{walltime}"),
+    "sge": dict(ncpus="{ncores}", walltime="{walltime}"),
+    "moab": dict(nodes="1:ppn={ncores}", walltime="{walltime}"),
+}
+
+ARRAY_SCRIPT = "runtests_array.sh"
+DRIVER_SCRIPT = "submit_runtests.sh"
+REPORT_FILE = "runtests_report.txt"
+
+
+def element_name(mpi, omp):
+    """Suffix used for the files of the (mpi, omp) run."""
+    return "MPI%s_OMP%s" % (mpi, omp)
+
+
+class RuntestsJobs(object):
+    """
+    Generate the queue scripts executing each MPI x OpenMP combination of the runtests matrix
+    in its own allocation, either as job arrays (slurm, pbspro) or as one script per combination.
+    Each element requests mpi_procs * omp_threads cores. The combinations are sorted by number of cores
+    so that the elements with the same request form a contiguous range of the array submitted
+    with a single command by the driver script.
+    """
+    MODES = ("array", "scripts")
+
+    def __init__(self, conf, mpi_procs=None, omp_threads=None, walltime="01:00:00",
+                 runtests="../../tests/runtests.py", module_env=None):
+        """
+        Args:
+            conf: Config object with qtype and qkwargs.
+            mpi_procs, omp_threads: List of MPI processes and OpenMP threads. Default: metadata or MPI_PROCS, OMP_THREADS.
+            walltime: Wall time of each element.
+            runtests: Path of runtests.py.
+            module_env: ModuleEnvironment. If not None, the cached environment is sourced.
+        """
+        opts = conf.meta.get("runtests", {})
+        mpi_procs = mpi_procs or opts.get("mpi_procs", MPI_PROCS)
+        omp_threads = omp_threads or opts.get("omp_threads", OMP_THREADS)
+        self.conf = conf
+        self.qtype = conf.meta.get("qtype", "shell")
+        self.combos = sorted(itertools.product(mpi_procs, omp_threads), key=lambda c: (c[0] * c[1], c))
+        self.walltime = walltime
+        self.runtests = runtests
+        self.module_env = module_env
+
+    def _get_header_lines(self, qkwargs, job_name, workdir, qout):
+        """Queue directives, modules and cd to workdir."""
+        from abiconfig.core.qtemplates import QueueTemplate
+        from abiconfig.core.workon import RUN_LAYOUT_QKWARGS
+        d = dict((k, v) for k, v in self.conf.meta.get("qkwargs", {}).items() if k not in RUN_LAYOUT_QKWARGS)
+        d.update(qkwargs)
+        d.update(job_name=job_name, _qout_path=os.path.join(workdir, qout + ".qout"),
+                 _qerr_path=os.path.join(workdir, qout + ".qerr"))
+        lines = QueueTemplate.from_qtype(self.qtype).substitute(d).splitlines()
+        lines.extend(["", "ulimit -s unlimited  # Set stack size to unlimited (if allowed)", ""])
+        commands = self.conf.meta.get("pre_configure", [])
+        if self.module_env is not None:
+            lines.extend(self.module_env.get_source_lines(commands))
+        else:
+            lines.extend(commands)
+        lines.extend(["", "cd %s" % workdir, "RUNTESTS='%s'" % self.runtests])
+        return lines
+
+    @staticmethod
+    def _get_run_lines(mpi, omp):
+        """Execute runtests.py. The exit status is written to runtests_<suffix>.retcode."""
+        suffix = element_name(mpi, omp)
+        return [
+            "export OMP_NUM_THREADS=%s" % omp,
+            "$RUNTESTS -n%s -o%s -j1 -w Test_suite_%s > runtests_%s.stdout 2> runtests_%s.stderr" % (
+                mpi, omp, suffix, suffix, suffix),
+            "echo $? > runtests_%s.retcode" % suffix,
+        ]
+
+    def _fmt(self, qkwargs, **kwargs):
+        return dict((k, v.format(walltime=self.walltime, **kwargs) if isinstance(v, str) else v)
+                    for k, v in qkwargs.items())
+
+    def get_array_script_str(self, workdir):
+        """Return string with the job array script. The element is selected by the array index."""
+        if self.qtype not in _ARRAY_QKWARGS:
+            raise ValueError("Job arrays are not supported for qtype: %s. Use mode `scripts`" % self.qtype)
+        # The index of the element is inserted by the resource manager so that the elements do not share the logs.
+        qout = {"slurm": "runtests_array_%a", "pbspro": "runtests_array_^array_index^"}.get(self.qtype, "runtests_array")
+        lines = self._get_header_lines(self._fmt(_ARRAY_QKWARGS[self.qtype]), "runtests", workdir, qout)
+        lines.extend([
+            "MPI_PROCS=(%s)" % " ".join(str(c[0]) for c in self.combos),
+            "OMP_THREADS=(%s)" % " ".join(str(c[1]) for c in self.combos),
+            "i=${SLURM_ARRAY_TASK_ID:-${PBS_ARRAY_INDEX:-$ABICONF_ARRAY_INDEX}}",
+            "n=${MPI_PROCS[$i]}",
+            "o=${OMP_THREADS[$i]}",
+        ])
+        lines.extend(self._get_run_lines("${n}", "${o}"))
+        return "\n".join(lines) + "\n"
+
+    def get_element_script_str(self, mpi, omp, workdir):
+        """Return string with the queue script for the (mpi, omp) combination."""
+        if self.qtype not in _SCRIPT_QKWARGS:
+            raise ValueError("Unsupported qtype: %s" % self.qtype)
+        suffix = element_name(mpi, omp)
+        qkwargs = self._fmt(_SCRIPT_QKWARGS[self.qtype], ncores=mpi * omp)
+        lines = self._get_header_lines(qkwargs, "runtests_" + suffix, workdir, "runtests_" + suffix)
+        lines.extend(self._get_run_lines(mpi, omp))
+        return "\n".join(lines) + "\n"
+
+    def get_groups(self):
+        """List of (ncores, first, last) with the ranges of array indices requesting the same number of cores."""
+        groups = []
+        for i, (mpi, omp) in enumerate(self.combos):
+            if groups and groups[-1][0] == mpi * omp:
+                groups[-1][2] = i
+            else:
+                groups.append([mpi * omp, i, i])
+        return [tuple(g) for g in groups]
+
+    def get_driver_str(self, mode="array"):
+        """Return string with the shell script submitting the jobs."""
+        from abiconfig.core.workon import SUBMIT_CMDS
+        lines = ["#!/bin/bash", "# Submit the runtests jobs. Use `abiconf.py runtests collect` to merge the results.",
+                 'cd "$(dirname "$0")"']
+        if mode == "array":
+            for ncores, first, last in self.get_groups():
+                fmt = _ARRAY_SUBMIT[self.qtype] if last > first else _ELEMENT_SUBMIT[self.qtype]
+                lines.append("%s %s" % (fmt.format(ncores=ncores, first=first, last=last), ARRAY_SCRIPT))
+        else:
+            cmd = SUBMIT_CMDS[self.qtype]
+            for mpi, omp in self.combos:
+                lines.append("%s runtests_%s.sh" % (cmd, element_name(mpi, omp)))
+        return "\n".join(lines) + "\n"
+
+    def write(self, workdir, mode="array"):
+        """Write the queue scripts and the driver to workdir. Return the path of the driver."""
+        from abiconfig.core.cache import write_atomic
+        if mode not in self.MODES:
+            raise ValueError("Wrong mode: %s. Choose among %s" % (mode, str(self.MODES)))
+        workdir = os.path.abspath(workdir)
+        if mode == "array":
+            write_atomic(os.path.join(workdir, ARRAY_SCRIPT), self.get_array_script_str(workdir))
+        else:
+            for mpi, omp in self.combos:
+                write_atomic(os.path.join(workdir, "runtests_%s.sh" % element_name(mpi, omp)),
+                             self.get_element_script_str(mpi, omp, workdir))
+        path = os.path.join(workdir, DRIVER_SCRIPT)
+        write_atomic(path, self.get_driver_str(mode=mode))
+        return path
+
+
+def find_runs(workdir):
+    """Return sorted list of (mpi, omp) with the runtests output files found in workdir."""
+    runs = set()
+    for f in os.listdir(workdir):
+        m = re.match(r"^runtests_MPI(\d+)_OMP(\d+)\.(stdout|stderr|retcode)$", f)
+        if m: runs.add((int(m.group(1)), int(m.group(2))))
+    return sorted(runs, key=lambda c: (c[0] * c[1], c))
+
+
+def collect_runs(workdir, nlines=20):
+    """
+    Merge the stdout, stderr and the exit status of the runs in workdir into a single report
+    written to REPORT_FILE. Return the report string.
+
+    Args:
+        nlines: Number of lines of stdout (end of the file) and stderr reported for each run.
+    """
+    from abiconfig.core.utils import marquee
+    from abiconfig.core.cache import write_atomic
+
+    def read(path):
+        try:
+            with open(path, "rt") as fh:
+                return fh.read()
+        except (IOError, OSError):
+            return None
+
+    out, summary = [], []
+    for mpi, omp in find_runs(workdir):
+        suffix = element_name(mpi, omp)
+        retcode = read(os.path.join(workdir, "runtests_%s.retcode" % suffix))
+        status = "not finished" if retcode is None else ("ok" if retcode.strip() == "0" else
+                                                         "failed (%s)" % retcode.strip())
+        summary.append("%s: %s" % (suffix, status))
+        out.append(marquee(suffix))
+        out.append("status: %s" % status)
+        for ext in ("stdout", "stderr"):
+            s = read(os.path.join(workdir, "runtests_%s.%s" % (suffix, ext)))
+            if not s: continue
+            out.append("--- %s (last %d lines)" % (ext, nlines))
+            out.extend(s.splitlines()[-nlines:])
+        out.append("")
+
+    report = "\n".join(summary + [""] + out)
+    write_atomic(os.path.join(workdir, REPORT_FILE), report)
+    return report
+
+
+# Line reported by runtests.py for each test e.g.
+#   [v1][t01][np=2]: succeeded: absolute error: 1.1e-10, relative error: 2.0e-08 [run_etime: 1.53 s]
+_TEST_RE = re.compile(r"^\[(?P<suite>[^\]]+)\]\[(?P<test>[^\]]+)\](?:\[np=(?P<np>\d+)\])?[^:]*:\s*"
+                      r"(?P<status>succeeded|passed|failed|skipped|disabled|crashed|error)\b")
+_ETIME_RE = re.compile(r"run_etime[:=\s]+(?P<etime>[\d.]+)")
+_TOTAL_RE = re.compile(r"Test suite completed in\s+(?P<etime>[\d.]+)\s*s")
+
+# Status considered as a success.
+OK_STATUS = ("succeeded", "passed")
+
+
+def parse_runtests_output(lines):
+    """
+    Parse the output of runtests.py. Return (tests, total_time) where tests is a list of dictionaries
+    with suite, test, status and run_etime (None if not reported) and total_time is the
+    wall time of the test suite (None if not found).
+    """
+    tests, total_time = [], None
+    for line in lines:
+        line = line.strip()
+        m = _TEST_RE.match(line)
+        if m:
+            e = _ETIME_RE.search(line)
+            tests.append(dict(suite=m.group("suite"), test=m.group("test"), status=m.group("status"),
+                              run_etime=float(e.group("etime")) if e else None))
+            continue
+        m = _TOTAL_RE.search(line)
+        if m: total_time = float(m.group("etime"))
+    return tests, total_time
+
+
+def parse_json_summary(path):
+    """
+    Read the tests from a json summary. The file may contain a list of dictionaries or a dictionary
+    with a `tests` list. Each entry should provide the name of the test (`test` or `name`), the suite
+    and the status, the elapsed time is read from `run_etime` or `tot_etime`.
+    """
+    with open(path, "rt") as fh:
+        data = json.load(fh)
+    if isinstance(data, dict): data = data.get("tests", [])
+    tests = []
+    for d in data:
+        if not isinstance(d, dict) or "status" not in d: continue
+        etime = d.get("run_etime", d.get("tot_etime"))
+        tests.append(dict(suite=d.get("suite", ""), test=d.get("test", d.get("name")), status=d["status"],
+                          run_etime=float(etime) if etime is not None else None))
+    return tests
+
+
+class RuntestsResults(object):
+    """
+    Results of the runtests.py runs executed in a directory for different MPI x OpenMP combinations.
+    The speedup and the efficiency of each combination are computed with respect to the 1x1 run
+    using the elapsed time of the tests executed by both runs.
+    """
+
+    def __init__(self, name, runs):
+        """
+        Args:
+            name: Name of the results (e.g. build directory or cluster).
+            runs: OrderedDict (mpi, omp) --> dict(tests=list of dictionaries, total_time=float or None).
+        """
+        self.name = name
+        self.runs = runs
+
+    @classmethod
+    def from_dir(cls, workdir, name=None):
+        """
+        Parse the runtests_MPI{n}_OMP{m}.stdout files in workdir. The json summaries found
+        in the Test_suite_MPI{n}_OMP{m} directories are used if present.
+        """
+        import glob
+        from collections import OrderedDict
+        runs = OrderedDict()
+        for mpi, omp in find_runs(workdir):
+            suffix = element_name(mpi, omp)
+            tests, total_time = [], None
+            path = os.path.join(workdir, "runtests_%s.stdout" % suffix)
+            if os.path.exists(path):
+                with open(path, "rt") as fh:
+                    tests, total_time = parse_runtests_output(fh)
+            for path in sorted(glob.glob(os.path.join(workdir, "Test_suite_%s" % suffix, "*.json"))):
+                try:
+                    found = parse_json_summary(path)
+                except (ValueError, TypeError, KeyError):
+                    continue
+                if found: tests = found
+            runs[(mpi, omp)] = dict(tests=tests, total_time=total_time)
+
+        if name is None: name = os.path.basename(os.path.abspath(workdir))
+        return cls(name, runs)
+
+    def get_times(self, key):
+        """Dictionary (suite, test) --> run_etime for the run key=(mpi, omp). Tests without timing are ignored."""
+        return dict(((t["suite"], t["test"]), t["run_etime"]) for t in self.runs[key]["tests"]
+                    if t["run_etime"] is not None and t["status"] in OK_STATUS)
+
+    def get_summary(self):
+        """
+        Return list of dictionaries (one for each run) with mpi, omp, ncores, passed, failed, time,
+        speedup and efficiency. time is the sum of the elapsed times of the tests (the total time of
+        the test suite if not available). speedup and efficiency are None if the 1x1 run is not available.
+        """
+        base = self.get_times((1, 1)) if (1, 1) in self.runs else None
+        rows = []
+        for (mpi, omp), run in self.runs.items():
+            times = self.get_times((mpi, omp))
+            time = sum(times.values()) if times else run["total_time"]
+            speedup = None
+            if base:
+                common = [k for k in times if k in base]
+                t, t0 = sum(times[k] for k in common), sum(base[k] for k in common)
+                if common and t > 0:
+                    speedup = t0 / t
+            elif base is not None and run["total_time"] and self.runs[(1, 1)]["total_time"]:
+                speedup = self.runs[(1, 1)]["total_time"] / run["total_time"]
+            rows.append(dict(
+                mpi=mpi, omp=omp, ncores=mpi * omp,
+                passed=sum(t["status"] in OK_STATUS for t in run["tests"]),
+                failed=sum(t["status"] not in OK_STATUS + ("skipped", "disabled") for t in run["tests"]),
+                time=time, speedup=speedup,
+                efficiency=speedup / (mpi * omp) if speedup is not None else None,
+            ))
+        return rows
+
+    def get_rows(self):
+        """List of dictionaries with the results of each test in each run (used for the CSV export)."""
+        rows = []
+        base = self.get_times((1, 1)) if (1, 1) in self.runs else {}
+        for (mpi, omp), run in self.runs.items():
+            for t in run["tests"]:
+                t0 = base.get((t["suite"], t["test"]))
+                speedup = t0 / t["run_etime"] if t0 and t["run_etime"] else None
+                rows.append(dict(name=self.name, mpi=mpi, omp=omp, suite=t["suite"], test=t["test"],
+                                 status=t["status"], run_etime=t["run_etime"], speedup=speedup,
+                                 efficiency=speedup / (mpi * omp) if speedup is not None else None))
+        return rows
+
+    def as_dict(self):
+        """JSON-serializable dictionary."""
+        return dict(name=self.name, summary=self.get_summary(), tests=self.get_rows())
+
+
+CSV_COLUMNS = ("name", "mpi", "omp", "suite", "test", "status", "run_etime", "speedup", "efficiency")
+
+
+def write_csv(results, path):
+    """Write the results of each test for a list of RuntestsResults to a CSV file."""
+    import csv
+    with open(path, "wt") as fh:
+        writer = csv.DictWriter(fh, fieldnames=CSV_COLUMNS)
+        writer.writeheader()
+        for res in results:
+            writer.writerows(res.get_rows())
+
+
+def write_json(results, path):
+    """Write a list of RuntestsResults to a json file."""
+    with open(path, "wt") as fh:
+        json.dump([res.as_dict() for res in results], fh, indent=4)
+
+
+def compare_results(results):
+    """
+    Return string with a table comparing the results side by side:
+    one row for each MPI x OpenMP combination, one group of columns for each RuntestsResults.
+    """
+    keys = []
+    for res in results:
+        keys.extend(k for k in res.runs if k not in keys)
+    keys.sort(key=lambda c: (c[0] * c[1], c))
+    summaries = [dict(((d["mpi"], d["omp"]), d) for d in res.get_summary()) for res in results]
+
+    def fmt(d):
+        if d is None: return "-"
+        s = "%d/%d" % (d["passed"], d["passed"] + d["failed"])
+        if d["time"] is not None: s += " %.1fs" % d["time"]
+        if d["speedup"] is not None: s += " x%.2f (%.0f%%)" % (d["speedup"], 100 * d["efficiency"])
+        return s
+
+    header = ["MPIxOMP"] + [res.name for res in results]
+    rows = [["%dx%d" % k] + [fmt(s.get(k)) for s in summaries] for k in keys]
+    widths = [max(len(r[i]) for r in [header] + rows) for i in range(len(header))]
+    lines = ["  ".join(s.ljust(w) for s, w in zip(row, widths)).rstrip() for row in [header] + rows]
+    lines.insert(1, "  ".join("-" * w for w in widths))
+    lines.append("")
+    lines.append("passed/run, elapsed time of the tests, speedup (efficiency) with respect to 1x1")
+    return "\n".join(lines)
@@ -0,0 +1,279 @@
+"""
+Strong and weak scaling studies of an ABINIT input file: generation of the job scripts
+for a sweep over nodes, MPI processes and OpenMP threads and analysis of the timings.
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+
+import os
+import re
+import json
+import itertools
+
+from collections import OrderedDict
+
+# Parameters of the resource manager describing the layout of a point of the study.
+_LAYOUT_QKWARGS = {
+    "shell": {},
+    "slurm": dict(nodes="{nodes}", ntasks="{mpi}", ntasks_per_node="{ranks_per_node}",
+                  cpus_per_task="{omp}", time="{walltime}"),
+    "pbspro": dict(select="{nodes}:ncpus={cores_per_node}:mpiprocs={ranks_per_node}:ompthreads={omp}",
+                   walltime="{walltime}"),
+    "sge": dict(ncpus="{ncores}", walltime="{walltime}"),
+    "moab": dict(nodes="{nodes}:ppn={cores_per_node}", walltime="{walltime}"),
+}
+
+# Name of the input file copied in the directory of each point.
+INPUT_FILE = "run.abi"
+
+# File with the parameters of the study written in the top directory.
+STUDY_FILE = "scaling.json"
+
+# Line printed by ABINIT at the end of the main output and of the log file e.g.
+#   +Overall time at end (sec) : cpu=        154.3  wall=         40.1
+_OVERALL_TIME_RE = re.compile(r"Overall time at end \(sec\)\s*:\s*cpu=\s*(?P<cpu>[\d.]+)\s+wall=\s*(?P<wall>[\d.]+)")
+
+_POINT_RE = re.compile(r"^scaling_N(?P<nodes>\d+)_MPI(?P<mpi>\d+)_OMP(?P<omp>\d+)$")
+
+
+def point_name(nodes, mpi, omp):
+    """Name of the directory of the point."""
+    return "scaling_N%d_MPI%d_OMP%d" % (nodes, mpi, omp)
+
+
+def set_abinit_vars(s, variables):
+    """
+    Return new string with the content of an ABINIT input in which the variables are set to the given values.
+    A line starting with the name of the variable is replaced, otherwise the variable is added at the end.
+
+    Args:
+        variables: OrderedDict name --> value (string).
+    """
+    for name, value in variables.items():
+        line = "%s %s" % (name, value)
+        regex = re.compile(r"^[ \t]*%s[ \t]+.*$" % re.escape(name), re.MULTILINE)
+        if regex.search(s):
+            s = regex.sub(line, s, count=1)
+        else:
+            if s and not s.endswith("\n"): s += "\n"
+            s += line + "\n"
+    return s
+
+
+def parse_abinit_timing(lines):
+    """
+    Return dictionary with the cpu and wall time (seconds) reported by ABINIT
+    at the end of the run. None if the run did not complete.
+    """
+    found = None
+    for line in lines:
+        m = _OVERALL_TIME_RE.search(line)
+        if m: found = dict(cpu=float(m.group("cpu")), wall=float(m.group("wall")))
+    return found
+
+
+class ScalingStudy(object):
+    """
+    Job scripts for a sweep over the number of nodes, MPI processes and OpenMP threads.
+    Each point is executed in its own directory with a copy of the input file in which the
+    parallelization variables (e.g. npkpt, npband) are set for the point.
+    In a weak scaling study, the variables in `weak_vars` are multiplied by the number
+    of cores divided by the number of cores of the smallest point.
+    """
+
+    def __init__(self, conf, input_path, nodes=(1,), mpi_procs=(1, 2, 4), omp_threads=(1,), cores_per_node=None,
+                 paral_vars=None, weak_vars=None, walltime="01:00:00", mpirun="mpirun -np {mpi}", abinit="abinit",
+                 module_env=None):
+        """
+        Args:
+            conf: Config object (qtype, qkwargs and pre_configure).
+            input_path: ABINIT input file.
+            nodes, mpi_procs, omp_threads: Values of the sweep. mpi_procs is the total number of MPI processes.
+            cores_per_node: Points that do not fit the nodes are skipped. None if not known.
+            paral_vars: Dictionary name --> value with the variables set in each point.
+                The values may contain {nodes}, {mpi}, {omp}, {ncores}, {ranks_per_node} e.g. {"npband": "{mpi}"}.
+            weak_vars: Dictionary name --> integer value for the smallest point (weak scaling).
+                None for strong scaling.
+            walltime: Wall time of each job.
+            mpirun: Command used to start the MPI processes ({mpi} is replaced by the number of processes).
+            abinit: ABINIT executable.
+            module_env: ModuleEnvironment (see Config.get_script_str).
+        """
+        self.conf = conf
+        self.input_path = os.path.abspath(input_path)
+        self.qtype = conf.meta.get("qtype", "shell")
+        if self.qtype not in _LAYOUT_QKWARGS:
+            raise ValueError("Unsupported qtype: %s" % self.qtype)
+        self.paral_vars = OrderedDict(sorted((paral_vars or {}).items()))
+        self.weak_vars = OrderedDict(sorted((weak_vars or {}).items()))
+        self.walltime, self.mpirun, self.abinit = walltime, mpirun, abinit
+        self.module_env = module_env
+
+        self.points = []
+        for n, mpi, omp in itertools.product(nodes, mpi_procs, omp_threads):
+            if mpi % n != 0 or mpi < n: continue
+            if cores_per_node is not None and (mpi // n) * omp > cores_per_node: continue
+            self.points.append((n, mpi, omp))
+        self.points.sort(key=lambda p: (p[1] * p[2], p))
+        if not self.points:
+            raise ValueError("No point of the sweep fits the nodes")
+
+    def get_params(self, nodes, mpi, omp):
+        """Dictionary with the parameters used to format the templates."""
+        ranks_per_node = mpi // nodes
+        return dict(nodes=nodes, mpi=mpi, omp=omp, ncores=mpi * omp, ranks_per_node=ranks_per_node,
+                    cores_per_node=ranks_per_node * omp, walltime=self.walltime)
+
+    def get_input_str(self, nodes, mpi, omp):
+        """Return string with the input file of the point."""
+        with open(self.input_path, "rt") as fh:
+            s = fh.read()
+        params = self.get_params(nodes, mpi, omp)
+        variables = OrderedDict((k, str(v).format(**params)) for k, v in self.paral_vars.items())
+        ncores0 = self.points[0][1] * self.points[0][2]
+        for name, value in self.weak_vars.items():
+            variables[name] = str(int(round(value * params["ncores"] / ncores0)))
+        return set_abinit_vars(s, variables) if variables else s
+
+    def get_script_str(self, nodes, mpi, omp, workdir):
+        """Return string with the job script of the point."""
+        from abiconfig.core.workon import RUN_LAYOUT_QKWARGS
+        params = self.get_params(nodes, mpi, omp)
+        # The site parameters of the metadata (queue, account ...) are kept,
+        # the layout of the job is the one of the point.
+        qkwargs = dict((k, None) for k in RUN_LAYOUT_QKWARGS)
+        qkwargs.update((k, v) for k, v in self.conf.meta.get("qkwargs", {}).items() if k not in RUN_LAYOUT_QKWARGS)
+        qkwargs.update((k, v.format(**params)) for k, v in _LAYOUT_QKWARGS[self.qtype].items())
+        name = point_name(nodes, mpi, omp)
+        qkwargs.update(job_name=name, _qout_path=os.path.join(workdir, "job.qout"),
+                       _qerr_path=os.path.join(workdir, "job.qerr"))
+        lines = self.conf.get_script_str(module_env=self.module_env, qkwargs=qkwargs).splitlines()
+        lines.extend([
+            "cd %s" % workdir,
+            "export OMP_NUM_THREADS=%d" % omp,
+            "%s %s %s > run.log 2> run.err" % (self.mpirun.format(**params), self.abinit, INPUT_FILE),
+        ])
+        return "\n".join(lines) + "\n"
+
+    def write(self, top):
+        """
+        Write the directories of the points and the driver script submitting the jobs to top.
+        Return the path of the driver.
+        """
+        from abiconfig.core.cache import write_atomic
+        from abiconfig.core.workon import SUBMIT_CMDS
+        top = os.path.abspath(top)
+        driver = ["#!/bin/bash", "# Submit the jobs of the scaling study. Use `abiconf.py scaling report` to analyze the results.",
+                  'cd "$(dirname "$0")"']
+        for point in self.points:
+            workdir = os.path.join(top, point_name(*point))
+            write_atomic(os.path.join(workdir, INPUT_FILE), self.get_input_str(*point))
+            write_atomic(os.path.join(workdir, "job.sh"), self.get_script_str(*point, workdir=workdir))
+            driver.append("(cd %s && %s job.sh)" % (point_name(*point), SUBMIT_CMDS[self.qtype]))
+
+        write_atomic(os.path.join(top, STUDY_FILE), json.dumps(dict(
+            input=self.input_path, points=self.points, paral_vars=self.paral_vars, weak_vars=self.weak_vars), indent=4))
+
+        path = os.path.join(top, "submit_scaling.sh")
+        write_atomic(path, "\n".join(driver) + "\n")
+        return path
+
+
+class ScalingResults(object):
+    """
+    Timings of the points of a scaling study. The speedup and the efficiency are computed
+    with respect to the point with the smallest number of cores:
+
+        strong scaling: speedup = T0 / T, efficiency = speedup * ncores0 / ncores
+        weak scaling: efficiency = T0 / T
+    """
+
+    def __init__(self, points, weak=False):
+        """
+        Args:
+            points: List of dictionaries with nodes, mpi, omp, cpu and wall (None if the run did not complete).
+            weak: True for a weak scaling study.
+        """
+        self.points = sorted(points, key=lambda p: (p["mpi"] * p["omp"], p["nodes"], p["mpi"]))
+        self.weak = weak
+
+    @classmethod
+    def from_dir(cls, top, weak=None):
+        """
+        Parse the output files (run.abo, run.log) in the directories of the points.
+
+        Args:
+            weak: True for weak scaling. None to read it from the file written by ScalingStudy.
+        """
+        if weak is None:
+            try:
+                with open(os.path.join(top, STUDY_FILE), "rt") as fh:
+                    weak = bool(json.load(fh).get("weak_vars"))
+            except (IOError, OSError, ValueError):
+                weak = False
+
+        points = []
+        for d in sorted(os.listdir(top)):
+            m = _POINT_RE.match(d)
+            if not m: continue
+            timing = None
+            for fname in ("run.abo", "run.log"):
+                path = os.path.join(top, d, fname)
+                if timing is None and os.path.exists(path):
+                    with open(path, "rt") as fh:
+                        timing = parse_abinit_timing(fh)
+            point = dict((k, int(v)) for k, v in m.groupdict().items())
+            point.update(timing if timing is not None else dict(cpu=None, wall=None))
+            points.append(point)
+        return cls(points, weak=weak)
+
+    def get_table(self):
+        """List of dictionaries with the timings, speedup and efficiency of each point."""
+        ref = None
+        for p in self.points:
+            if p["wall"]:
+                ref = p
+                break
+        rows = []
+        for p in self.points:
+            row = dict(p, ncores=p["mpi"] * p["omp"], speedup=None, efficiency=None)
+            if ref is not None and p["wall"]:
+                row["speedup"] = ref["wall"] / p["wall"]
+                if self.weak:
+                    row["efficiency"] = row["speedup"]
+                else:
+                    row["efficiency"] = row["speedup"] * (ref["mpi"] * ref["omp"]) / row["ncores"]
+            rows.append(row)
+        return rows
+
+    def to_string(self, width=40):
+        """Return string with the scaling table and the efficiency curve."""
+        rows = self.get_table()
+        header = ["nodes", "MPI", "OMP", "cores", "wall (s)", "cpu (s)", "speedup", "efficiency", ""]
+
+        def fmt(value, f):
+            return f % value if value is not None else "-"
+
+        table = [header]
+        for r in rows:
+            bar = "#" * int(round(width * min(r["efficiency"], 1.0))) if r["efficiency"] is not None else ""
+            table.append([str(r["nodes"]), str(r["mpi"]), str(r["omp"]), str(r["ncores"]),
+                          fmt(r["wall"], "%.1f"), fmt(r["cpu"], "%.1f"), fmt(r["speedup"], "%.2f"),
+                          fmt(r["efficiency"], "%.2f"), bar])
+        widths = [max(len(t[i]) for t in table) for i in range(len(header))]
+        lines = ["  ".join(s.ljust(w) for s, w in zip(t, widths)).rstrip() for t in table]
+        lines.insert(1, "  ".join("-" * w for w in widths[:-1]))
+        lines.append("")
+        lines.append("%s scaling, reference: point with the smallest number of cores" % ("Weak" if self.weak else "Strong"))
+        return "\n".join(lines)
+
+    def __str__(self):
+        return self.to_string()
+
+    def write_csv(self, path):
+        """Write the scaling table to a CSV file."""
+        import csv
+        columns = ["nodes", "mpi", "omp", "ncores", "wall", "cpu", "speedup", "efficiency"]
+        with open(path, "wt") as fh:
+            writer = csv.DictWriter(fh, fieldnames=columns, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(self.get_table())
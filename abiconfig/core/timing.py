@@ -0,0 +1,181 @@
+"""
+Timing reports for the phases of the build (module load, configure, make, post_make).
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+
+import os
+import json
+
+# File written by the workon script: one json dictionary per phase.
+EVENTS_FILE = "abiconf_timing.jsonl"
+
+# Report written to the build directory at the end of the build.
+REPORT_FILE = "timing.json"
+
+# Shell functions used by the workon script to record the phases.
+# The peak RSS is measured with GNU time if available.
+# `date +%N` is not portable (e.g. macOS), the time is taken from $EPOCHREALTIME (bash >= 5),
+# python or, as last resort, with a resolution of one second.
+SHELL_FUNCTIONS = """\
+# Timing of the build phases (see abiconfig.core.timing).
+: > %(events)s
+_abiconf_time=""
+/usr/bin/time -f %%M -o /dev/null true 2>/dev/null && _abiconf_time="/usr/bin/time -f %%M -o .abiconf_rss"
+abiconf_run() { $_abiconf_time "$@"; }
+abiconf_now() {
+    if [ -n "$EPOCHREALTIME" ]; then echo "${EPOCHREALTIME/,/.}"
+    else python3 -c 'import time; print(time.time())' 2>/dev/null || python -c 'import time; print(time.time())' 2>/dev/null || date +%%s
+    fi
+}
+abiconf_phase_start() { _abiconf_phase=$1; _abiconf_t0=$(abiconf_now); rm -f .abiconf_rss; }
+abiconf_phase_end() {
+    local rc=$1 rss=null
+    [ -s .abiconf_rss ] && rss=$(tail -n 1 .abiconf_rss)
+    printf '{"phase": "%%s", "start": %%s, "end": %%s, "exit_code": %%d, "peak_rss_kb": %%s}\\n' \\
+        "$_abiconf_phase" "$_abiconf_t0" "$(abiconf_now)" "$rc" "$rss" >> %(events)s
+    return $rc
+}
+""" % dict(events=EVENTS_FILE)
+
+
+def read_events(path):
+    """
+    Read the file with the events written by the workon script. Return list of dictionaries.
+    A warning is printed if complete lines cannot be parsed.
+    """
+    phases, nbad = [], 0
+    with open(path, "rt") as fh:
+        for line in fh:
+            if not line.strip(): continue
+            try:
+                d = json.loads(line)
+                d["duration"] = d["end"] - d["start"]
+            except (ValueError, KeyError, TypeError):
+                # The last line is incomplete if the script has been killed.
+                if line.endswith("\n"): nbad += 1
+                continue
+            phases.append(d)
+
+    if nbad:
+        from abiconfig.core.termcolor import cprint
+        cprint("Cannot parse %d event(s) in %s. The timing report is incomplete." % (nbad, path), "red")
+    return phases
+
+
+class TimingReport(dict):
+    """
+    Dictionary with the timing of a build. Keys:
+
+        name: Name of the build.
+        hostname: Hostname in the metadata of the .ac file.
+        jobs: Number of make jobs.
+        start, end, wall_time: Timing of the full script (seconds since epoch and seconds).
+        retcode: Exit status of the script.
+        compiler_cache: Dictionary with the hits and misses of the compiler cache. None if not used.
+        phases: List of dictionaries with phase, start, end, duration, exit_code, peak_rss_kb.
+    """
+
+    @classmethod
+    def from_build(cls, build):
+        """Build the report from a Build object after the execution of the script."""
+        path = os.path.join(build.workdir, EVENTS_FILE)
+        return cls(
+            name=build.name,
+            hostname=build.conf.meta.get("hostname"),
+            jobs=build.jobs,
+            start=build.start_time,
+            end=build.end_time,
+            wall_time=build.wall_time,
+            retcode=build.retcode,
+            compiler_cache=build.compiler_cache_stats,
+            phases=read_events(path) if os.path.exists(path) else [],
+        )
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Read the report from path. path can be a json file or a build directory.
+        If the directory does not contain the report (e.g. the script has been executed by hand),
+        the report is built from the events written by the script.
+        """
+        if os.path.isdir(path):
+            report = os.path.join(path, REPORT_FILE)
+            if not os.path.exists(report):
+                phases = read_events(os.path.join(path, EVENTS_FILE))
+                name = os.path.basename(os.path.abspath(path))
+                if name.startswith("_build_"): name = name[len("_build_"):]
+                start = phases[0]["start"] if phases else None
+                end = phases[-1]["end"] if phases else None
+                return cls(name=name, hostname=None, jobs=None, start=start, end=end,
+                           wall_time=end - start if phases else None,
+                           retcode=phases[-1]["exit_code"] if phases else None, phases=phases)
+            path = report
+
+        with open(path, "rt") as fh:
+            return cls(json.load(fh))
+
+    def write(self, path):
+        """Write the report to path in json format."""
+        with open(path, "wt") as fh:
+            json.dump(self, fh, indent=4)
+
+    def get_phase(self, phase):
+        """Return dictionary with the timing of phase. None if not found."""
+        for d in self["phases"]:
+            if d["phase"] == phase: return d
+        return None
+
+    @property
+    def phase_names(self):
+        """List with the names of the phases."""
+        return [d["phase"] for d in self["phases"]]
+
+
+def compare_reports(reports):
+    """
+    Return string with a table comparing the duration and the peak RSS of the phases in the reports.
+    The relative difference is computed with respect to the first report.
+    """
+    phases = []
+    for report in reports:
+        phases.extend(p for p in report.phase_names if p not in phases)
+
+    def fmt_time(d, ref):
+        if d is None: return "-"
+        s = "%.1f s" % d
+        if ref: s += " (%+.0f%%)" % (100 * (d - ref) / ref)
+        return s
+
+    header = ["phase"] + [r["name"] for r in reports]
+    rows = []
+    for phase in phases + ["total"]:
+        row, ref = [phase], None
+        for i, report in enumerate(reports):
+            if phase == "total":
+                d = report["wall_time"]
+            else:
+                p = report.get_phase(phase)
+                d = p["duration"] if p is not None else None
+            if i == 0: ref = d
+            row.append(fmt_time(d, ref if i > 0 else None))
+        rows.append(row)
+
+    for phase in phases:
+        if all(r.get_phase(phase) is None or r.get_phase(phase).get("peak_rss_kb") is None for r in reports):
+            continue
+        row = ["%s peak RSS" % phase]
+        for report in reports:
+            p = report.get_phase(phase)
+            rss = p.get("peak_rss_kb") if p is not None else None
+            row.append("%.1f MB" % (rss / 1024) if rss is not None else "-")
+        rows.append(row)
+
+    row = ["exit codes"]
+    for report in reports:
+        row.append(" ".join("%s" % p["exit_code"] for p in report["phases"]) or "-")
+    rows.append(row)
+
+    widths = [max(len(r[i]) for r in [header] + rows) for i in range(len(header))]
+    lines = ["  ".join(s.ljust(w) for s, w in zip(row, widths)).rstrip() for row in [header] + rows]
+    lines.insert(1, "  ".join("-" * w for w in widths))
+    return "\n".join(lines)
@@ -18,6 +18,7 @@ def get_ncpus():
     except (ImportError, NotImplementedError):
         pass
 
+    from abiconfig.core.termcolor import cprint
     cprint('Cannot determine number of CPUs on this system! Returning 4', "red")
     return 4
 
@@ -0,0 +1,630 @@
+"""
+Objects used by `abiconf.py workon` to configure and compile Abinit with the settings of .ac files.
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+
+import os
+import time
+import json
+import shutil
+import hashlib
+
+from collections import deque, OrderedDict
+from abiconfig.core.termcolor import cprint
+
+# Name of the file with the number of make jobs. Written by BuildScheduler, read by the workon script.
+JOBS_FILE = ".abiconf_jobs"
+
+# Marker files created by the workon script.
+CONFIGURE_DONE = "__configure_done__"
+MAKE_STARTED = "__make_started__"
+
+# File with the hashes of the inputs of the stages completed in the build directory.
+STAGES_FILE = ".abiconf_stages.json"
+
+# Files used when the build is submitted to the resource manager (see Build.write_batch_script).
+BATCH_SCRIPT = "batch_build.sh"
+BATCH_RETCODE = "batch.retcode"
+
+# Parameters of the queue script used to compile the code on a compute node.
+# {ncores} and {walltime} are replaced by the values passed to Build.get_batch_script_str.
+BATCH_QKWARGS = {
+    "shell": {},
+    "slurm": dict(nodes=1, ntasks=1, cpus_per_task="{ncores}", time="{walltime}"),
+    "pbspro": dict(select="1:ncpus={ncores}", walltime="{walltime}"),
+    "sge": dict(ncpus="{ncores}", walltime="{walltime}"),
+    "moab": dict(nodes="1:ppn={ncores}", walltime="{walltime}"),
+    "bluegene": dict(wall_clock_limit="{walltime}"),
+}
+
+# Parameters of the metadata describing the layout of the MPI run. Replaced by BATCH_QKWARGS.
+RUN_LAYOUT_QKWARGS = ("nodes", "total_tasks", "ntasks", "ntasks_per_node", "cpus_per_task",
+                       "select", "ncpus", "procs")
+
+# Commands used to submit the batch script.
+SUBMIT_CMDS = {
+    "shell": "bash",
+    "slurm": "sbatch",
+    "pbspro": "qsub",
+    "sge": "qsub",
+    "moab": "msub",
+    "bluegene": "llsubmit",
+}
+
+
+class AutoconfCache(object):
+    """
+    Autoconf cache files (configure --cache-file) shared by the builds with the same toolchain.
+    The cache file is selected by a fingerprint computed from the compiler variables, the flags and
+    the external libraries of the .ac file, the pre_configure commands (modules) and the output of
+    `compiler --version` after loading the modules so that the cache is automatically invalidated
+    when the toolchain or the libraries change.
+    """
+    # Variables of the .ac file that define the toolchain.
+    TOOLCHAIN_VARS = ("FC", "CC", "CXX", "CPP", "FPP", "AR", "NVCC", "MPI_RUNNER")
+
+    # Options selecting the features and the external libraries (e.g. with_linalg_flavor, LINALG_LIBS).
+    # The cached link tests (ac_cv_*) depend on them.
+    LIBRARY_PREFIXES = ("with_", "enable_")
+    LIBRARY_SUFFIXES = ("_LIBS", "_INCS", "ROOT")
+
+    @classmethod
+    def in_fingerprint(cls, key):
+        """True if the option `key` of the .ac file is part of the fingerprint."""
+        return (key in cls.TOOLCHAIN_VARS or "FLAGS" in key or
+                key.startswith(cls.LIBRARY_PREFIXES) or key.endswith(cls.LIBRARY_SUFFIXES))
+
+    def __init__(self, cache_dir=None):
+        """
+        Args:
+            cache_dir: Directory with the cache files. Default: ~/.abiconf/autoconf.
+        """
+        from abiconfig.core.cache import get_cache_dir
+        self.cache_dir = os.path.abspath(cache_dir if cache_dir is not None else
+                                         os.path.join(get_cache_dir(), "autoconf"))
+
+    def __repr__(self):
+        return "<%s: %s>" % (self.__class__.__name__, self.cache_dir)
+
+    @classmethod
+    def get_static_fingerprint(cls, conf):
+        """
+        SHA1 hash of the part of the fingerprint that can be computed from the .ac file:
+        compiler variables, flags, external libraries and pre_configure commands.
+        """
+        import json
+        import hashlib
+        items = sorted((k, v) for k, v in conf.items() if cls.in_fingerprint(k))
+        s = json.dumps([items, conf.meta.get("pre_configure", [])])
+        return hashlib.sha1(s.encode("utf-8")).hexdigest()
+
+    def get_configure_lines(self, conf, configure_cmd):
+        """
+        Shell commands executing configure_cmd with the shared cache file.
+        The commands set _abiconf_rc to the exit status of configure.
+        """
+        compilers = [conf[k].split()[0] for k in ("FC", "CC", "CXX") if conf.get(k)]
+        versions = "; ".join("%s --version 2>&1 | head -n 5" % c for c in compilers)
+        cache_file = os.path.join(self.cache_dir, "config-${_abiconf_fp}.cache")
+        return [
+            "# Toolchain fingerprint: .ac file + compiler versions (after module load).",
+            "_abiconf_fp=$( { echo %s; %s; } | sha1sum | cut -c1-16)" % (
+                self.get_static_fingerprint(conf), versions if versions else "true"),
+            '_abiconf_acache="%s"' % cache_file,
+            "rm -f config.cache",
+            '[ -f "$_abiconf_acache" ] && cp "$_abiconf_acache" config.cache && echo "Using autoconf cache $_abiconf_acache"',
+            "abiconf_run %s --cache-file=config.cache" % configure_cmd,
+            "_abiconf_rc=$?",
+            'if [ $_abiconf_rc -ne 0 ] && [ -f "$_abiconf_acache" ]; then',
+            '    echo "configure failed with the cached results, running again without cache" >&2',
+            "    rm -f config.cache",
+            "    abiconf_run %s --cache-file=config.cache" % configure_cmd,
+            "    _abiconf_rc=$?",
+            "fi",
+            "if [ $_abiconf_rc -eq 0 ] && [ -f config.cache ]; then",
+            "    # Atomic update of the shared cache file.",
+            '    mkdir -p %s && cp config.cache "$_abiconf_acache.$$" && mv -f "$_abiconf_acache.$$" "$_abiconf_acache"' % (
+                 self.cache_dir),
+            "fi",
+        ]
+
+
+class Build(object):
+    """
+    Build directory `_build_<name>` associated to a configuration file.
+    The directory contains a copy of the .ac file and a shell script that loads the modules,
+    runs configure and make.
+    """
+
+    def __init__(self, conf, workdir, name=None, compiler_cache=None, autoconf_cache=None, module_env=None):
+        """
+        Args:
+            conf: Config object.
+            workdir: Build directory.
+            name: Name of the build. Default: basename of the .ac file.
+            compiler_cache: CompilerCache object used to wrap the compilers. None if not used.
+            autoconf_cache: AutoconfCache object. None if the configure results should not be shared.
+            module_env: ModuleEnvironment object. If not None, the scripts source the cached environment
+                instead of executing the pre_configure commands.
+        """
+        self.conf = conf
+        self.compiler_cache = compiler_cache
+        self.autoconf_cache = autoconf_cache
+        self.module_env = module_env
+        self.compiler_cache_stats = None
+        self.workdir = os.path.abspath(workdir)
+        self.name = name if name is not None else conf.basename
+        self.script = os.path.join(self.workdir, "workon_" + self.name + ".sh")
+        self.acfile = os.path.join(self.workdir, conf.basename)
+        self.jobs = 1
+        self.process = None
+        self.retcode = None
+        self.start_time, self.end_time = None, None
+
+    @classmethod
+    def from_conf(cls, conf, name=None, top=None, compiler_cache=None, autoconf_cache=None, module_env=None):
+        """
+        Build object for the Config conf. The build directory is created
+        inside top (default: current working directory).
+        """
+        name = name if name is not None else conf.basename
+        top = os.getcwd() if top is None else top
+        return cls(conf, os.path.join(top, "_build_" + name), name=name,
+                   compiler_cache=compiler_cache, autoconf_cache=autoconf_cache, module_env=module_env)
+
+    def __repr__(self):
+        return "<%s: %s, workdir=%s>" % (self.__class__.__name__, self.name, self.workdir)
+
+    def get_stage_hashes(self):
+        """
+        Return OrderedDict stage --> SHA1 hash of the inputs of the stage.
+        The hash of a stage includes the hash of the previous stage so that a change
+        in the inputs of a stage invalidates the following ones.
+        make and post_make are not hashed: they are always executed since make is incremental.
+        """
+        from abiconfig.core.cache import file_sha1
+
+        def sha1(*args):
+            return hashlib.sha1(json.dumps(args).encode("utf-8")).hexdigest()
+
+        configure = os.path.join(os.path.dirname(self.workdir), "configure")
+        meta = self.conf.meta
+        hashes = OrderedDict()
+        hashes["prepare"] = sha1(file_sha1(self.conf.path),
+                                 self.compiler_cache.tool if self.compiler_cache is not None else None)
+        hashes["configure"] = sha1(hashes["prepare"],
+                                   file_sha1(configure) if os.path.exists(configure) else None,
+                                   meta.get("pre_configure", []), meta.get("post_configure", []),
+                                   "nag" in meta["keywords"],
+                                   self.autoconf_cache.cache_dir if self.autoconf_cache is not None else None)
+        hashes["scripts"] = sha1(hashes["prepare"], dict(meta), self.module_env is not None)
+        return hashes
+
+    def _read_stages(self):
+        """Read the hashes of the completed stages. Return dict."""
+        try:
+            with open(os.path.join(self.workdir, STAGES_FILE), "rt") as fh:
+                return json.load(fh)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _write_stages(self, stages):
+        """Write the hashes of the completed stages."""
+        with open(os.path.join(self.workdir, STAGES_FILE), "wt") as fh:
+            json.dump(stages, fh, indent=4)
+
+    def prepare(self, remove=False):
+        """
+        Prepare the build directory and return OrderedDict stage --> status with the stages that
+        will be executed ("run") or skipped ("up-to-date"). If the build directory already exists,
+        the build is resumed: the .ac file is copied again only if it changed and configure
+        is executed only if its inputs (.ac file, metadata, configure script) changed.
+        The object files produced by make are not removed.
+
+        Args:
+            remove: True if an existing build directory should be removed (full rebuild).
+        """
+        if os.path.exists(self.workdir) and remove:
+            cprint("Removing build directory %s" % self.workdir, "yellow")
+            shutil.rmtree(self.workdir)
+
+        if not os.path.exists(self.workdir):
+            cprint("Creating build directory %s" % self.workdir, "yellow")
+            os.mkdir(self.workdir)
+
+        hashes = self.get_stage_hashes()
+        done = self._read_stages()
+        plan = OrderedDict()
+
+        plan["prepare"] = "up-to-date" if done.get("prepare") == hashes["prepare"] else "run"
+        if plan["prepare"] == "run":
+            shutil.copy(self.conf.path, self.acfile)
+            if self.compiler_cache is not None: self.wrap_compilers()
+            done["prepare"] = hashes["prepare"]
+            self._write_stages(done)
+
+        # The workon script writes the hash of the configure stage in the marker file.
+        marker = os.path.join(self.workdir, CONFIGURE_DONE)
+        plan["configure"] = "run"
+        if os.path.exists(marker):
+            with open(marker, "rt") as fh:
+                if fh.read().strip() == hashes["configure"]:
+                    plan["configure"] = "up-to-date"
+                else:
+                    os.remove(marker)
+
+        plan["make"] = "run"
+        plan["post_make"] = "run"
+        plan["scripts"] = "up-to-date" if (done.get("scripts") == hashes["scripts"] and
+                                           os.path.exists(os.path.join(self.workdir, "template_job.sh"))) else "run"
+
+        if os.path.exists(os.path.join(self.workdir, MAKE_STARTED)):
+            os.remove(os.path.join(self.workdir, MAKE_STARTED))
+
+        return plan
+
+    def wrap_compilers(self):
+        """Prefix the compilers in the copy of the .ac file with the compiler cache."""
+        cache = self.compiler_cache
+        with open(self.acfile, "rt") as fh:
+            s, wrapped = cache.wrap_acfile_string(fh.read())
+        with open(self.acfile, "wt") as fh:
+            fh.write(s)
+
+        if wrapped:
+            cprint("Using %s for %s. Cache directory: %s" % (cache.tool, ", ".join(wrapped), cache.cache_dir), "yellow")
+        else:
+            cprint("No compiler found in %s. %s won't be used" % (self.conf.basename, cache.tool), "magenta")
+
+    def get_script_str(self, jobs):
+        """
+        Return string with the shell script to load the modules, run configure and make.
+        The number of make jobs is read from JOBS_FILE (default: jobs) when make starts
+        so that it can be changed while configure is running.
+        Each phase is timed and the results are written to abiconf_timing.jsonl (see abiconfig.core.timing).
+        """
+        from abiconfig.core.timing import SHELL_FUNCTIONS
+        conf = self.conf
+        has_nag = "nag" in conf.meta["keywords"]
+
+        lines = [
+            "#!/bin/bash",
+            "# Generated by abiconf.py on %s" % time.strftime("%c"),
+            "cd %s" % self.workdir,
+            SHELL_FUNCTIONS,
+        ]
+        if self.compiler_cache is not None:
+            lines.extend(self.compiler_cache.get_env_lines(self.workdir) + [""])
+
+        def add_phase(phase, commands):
+            """Commands executed in the current shell. The exit status of the phase is the last non-zero one."""
+            lines.extend(["abiconf_phase_start %s" % phase, "_abiconf_rc=0"])
+            lines.extend("%s || _abiconf_rc=$?" % cmd for cmd in commands)
+            lines.extend(["abiconf_phase_end $_abiconf_rc", ""])
+
+        if self.module_env is not None and conf.meta.get("pre_configure"):
+            lines.extend(["abiconf_phase_start module_load", "_abiconf_rc=0"])
+            lines.extend(self.module_env.get_source_lines(conf.meta["pre_configure"], suffix=" || _abiconf_rc=$?"))
+            lines.extend(["abiconf_phase_end $_abiconf_rc", ""])
+        else:
+            add_phase("module_load", conf.meta.get("pre_configure", []))
+
+        lines.append("abiconf_phase_start configure")
+        if has_nag:
+            # taken from pre_configure_nag.sh
+            lines.append("sed -i -e 's/ -little/& \\| -library/' -e 's/\\-\\#\\#\\#/& -dryrun/' ../configure")
+        configure_cmd = "../configure --with-config-file='%s'" % os.path.basename(self.acfile)
+        # The marker contains the hash of the inputs of configure (see prepare).
+        configure_hash = self.get_stage_hashes()["configure"]
+        if self.autoconf_cache is None:
+            lines.extend([
+                "if [ ! -f %s ]; then" % CONFIGURE_DONE,
+                "    abiconf_run %s && echo %s > %s" % (configure_cmd, configure_hash, CONFIGURE_DONE),
+                "fi",
+                "_abiconf_rc=$?",
+            ])
+        else:
+            lines.append("_abiconf_rc=0")
+            lines.append("if [ ! -f %s ]; then" % CONFIGURE_DONE)
+            lines.extend("    " + l for l in self.autoconf_cache.get_configure_lines(self.conf, configure_cmd))
+            lines.append("    [ $_abiconf_rc -eq 0 ] && echo %s > %s" % (configure_hash, CONFIGURE_DONE))
+            lines.append("fi")
+        if has_nag:
+            # taken from post_configure_nag.sh
+            lines.append("sed -i -e 's/\t\\$.FCFLAGS. \\//' src/98_main/Makefile")
+        lines.extend(["abiconf_phase_end $_abiconf_rc", ""])
+
+        if conf.meta.get("post_configure"):
+            add_phase("post_configure", conf.meta["post_configure"])
+
+        # stdout and stderr are saved to file by the Process executing the script.
+        lines.append("touch %s" % MAKE_STARTED)
+        if self.compiler_cache is not None: lines.extend(self.compiler_cache.get_pre_make_lines())
+        lines.extend([
+            "abiconf_phase_start make",
+            "abiconf_run make -j$(cat %s 2>/dev/null || echo %d)" % (JOBS_FILE, jobs),
+            "make_retcode=$?",
+            "abiconf_phase_end $make_retcode",
+        ])
+        if self.compiler_cache is not None: lines.extend(self.compiler_cache.get_post_make_lines())
+        lines.append("")
+
+        if conf.meta.get("post_make"):
+            add_phase("post_make", conf.meta["post_make"])
+
+        lines.append("# make check")
+        # return if the script is sourced, exit if executed.
+        lines.append("return $make_retcode 2>/dev/null || exit $make_retcode")
+
+        return "\n".join(lines) + "\n"
+
+    def write_script(self, jobs):
+        """Write the workon script and the file with the number of make jobs."""
+        self.set_jobs(jobs)
+        with open(self.script, "wt") as fh:
+            fh.write(self.get_script_str(jobs))
+
+    def write_job_scripts(self):
+        """Write the submission script templates to the build directory."""
+        path = os.path.join(self.workdir, "template_job.sh")
+        cprint("Writing submission script template to %s" % os.path.relpath(path), "yellow")
+        with open(path, "wt") as fh:
+            fh.write(self.conf.get_script_str(module_env=self.module_env))
+
+        path = os.path.join(self.workdir, "launch_runtests_job.sh")
+        cprint("Writing submission script for runtests.py to %s" % os.path.relpath(path), "yellow")
+        with open(path, "wt") as fh:
+            fh.write(self.conf.get_runtests_script_str(module_env=self.module_env))
+
+        done = self._read_stages()
+        done["scripts"] = self.get_stage_hashes()["scripts"]
+        self._write_stages(done)
+
+    def set_jobs(self, jobs):
+        """Set the number of make jobs. Has no effect if make already started."""
+        self.jobs = jobs
+        with open(os.path.join(self.workdir, JOBS_FILE), "wt") as fh:
+            fh.write("%d\n" % jobs)
+
+    @property
+    def make_started(self):
+        """True if the script already executed make."""
+        return os.path.exists(os.path.join(self.workdir, MAKE_STARTED))
+
+    def start(self, echo=True, prefix="", timeout=None):
+        """
+        Execute the workon script in a subprocess. stdout and stderr are saved
+        in workon.stdout and workon.stderr in the build directory.
+
+        Args:
+            echo: True if the output should be shown in the terminal as well.
+            prefix: String added at the beginning of the lines shown in the terminal.
+            timeout: The build is cancelled after timeout seconds. None for no limit.
+        """
+        from abiconfig.core.runner import Process
+        self.start_time = time.time()
+        self.process = Process(["bash", self.script], cwd=self.workdir,
+                               stdout_path=os.path.join(self.workdir, "workon.stdout"),
+                               stderr_path=os.path.join(self.workdir, "workon.stderr"),
+                               echo=echo, prefix=prefix)
+        self.process.start(timeout=timeout)
+
+    def poll(self):
+        """Return exit status of the script or None if still running."""
+        if self.retcode is None and self.process is not None:
+            self.retcode = self.process.poll()
+            if self.retcode is not None:
+                self.end_time = time.time()
+                if self.compiler_cache is not None:
+                    self.compiler_cache_stats = self.compiler_cache.get_stats(self.workdir)
+                self.write_timing_report()
+        return self.retcode
+
+    def write_timing_report(self):
+        """Write the json file with the timing of the phases to the build directory. Return TimingReport."""
+        from abiconfig.core.timing import TimingReport, REPORT_FILE
+        report = TimingReport.from_build(self)
+        report.write(os.path.join(self.workdir, REPORT_FILE))
+        return report
+
+    def cancel(self):
+        """Kill the script and all its children."""
+        if self.process is not None:
+            self.process.cancel()
+            self.poll()
+
+    @property
+    def status(self):
+        """String with the status of the build."""
+        if self.process is None: return "not started"
+        if self.retcode is None: return "running"
+        if self.process.timed_out: return "timeout"
+        if self.process.cancelled: return "cancelled"
+        return "ok" if self.retcode == 0 else "failed"
+
+    @property
+    def wall_time(self):
+        """Wall time in seconds. None if the build did not start."""
+        if self.start_time is None: return None
+        return (self.end_time if self.end_time is not None else time.time()) - self.start_time
+
+    def get_batch_script_str(self, ncores, walltime="02:00:00"):
+        """
+        Return string with the queue script executing the workon script on a compute node.
+        The resources are taken from the qkwargs of the metadata, the layout of the MPI run is replaced
+        by a single task with ncores cores. The number of make jobs is set to the number of cores
+        available at runtime and the exit status of the workon script is written to BATCH_RETCODE.
+        The timing report is written at the end of the job.
+
+        Args:
+            ncores: Number of cores requested.
+            walltime: Wall time requested (format accepted by the resource manager).
+        """
+        import sys
+        import shlex
+        from abiconfig.core.qtemplates import QueueTemplate
+        from abiconfig.core.timing import REPORT_FILE
+        qtype = self.conf.meta.get("qtype", "shell")
+        if qtype not in BATCH_QKWARGS:
+            raise ValueError("Cannot submit the build with qtype: %s" % qtype)
+
+        qkwargs = dict((k, v) for k, v in self.conf.meta.get("qkwargs", {}).items() if k not in RUN_LAYOUT_QKWARGS)
+        for k, v in BATCH_QKWARGS[qtype].items():
+            qkwargs[k] = v.format(ncores=ncores, walltime=walltime) if isinstance(v, str) else v
+        qkwargs.update(job_name="build_" + self.name,
+                       _qout_path=os.path.join(self.workdir, "batch.qout"),
+                       _qerr_path=os.path.join(self.workdir, "batch.qerr"))
+
+        # Directory containing the abiconfig package.
+        pythonpath = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        lines = QueueTemplate.from_qtype(qtype).substitute(qkwargs).splitlines()
+        lines.extend([
+            "",
+            "cd %s" % self.workdir,
+            "rm -f %s" % BATCH_RETCODE,
+            "# Use all the cores of the allocation.",
+            "nproc > %s" % JOBS_FILE,
+            "bash %s > workon.stdout 2> workon.stderr" % os.path.basename(self.script),
+            "rc=$?",
+            "echo $rc > %s" % BATCH_RETCODE,
+            "# Timing report (see abiconf.py timing). Skipped if abiconfig cannot be imported on the compute node.",
+            "PYTHONPATH=%s${PYTHONPATH:+:$PYTHONPATH} %s -c %s 2>/dev/null" % (
+                shlex.quote(pythonpath), shlex.quote(sys.executable), shlex.quote(
+                'from abiconfig.core.timing import TimingReport; TimingReport.from_file(".").write("%s")' % REPORT_FILE)),
+            "exit $rc",
+        ])
+        return "\n".join(lines) + "\n"
+
+    def write_batch_script(self, ncores, walltime="02:00:00"):
+        """Write the queue script to the build directory. Return its path."""
+        path = os.path.join(self.workdir, BATCH_SCRIPT)
+        with open(path, "wt") as fh:
+            fh.write(self.get_batch_script_str(ncores, walltime=walltime))
+        return path
+
+    def submit(self):
+        """
+        Submit the queue script written by write_batch_script. Return the exit status of the submission command.
+        With qtype `shell`, the build is executed in the current process (useful for testing).
+        Return 127 if the submission command is not available on this machine, 1 if the qtype is not supported.
+        """
+        import subprocess
+        qtype = self.conf.meta.get("qtype", "shell")
+        cmd = SUBMIT_CMDS.get(qtype)
+        if cmd is None:
+            cprint("Cannot submit %s with qtype: %s" % (self.name, qtype), "red")
+            return 1
+        cprint("Submitting %s with %s" % (os.path.join(self.workdir, BATCH_SCRIPT), cmd), "yellow")
+        try:
+            return subprocess.call([cmd, BATCH_SCRIPT], cwd=self.workdir)
+        except OSError as exc:
+            cprint("Cannot execute `%s` to submit %s: %s" % (cmd, self.name, str(exc)), "red")
+            return 127
+
+    @property
+    def batch_retcode(self):
+        """Exit status of the workon script executed by the queue script. None if not available."""
+        try:
+            with open(os.path.join(self.workdir, BATCH_RETCODE), "rt") as fh:
+                return int(fh.read())
+        except (IOError, OSError, ValueError):
+            return None
+
+    def print_errors(self, nlines=50):
+        """Print the last nlines of workon.stderr."""
+        stderr_path = os.path.join(self.workdir, "workon.stderr")
+        if not os.path.exists(stderr_path): return
+        with open(stderr_path, "rt") as fh:
+            lines = fh.readlines()[-nlines:]
+        if lines:
+            cprint("Errors found in %s (last %d lines):" % (stderr_path, len(lines)), "red")
+            cprint("".join(lines), "red")
+
+
+class BuildScheduler(object):
+    """
+    Execute several builds concurrently with a shared budget of cores.
+    The cores are split between the running builds that did not start make yet,
+    the cores released by a build that finished are given to the other builds.
+    """
+
+    def __init__(self, builds, ncores, max_builds=None, poll_interval=0.5):
+        """
+        Args:
+            builds: List of Build objects.
+            ncores: Total number of cores used by the make processes.
+            max_builds: Max number of builds executed at the same time. Default: all.
+            poll_interval: Time in seconds between two checks of the status of the builds.
+        """
+        self.builds = list(builds)
+        self.ncores = max(1, ncores)
+        self.max_builds = len(self.builds) if max_builds is None else max(1, max_builds)
+        self.poll_interval = poll_interval
+
+    def split_cores(self, running):
+        """
+        Distribute the cores among the running builds.
+        Builds that already started make keep their number of jobs.
+        """
+        fixed = [b for b in running if b.make_started]
+        flexible = [b for b in running if not b.make_started]
+        if not flexible: return
+        avail = max(len(flexible), self.ncores - sum(b.jobs for b in fixed))
+        base, extra = divmod(avail, len(flexible))
+        for i, build in enumerate(flexible):
+            jobs = base + (1 if i < extra else 0)
+            if jobs != build.jobs: build.set_jobs(jobs)
+
+    def run(self, echo=None, timeout=None):
+        """
+        Execute the builds. Return number of builds that failed.
+        The builds are cancelled if the execution is interrupted with Ctrl+C.
+
+        Args:
+            echo: True if the output of the scripts should be shown in the terminal.
+                Default: True if one build. The output is always saved in the build directories.
+            timeout: Builds are cancelled after timeout seconds. None for no limit.
+        """
+        if echo is None: echo = len(self.builds) == 1
+        prefix = "" if len(self.builds) == 1 else "[%s] "
+        pending, running = deque(self.builds), []
+        try:
+            while pending or running:
+                for build in [b for b in running if b.poll() is not None]:
+                    running.remove(build)
+                    color = "green" if build.retcode == 0 else "red"
+                    cprint("Build %s completed with retcode %s (%s)" % (build.name, build.retcode, build.status), color)
+                    if build.compiler_cache is not None:
+                        from abiconfig.core.compiler_cache import format_stats
+                        cprint("%s: %s" % (build.compiler_cache.tool, format_stats(build.compiler_cache_stats)), color)
+
+                new = []
+                while pending and len(running) < self.max_builds:
+                    new.append(pending.popleft())
+                    running.append(new[-1])
+                self.split_cores(running)
+                for build in new:
+                    cprint("Starting build %s with make -j%d" % (build.name, build.jobs), "yellow")
+                    build.start(echo=echo, prefix=prefix % build.name if prefix else "", timeout=timeout)
+
+                if running: time.sleep(self.poll_interval)
+
+        except KeyboardInterrupt:
+            cprint("Cancelling %d running build(s)" % len(running), "red")
+            for build in running:
+                build.cancel()
+            raise
+
+        return sum(1 for b in self.builds if b.retcode != 0)
+
+    def print_summary(self):
+        """Print table with the wall time and the exit status of the builds."""
+        from abiconfig.core.compiler_cache import format_stats
+        width = max([len(b.name) for b in self.builds] + [5])
+        print("%-*s %10s %8s %12s" % (width, "Build", "Wall time", "Retcode", "Status"))
+        for build in self.builds:
+            wall = "%.1f s" % build.wall_time if build.wall_time is not None else "-"
+            line = "%-*s %10s %8s %12s" % (width, build.name, wall, build.retcode, build.status)
+            if build.compiler_cache is not None:
+                line += "   %s: %s" % (build.compiler_cache.tool, format_stats(build.compiler_cache_stats))
+            cprint(line, "green" if build.retcode == 0 else "red")
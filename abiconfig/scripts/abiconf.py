@@ -7,32 +7,80 @@ from __future__ import unicode_literals, division, print_function, absolute_impo
 
 import sys
 import os
-import argparse
-import time
-import shutil
-
-from pprint import pprint
-from socket import gethostname
-from abiconfig.core.utils import get_ncpus, marquee, is_string, which, chunks, pprint_table, find_abinit_toptree
-from abiconfig.core import termcolor
+
 from abiconfig.core.termcolor import cprint, colored
-from abiconfig.core.options import AbinitConfigureOptions, ConfigMeta, Config, ConfigList, get_actemplate_string
-from abiconfig.core import release
+
+# NB: This script is executed from shell prompts and login scripts so startup time matters.
+# Each subcommand imports only the modules it needs (see tests/test_startup.py).
 
 
-def get_configs(options):
+def get_configs(options, lazy=False):
     """
     Return list of configuration files found if clusters if -b is not used else
     buildbot configuration files.
+    lazy=True should be used if only the metadata section is needed.
+    """
+    from abiconfig.core.options import ConfigList
+    if getattr(options, "buildbot", False):
+        return get_buildbot_configs(options, lazy=lazy)
+    else:
+        return ConfigList.get_clusters(use_cache=not options.no_cache, lazy=lazy)
+
+
+def get_buildbot_configs(options, lazy=False):
+    """
+    Parse the buildbot configuration files in parallel.
+    Files that cannot be parsed are reported and skipped.
+    """
+    from abiconfig.core.options import ConfigList
+    configs = ConfigList.get_buildbot_configs(use_cache=not options.no_cache, lazy=lazy, nprocs=options.nprocs)
+    configs.print_parse_errors()
+    return configs
+
+
+def print_meta_warnings(configs):
+    """
+    Print the warnings about the metadata of configs (e.g. misspelled qkwargs).
+    The scripts are still generated, the unsupported parameters are ignored.
     """
+    for conf in configs:
+        for warning in conf.meta.get_warnings():
+            cprint("%s: %s" % (conf.basename, warning), "yellow")
+
+
+def get_jobs(options):
+    """
+    Number of make jobs from the --jobs and --mem-per-job options.
+    `auto` uses the CPUs and the memory available to the process (affinity, cgroup limits),
+    0 means half of the CPUs.
+    """
+    if options.jobs == "auto":
+        from abiconfig.core.resources import Resources
+        resources = Resources.probe()
+        cprint(resources.to_string(mem_per_job=options.mem_per_job), "blue")
+        return resources.get_jobs(mem_per_job=options.mem_per_job)
+
+    from abiconfig.core.utils import get_ncpus
+    jobs = int(options.jobs)
+    return jobs if jobs != 0 else max(1, get_ncpus() // 2)
+
+
+def get_index(options):
+    """
+    Return ConfigIndex for the configuration files in clusters if -b is not used else
+    for the buildbot configuration files.
+    """
+    from abiconfig.core.index import ConfigIndex
     if getattr(options, "buildbot", False):
-        return ConfigList.get_buildbot_configs()
+        return ConfigIndex.from_configs(get_buildbot_configs(options, lazy=True))
     else:
-        return ConfigList.get_clusters()
+        return ConfigIndex.get_clusters(use_cache=not options.no_cache)
 
 
 def abiconf_new(options):
     """Generate new configuration file."""
+    from socket import gethostname
+    from abiconfig.core.options import get_actemplate_string
     template = get_actemplate_string()
     new_filename = options.new_filename
     if new_filename is None:
@@ -45,7 +93,9 @@ def abiconf_new(options):
 
 def abiconf_opts(options):
     """List available configure options."""
-    confopts = AbinitConfigureOptions.from_myoptions_conf()
+    from abiconfig.core.utils import marquee, pprint_table
+    from abiconfig.core.options import AbinitConfigureOptions
+    confopts = AbinitConfigureOptions.from_myoptions_conf(use_cache=not options.no_cache)
 
     if options.optnames is None or not options.optnames:
         # Print all options.
@@ -74,45 +124,89 @@ def abiconf_opts(options):
 
 def abiconf_bbcov(options):
     """Analyse the coverage of autoconf options in the Abinit test farm."""
+    from abiconfig.core.options import AbinitConfigureOptions, ConfigList
+    if options.incremental:
+        return bbcov_incremental(options)
+
     # Either build configs from internal directories or from command-line arguments.
     paths = options.paths
+    kwargs = dict(use_cache=not options.no_cache, nprocs=options.nprocs)
     if paths is None or not paths:
         # No argument provided --> Find directory with buildbot ac files and read them.
         # Assume we are inside an Abinit package.
-        configs = ConfigList.get_buildbot_configs()
+        configs = ConfigList.get_buildbot_configs(**kwargs)
     else:
         # paths can be a directory name or list of files.
         if len(paths) == 1 and os.path.isdir(paths[0]):
-            configs = ConfigList.from_dir(paths[0])
+            configs = ConfigList.from_dir(paths[0], **kwargs)
         else:
-            configs = ConfigList.from_files(paths)
+            configs = ConfigList.from_files(paths, **kwargs)
 
-    return configs.buildbot_coverage(AbinitConfigureOptions.from_myoptions_conf(),
-                                     verbose=options.verbose)
+    # Files that cannot be parsed are reported and counted as errors.
+    retcode = configs.print_parse_errors()
+    confopts = AbinitConfigureOptions.from_myoptions_conf(use_cache=not options.no_cache)
+    return retcode + configs.buildbot_coverage(confopts, verbose=options.verbose)
+
+
+def bbcov_incremental(options):
+    """
+    Incremental version of bbcov: only the files that changed since the last run are parsed.
+    The exit code is the same as the one of the non-incremental version.
+    """
+    from abiconfig.core.options import AbinitConfigureOptions, ConfigList
+    from abiconfig.core.coverage import IncrementalCoverage, get_state_path
+    paths = options.paths
+    if paths is None or not paths:
+        top = ConfigList.get_buildbot_dir()
+        cprint("Looking for buildbot AC files in %s" % top, "yellow")
+        acfiles = ConfigList._find_acfiles(top)
+    elif len(paths) == 1 and os.path.isdir(paths[0]):
+        top = paths[0]
+        acfiles = ConfigList._find_acfiles(top)
+    else:
+        acfiles = [p for p in paths if p.endswith(".ac")]
+        top = os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in acfiles])
+
+    confopts = AbinitConfigureOptions.from_myoptions_conf(use_cache=not options.no_cache)
+    state_path = options.state if options.state is not None else get_state_path(top)
+    state = IncrementalCoverage.from_file(state_path, confopts)
+    added, modified, removed, parse_errors = state.update(acfiles, use_cache=not options.no_cache,
+                                                          nprocs=options.nprocs)
+    state.save()
+
+    for path, err in parse_errors:
+        cprint("Exception while parsing %s:\n%s" % (path, err), "red")
+    if parse_errors:
+        cprint("%d file(s) could not be parsed" % len(parse_errors), "red")
+
+    state.print_changes(added, modified, removed)
+    return len(parse_errors) + state.matrix.print_report(verbose=options.verbose)
 
 
 def abiconf_hostname(options):
     """Find configuration files for this hostname."""
+    from abiconfig.core.utils import marquee, chunks
 
     def show_hostnames():
         cprint(marquee("Available hostnames"), "yellow")
-        all_hosts = sorted({conf.meta["hostname"] for conf in configs})
+        all_hosts = sorted(index.hostnames)
         for chunk in chunks(all_hosts, 7):
             cprint(", ".join(chunk), "blue")
 
+    index = get_index(options)
     if options.show_hostnames:
         show_hostnames()
         return 0
 
-    hostname = gethostname() if options.hostname is None else options.hostname
+    from pprint import pprint
+    hostname = options.hostname
+    if hostname is None:
+        from socket import gethostname
+        hostname = gethostname()
+
     nfound = 0
-    configs = get_configs(options)
-    for conf in configs:
-        # TODO: Should handle foo.bar.be case
-        #if not (hostname in conf.meta["keywords"] or hostname in conf.basename):
-        print(conf)
-        if not hostname in conf.meta["hostname"]:
-            continue
+    # TODO: Should handle foo.bar.be case
+    for conf in index.find_hostname(hostname):
         nfound += 1
         cprint(marquee(conf.basename), "yellow")
         if options.verbose:
@@ -131,7 +225,8 @@ def abiconf_hostname(options):
 
 def abiconf_list(options):
     """List all configuration files."""
-    configs = get_configs(options)
+    from abiconfig.core.utils import marquee
+    configs = get_configs(options, lazy=options.verbose == 0)
 
     width = 92
     for i, config in enumerate(configs):
@@ -150,14 +245,12 @@ def abiconf_list(options):
 def abiconf_show(options):
     """Find configuration file from its basename and print it to terminal."""
     if options.basename is None or not options.basename:
-        confopts = AbinitConfigureOptions.from_myoptions_conf()
         return abiconf_list(options)
 
-    configs = get_configs(options)
-    for i, config in enumerate(configs):
-        if config.basename == options.basename:
-            print(config)
-            return 0
+    config = get_index(options).find_basename(options.basename)
+    if config is not None:
+        print(config)
+        return 0
     else:
         cprint("Cannot find configuration file for `%s`" % options.basename, "red")
         return abiconf_list(options)
@@ -165,34 +258,35 @@ def abiconf_show(options):
 
 def abiconf_keys(options):
     """Find configuration files containing keywords."""
-    configs = get_configs(options)
-    if options.keys is None or not options.keys:
+    from pprint import pprint
+    from abiconfig.core.utils import marquee, chunks, is_string
+    index = get_index(options)
+    if (options.keys is None or not options.keys) and not options.optvals:
         # Print list of available keywords.
-        all_keys = set()
-        for conf in configs:
-            all_keys.update(conf.meta["keywords"])
+        all_keys = sorted(index.keywords)
 
         cprint(marquee("Available keywords"), "yellow")
         for chunk in chunks(all_keys, 7):
             cprint(", ".join(chunk), "magenta")
 
     else:
-        # Find configuration files containing keywords.
+        # Find configuration files containing keywords and options.
         keys = options.keys
         if is_string(keys): keys = [keys]
-        keys = set(keys)
-        nfound = 0
+        configs = index.find_keywords(keys) if keys else index.configs
+        if options.optvals:
+            selected = set(c.path for c in index.find_options(options.optvals))
+            configs = [c for c in configs if c.path in selected]
+
         for conf in configs:
-            if keys.issubset(conf.meta["keywords"]):
-                nfound += 1
-                print("")
-                cprint(marquee(conf.basename), "yellow")
-                if options.verbose:
-                    conf.cprint()
-                else:
-                    pprint(conf.meta)
+            print("")
+            cprint(marquee(conf.basename), "yellow")
+            if options.verbose:
+                conf.cprint()
+            else:
+                pprint(conf.meta)
 
-        if options.verbose == 0 and nfound != 0:
+        if options.verbose == 0 and configs:
             print("\nUse -v for further information")
 
     return 0
@@ -200,26 +294,153 @@ def abiconf_keys(options):
 
 def abiconf_script(options):
     """Generate submission script from configuration file."""
-    path = options.path
-    if path is None:
+    if options.outdir is not None:
+        return script_batch(options)
+
+    if not options.paths:
         return abiconf_list(options)
+    path = options.paths[0]
 
+    from abiconfig.core.options import Config
+    from abiconfig.core.index import ConfigIndex
     if os.path.exists(path):
         conf = Config.from_file(path)
     else:
-        configs = ConfigList.get_clusters()
-        for conf in configs:
-            if conf.basename == path: break
-        else:
+        conf = ConfigIndex.get_clusters(use_cache=not options.no_cache).find_basename(path)
+        if conf is None:
             cprint("Cannot find %s in internal list" % path, "red")
             return abiconf_list(options)
 
+    print_meta_warnings([conf])
     print(conf.get_script_str())
     return 0
 
 
+def script_batch(options):
+    """
+    Write the submission scripts, the runtests scripts and the workon scripts
+    of all the configuration files (or the ones selected with paths/keywords) to options.outdir.
+    """
+    from abiconfig.core.options import Config
+    from abiconfig.core.batch import ScriptGenerator
+    index = get_index(options)
+    configs = []
+    for path in options.paths:
+        conf = Config.from_file(path) if os.path.isfile(path) else index.find_basename(path)
+        if conf is None:
+            cprint("Cannot find configuration file associated to `%s`" % path, "red")
+            return 1
+        configs.append(conf)
+    if options.keywords:
+        configs.extend(index.find_keywords(options.keywords))
+    if not options.paths and not options.keywords:
+        configs = index.configs
+
+    # A file selected both by path and by keyword is generated once.
+    seen = set()
+    configs = [c for c in configs if not (c.path in seen or seen.add(c.path))]
+
+    print_meta_warnings(configs)
+    generator = ScriptGenerator(options.outdir, build_top=options.build_top, jobs=get_jobs(options))
+    nerrors = generator.generate(configs, nprocs=options.nprocs)
+    generator.print_summary(verbose=options.verbose)
+    return nerrors
+
+
+def abiconf_runtests(options):
+    """Generate the runtests jobs, merge their output or report the speedup and the efficiency of the runs."""
+    if options.action == "collect":
+        from abiconfig.core.runtests import collect_runs
+        workdir = options.paths[0] if options.paths else os.getcwd()
+        print(collect_runs(workdir))
+        return 0
+
+    if options.action == "report":
+        from abiconfig.core.runtests import RuntestsResults, compare_results, write_csv, write_json
+        results = [RuntestsResults.from_dir(d) for d in (options.paths or [os.getcwd()])]
+        print(compare_results(results))
+        if options.csv:
+            write_csv(results, options.csv)
+            cprint("Results written to %s" % options.csv, "yellow")
+        if options.json:
+            write_json(results, options.json)
+            cprint("Results written to %s" % options.json, "yellow")
+        return 0
+
+    if not options.paths:
+        return abiconf_list(options)
+    from abiconfig.core.options import Config
+    from abiconfig.core.runtests import RuntestsJobs
+    path = options.paths[0]
+    if os.path.isfile(path):
+        conf = Config.from_file(path)
+    else:
+        conf = get_index(options).find_basename(path)
+        if conf is None:
+            cprint("Cannot find configuration file associated to `%s`" % path, "red")
+            return 1
+
+    print_meta_warnings([conf])
+    jobs = RuntestsJobs(conf, walltime=options.walltime)
+    try:
+        driver = jobs.write(options.outdir, mode=options.mode)
+    except ValueError as exc:
+        cprint(str(exc), "red")
+        return 1
+    cprint("Execute:\n\t`%s`\n\nto submit the jobs and\n\t`abiconf.py runtests collect %s`\n\nto merge the results"
+           % (os.path.relpath(driver), os.path.relpath(options.outdir)), "yellow")
+    return 0
+
+
+def abiconf_scaling(options):
+    """Generate the jobs of a strong/weak scaling study of an ABINIT input or report the results."""
+    from abiconfig.core.scaling import ScalingStudy, ScalingResults
+    if options.action == "report":
+        results = ScalingResults.from_dir(options.paths[0] if options.paths else os.getcwd())
+        print(results)
+        if options.csv:
+            results.write_csv(options.csv)
+            cprint("Results written to %s" % options.csv, "yellow")
+        return 0
+
+    if len(options.paths) != 2:
+        cprint("scaling gen requires the configuration file and the ABINIT input", "red")
+        return 1
+    from abiconfig.core.options import Config
+    confname, input_path = options.paths
+    conf = Config.from_file(confname) if os.path.isfile(confname) else get_index(options).find_basename(confname)
+    if conf is None:
+        cprint("Cannot find configuration file associated to `%s`" % confname, "red")
+        return 1
+    print_meta_warnings([conf])
+
+    def parse_vars(items, convert=str):
+        d = {}
+        for item in items:
+            name, sep, value = item.partition("=")
+            if not sep: raise ValueError("Expecting name=value, got: %s" % item)
+            d[name.strip()] = convert(value.strip())
+        return d
+
+    try:
+        study = ScalingStudy(conf, input_path, nodes=options.nodes, mpi_procs=options.mpi_procs,
+                             omp_threads=options.omp_threads, cores_per_node=options.cores_per_node,
+                             paral_vars=parse_vars(options.paral_vars), weak_vars=parse_vars(options.weak, int),
+                             walltime=options.walltime, mpirun=options.mpirun, abinit=options.abinit)
+    except ValueError as exc:
+        cprint(str(exc), "red")
+        return 1
+
+    driver = study.write(options.outdir)
+    cprint("%d points written to %s. Execute:\n\t`%s`\n\nto submit the jobs and\n\t`abiconf.py scaling report %s`\n\n"
+           "to analyze the results" % (len(study.points), options.outdir, os.path.relpath(driver),
+                                       os.path.relpath(options.outdir)), "yellow")
+    return 0
+
+
 def abiconf_convert(options):
     """Read a configuration file without metadata section and convert it."""
+    from abiconfig.core.options import Config, ConfigMeta
     path = options.path
     try:
         Config.from_file(path)
@@ -242,129 +463,175 @@ def abiconf_convert(options):
     return 0
 
 
+def abiconf_index(options):
+    """Build the index of the configuration files and write it to file."""
+    from abiconfig.core.options import ConfigList
+    from abiconfig.core.index import ConfigIndex, get_clusters_dir
+    top = options.top
+    if top is None:
+        top = get_clusters_dir()
+    configs = ConfigList.from_dir(top, use_cache=not options.no_cache)
+
+    index = ConfigIndex.from_configs(configs)
+    filepath = os.path.join(top, ConfigIndex.FILENAME)
+    index.write(filepath)
+    cprint("Index with %d configuration files written to %s" % (len(index), filepath), "yellow")
+    return 0
+
+
+def abiconf_timing(options):
+    """Compare the timing reports of workon builds."""
+    from abiconfig.core.timing import TimingReport, compare_reports
+    reports = []
+    for path in options.paths:
+        try:
+            reports.append(TimingReport.from_file(path))
+        except (IOError, OSError, ValueError) as exc:
+            cprint("Cannot read timing report from %s:\n%s" % (path, str(exc)), "red")
+            return 1
+
+    if options.json:
+        import json
+        print(json.dumps(reports, indent=4))
+    else:
+        print(compare_reports(reports))
+    return 0
+
+
 def abiconf_workon(options):
     """
     Compile the code with the settings and the modules specified
-    in the autoconf file.
+    in the autoconf file(s).
     """
     # If confname is not specified, print full list and return
-    if options.confname is None:
+    if not options.confnames and not options.keywords:
         print("Available configuration files.")
         return abiconf_list(options)
 
-    configs = get_configs(options)
+    from abiconfig.core.options import Config
+    from abiconfig.core.workon import Build, BuildScheduler
 
-    confname = options.confname
-    if os.path.exists(confname):
-        if os.path.isfile(confname):
-            # Init conf from local file
-            conf = Config.from_file(confname)
+    configs = []
+    for confname in options.confnames:
+        if os.path.exists(confname):
+            if os.path.isfile(confname):
+                # Init conf from local file
+                configs.append(Config.from_file(confname))
+            else:
+                raise RuntimeError("Found directory with same name as AC file!")
         else:
-            raise RuntimeError("Found directory with same name as AC file!")
-    else:
-        # Find it in the abiconf database.
+            # Find it in the abiconf database.
+            conf = get_index(options).find_basename(confname)
+            if conf is None:
+                cprint("Cannot find configuration file associated to `%s`" % confname, "red")
+                return abiconf_list(options)
+            configs.append(conf)
+
+    if options.keywords:
+        found = get_index(options).find_keywords(options.keywords)
+        if not found:
+            cprint("Cannot find configuration files with keywords: %s" % str(options.keywords), "red")
+            return 1
+        configs.extend(c for c in found if c.path not in set(conf.path for conf in configs))
+
+    print_meta_warnings(configs)
+    if options.batch:
+        from abiconfig.core.workon import BATCH_QKWARGS, SUBMIT_CMDS
         for conf in configs:
-            if conf.basename == confname or conf.path == confname: break
-        else:
-            cprint("Cannot find configuration file associated to `%s`" % confname, "red")
-            return abiconf_list(options)
+            qtype = conf.meta.get("qtype", "shell")
+            if qtype not in BATCH_QKWARGS or qtype not in SUBMIT_CMDS:
+                cprint("Cannot submit the build of %s with qtype: %s. Supported: %s" % (
+                       conf.basename, qtype, ", ".join(sorted(BATCH_QKWARGS))), "red")
+                return 1
 
     if options.verbose:
-        #cprint("Reading configuration file %s" % confname, "yellow")
-        print("Configuration file:")
-        print(conf)
+        for conf in configs:
+            print("Configuration file:")
+            print(conf)
 
     # Script must be executed inside the abinit source tree.
     #abinit_top = find_abinit_toptree()
 
-    cwd = os.getcwd()
-    workdir = os.path.join(cwd, "_build_" + confname)
-    script = os.path.join(workdir, "workon_" + confname + ".sh")
-    acfile = os.path.join(workdir, conf.basename)
+    # Total number of cores shared by the builds.
+    ncores = get_jobs(options)
 
-    # Look before you leap.
-    if os.path.exists(workdir):
-        if not options.remove:
-            cprint("Build directory `%s` already exists. Use `-r to remove it`. Returning" % workdir, "red")
+    compiler_cache = None
+    if options.compiler_cache is not None:
+        from abiconfig.core.compiler_cache import CompilerCache
+        try:
+            compiler_cache = CompilerCache(options.compiler_cache, cache_dir=options.compiler_cache_dir)
+        except ValueError as exc:
+            cprint(str(exc), "red")
             return 1
-        else:
-            shutil.rmtree(workdir)
-
-    # Create build directory, copy ac file.
-    # generare shell script to load modules, run configure and make.
-    cprint("Creating build directory %s" % workdir, "yellow")
-    os.mkdir(workdir)
-    shutil.copy(conf.path, acfile)
-
-    # Write shell script to start new with modules and run it.
-    has_nag = "nag" in conf.meta["keywords"]
-    nthreads = options.jobs
-    if nthreads == 0: nthreads = max(1, get_ncpus() // 2)
-
-    with open(script, "w+") as fh:
-        fh.write("#!/bin/bash\n")
-        fh.write("# Generated by abiconf.py on %s\n" % time.strftime("%c"))
-        fh.write("cd %s\n" % workdir)
-        for cmd in conf.meta.get("pre_configure", []):
-            fh.write("%s\n" % cmd)
-
-        conf_lines = [
-            "[ ! -f __configure_done__ ] && ../configure --with-config-file='%s' && touch __configure_done__\n" % os.path.basename(acfile),
-        ]
-        if has_nag:
-            # taken from pre_configure_nag.sh
-            conf_lines.insert(0, "sed -i -e 's/ -little/& \| -library/' -e 's/\-\\#\\#\\#/& -dryrun/' ../configure\n")
-            # taken from post_configure_nag.sh
-            conf_lines.append("sed -i -e 's/\t\$.FCFLAGS. \\//' src/98_main/Makefile\n")
-
-        fh.writelines(conf_lines)
-
-        for cmd in conf.meta.get("post_configure", []):
-            fh.write("%s\n" % cmd)
-
-        # command > >(tee stdout.log) 2> >(tee stderr.log >&2)
-        # http://stackoverflow.com/questions/692000/how-do-i-write-stderr-to-a-file-while-using-tee-with-a-pipe
-        #cprint("`make stdout` redirected to make.stdout file", "yellow")
-        #cprint("`make stderr` redirected to make.stderr file", "yellow")
-        fh.write("make -j%d > >(tee make.stdout) 2> >(tee make.stderr >&2) \n" % nthreads)
-
-        for cmd in conf.meta.get("post_make", []):
-            fh.write("%s\n" % cmd)
-        fh.write("# make check\n")
-
-        fh.seek(0)
 
+    autoconf_cache = None
+    if options.autoconf_cache:
+        from abiconfig.core.workon import AutoconfCache
+        autoconf_cache = AutoconfCache(cache_dir=options.autoconf_cache_dir)
+
+    module_env = None
+    if options.module_env:
+        from abiconfig.core.module_env import ModuleEnvironment
+        module_env = ModuleEnvironment(cache_dir=options.module_env_dir, refresh=options.refresh_module_env)
+
+    builds = [Build.from_conf(conf, compiler_cache=compiler_cache, autoconf_cache=autoconf_cache,
+                              module_env=module_env) for conf in configs]
+    plans = []
+    for build in builds:
+        if module_env is not None and build.conf.meta.get("pre_configure"):
+            # Execute the pre_configure commands once, the scripts will source the environment.
+            try:
+                path = module_env.get_env_file(build.conf.meta["pre_configure"])
+                cprint("Using cached environment %s" % path, "blue")
+            except RuntimeError as exc:
+                cprint("Cannot capture the environment of %s, pre_configure commands will be executed.\n%s" % (
+                       build.name, str(exc)), "red")
+                build.module_env = None
+
+        # Existing build directories are resumed from the first stage whose inputs changed.
+        plans.append(build.prepare(remove=options.remove))
+        cprint("Stages of %s: %s" % (build.name, ", ".join("%s [%s]" % t for t in plans[-1].items())), "blue")
+        # Generate shell script to load modules, run configure and make.
+        build.write_script(max(1, ncores // len(builds)))
         if options.verbose:
             cprint("abiconf script:", "yellow")
-            for line in fh.readlines():
-                print(line, end="")
+            with open(build.script, "rt") as fh:
+                print(fh.read(), end="")
 
     retcode = 0
-    if not options.make:
-        cprint("Use:\n\t`source %s`\n\nto configure/make\n" % os.path.relpath(script), "yellow")
+    if options.batch:
+        # Build on a compute node. The number of make jobs is the number of cores of the allocation
+        # (see get_batch_script_str), the cores requested are given by -j.
+        for build in builds:
+            path = build.write_batch_script(ncores, walltime=options.walltime)
+            if options.make:
+                ret = build.submit()
+                if ret != 0: cprint("Submission of %s returned %s" % (build.name, ret), "red")
+                retcode += ret != 0
+            else:
+                cprint("Submit:\n\t`%s`\n\nto configure/make on a compute node\n" % os.path.relpath(path), "yellow")
+    elif not options.make:
+        for build in builds:
+            cprint("Use:\n\t`source %s`\n\nto configure/make\n" % os.path.relpath(build.script), "yellow")
     else:
-	# The code gets stuck here if -jN. Should find better approach
-        os.chdir(workdir)
-        retcode = os.system(". %s" % script)
-        if retcode != 0:
-            cprint("make returned retcode %s" % retcode, "red")
-            stderr_path = os.path.join(workdir, "make.stderr")
-            with open(stderr_path, "rt") as fh:
-                err = fh.read()
-                if err:
-                    cprint("Errors found in %s" % stderr_path, "red")
-                    cprint(err, "red")
-        os.chdir(cwd)
-
-    path = os.path.join(workdir, "template_job.sh")
-    cprint("Writing submission script template to %s" % os.path.relpath(path), "yellow")
-    with open(path, "wt") as fh:
-        fh.write(conf.get_script_str())
-
-    path = os.path.join(workdir, "launch_runtests_job.sh")
-    cprint("Writing submission script for runtests.py to %s" % os.path.relpath(path), "yellow")
-    with open(path, "wt") as fh:
-        fh.write(conf.get_runtests_script_str())
+        scheduler = BuildScheduler(builds, ncores, max_builds=options.max_builds)
+        nfailed = scheduler.run(echo=len(builds) == 1 or options.verbose > 0, timeout=options.timeout)
+        for build in builds:
+            if build.retcode != 0:
+                cprint("Build %s returned retcode %s" % (build.name, build.retcode), "red")
+                build.print_errors()
+        # Propagate the exit status of the script if single build.
+        retcode = builds[0].retcode if len(builds) == 1 else nfailed
+
+    for build, plan in zip(builds, plans):
+        if plan["scripts"] == "run": build.write_job_scripts()
+
+    if options.make and len(builds) > 1:
+        print(" ")
+        if options.batch:
+            print("%d build(s) submitted, %d failed submission(s)" % (len(builds) - retcode, retcode))
+        else:
+            scheduler.print_summary()
 
     return retcode
 
@@ -378,6 +645,7 @@ Usage example:
     abiconf.py list                  => List all configuration files.
     abiconf.py workon [ACNAME]       => Create build directory and compile the code with this
                                         configuration file.
+    abiconf.py workon -m -k intel    => Build all the configuration files with keyword `intel` in parallel.
     abiconf.py script [ACNAME]       => Generate job script template.
     abiconf.py keys intel mkl        => Find configuration files with these keywords.
     abiconf.py doc                   => Print documented template.
@@ -385,9 +653,11 @@ Usage example:
     abiconf.py get [ACNAME]          => Get a copy of the configuration file.
     abiconf.py new [FILENAME]        => Generate template file.
     abiconf.py convert acfile        => Add metadata section to an old autoconf file.
+    abiconf.py index [DIR]           => Write index of the configuration files to DIR/index.json.
 
 Options for developers
     abiconf.py bbcov    [DIRorFILEs]   => Test autoconf options coverage
+    abiconf.py timing _build_a _build_b => Compare the timing of the build phases.
 """
 
     def show_examples_and_exit(error_code=1):
@@ -396,17 +666,31 @@ Options for developers
         sys.exit(error_code)
 
     import argparse
+    from abiconfig.core import release
+
     # Parent parser for common options.
     copts_parser = argparse.ArgumentParser(add_help=False)
     copts_parser.add_argument('-v', '--verbose', default=0, action='count', # -vv --> verbose=2
                               help='Verbose, can be supplied multiple times to increase verbosity.')
     copts_parser.add_argument('--no-colors', default=False, action="store_true", help='Disable ASCII colors.')
+    copts_parser.add_argument('--no-cache', default=False, action="store_true",
+                              help='Parse the configuration files again instead of using the on-disk cache.')
 
     # Parent parser for command that have a `buildbot` variant.
     bb_parser = argparse.ArgumentParser(add_help=False)
     bb_parser.add_argument('-b', '--buildbot', default=False, action='store_true',
                            help=("Activate buildbot mode. Configuration files are read from "
                                  "~abinit/doc/build/config-examples"))
+    bb_parser.add_argument('-n', '--nprocs', type=int, default=None,
+                           help="Number of workers used to parse the buildbot configuration files. "
+                                "Default: number of CPUs.")
+
+    def parse_jobs(s):
+        if s == "auto": return s
+        try:
+            return int(s)
+        except ValueError:
+            raise argparse.ArgumentTypeError("invalid value `%s`, use an integer or `auto`" % s)
 
     # Build the main parser.
     parser = argparse.ArgumentParser(epilog=str_examples(), formatter_class=argparse.RawDescriptionHelpFormatter)
@@ -433,11 +717,71 @@ Options for developers
     p_keys.add_argument("keys", nargs="*", default=None,
                             help="Find configuration files with these keywords. "
                                  "Show available keywords if no value is provided.")
+    p_keys.add_argument("-o", "--option", dest="optvals", action="append", default=[],
+                        help="Select configuration files setting this option. "
+                             "Use `name=value` to select a particular value. Can be supplied multiple times.")
 
     # Subparser for script.
-    p_script = subparsers.add_parser('script', parents=[copts_parser], help=abiconf_script.__doc__)
-    p_script.add_argument('path', nargs="?", default=None,
-                          help="Configuration file or database entry. None to print all files.")
+    p_script = subparsers.add_parser('script', parents=[copts_parser, bb_parser], help=abiconf_script.__doc__)
+    p_script.add_argument('paths', nargs="*", default=[],
+                          help="Configuration file(s) or database entries. None to print all files.")
+    p_script.add_argument("-o", '--outdir', default=None,
+                          help="Batch mode: write the submission, runtests and workon scripts of the configuration "
+                               "files (all files if no path/keyword is given) to OUTDIR/<basename>/. "
+                               "Files whose content did not change are not rewritten.")
+    p_script.add_argument("-k", '--keywords', nargs="+", default=None,
+                          help="Batch mode: select the configuration files with these keywords.")
+    p_script.add_argument('--build-top', default=None,
+                          help="Batch mode: directory in which the workon scripts create the build directories. "
+                               "Default: current working directory.")
+    p_script.add_argument("-j", '--jobs', type=parse_jobs, default=0,
+                          help="Batch mode: number of make jobs used in the workon scripts. "
+                               "`auto` to use the CPUs and the memory available to the process (see workon). "
+                               "Default: half of the CPUs.")
+    p_script.add_argument('--mem-per-job', type=float, default=2.0,
+                          help="Estimate of the memory (GB) used by a compilation job. Used by `-j auto`. Default: 2.")
+
+    # Subparser for runtests.
+    p_runtests = subparsers.add_parser('runtests', parents=[copts_parser], help=abiconf_runtests.__doc__)
+    p_runtests.add_argument('action', choices=["jobs", "collect", "report"],
+                            help="jobs: write the queue scripts for the configuration file. "
+                                 "collect: merge the output of the runs found in the directory. "
+                                 "report: speedup and efficiency of the runs found in the directories (side by side).")
+    p_runtests.add_argument('paths', nargs="*", default=[],
+                            help="Configuration file or database entry (jobs), directory with the results "
+                                 "(collect, report). Default: cwd.")
+    p_runtests.add_argument('--csv', default=None, help="report: export the results of each test to a CSV file.")
+    p_runtests.add_argument('--json', default=None, help="report: export the results to a json file.")
+    p_runtests.add_argument("-o", '--outdir', default=".", help="Output directory of the scripts. Default: cwd.")
+    p_runtests.add_argument('--mode', default="array", choices=["array", "scripts"],
+                            help="array: job array (slurm, pbspro). scripts: one script per combination.")
+    p_runtests.add_argument('--walltime', default="01:00:00", help="Wall time of each job. Default: 01:00:00.")
+
+    # Subparser for scaling.
+    p_scaling = subparsers.add_parser('scaling', parents=[copts_parser], help=abiconf_scaling.__doc__)
+    p_scaling.add_argument('action', choices=["gen", "report"],
+                           help="gen: write the jobs of the study. report: analyze the results found in the directory.")
+    p_scaling.add_argument('paths', nargs="*", default=[],
+                           help="Configuration file (or database entry) and ABINIT input (gen), "
+                                "directory of the study (report, default: cwd).")
+    p_scaling.add_argument("-o", '--outdir', default="scaling", help="Output directory. Default: scaling.")
+    p_scaling.add_argument('--nodes', nargs="+", type=int, default=[1], help="Number of nodes. Default: 1.")
+    p_scaling.add_argument('--mpi', dest="mpi_procs", nargs="+", type=int, default=[1, 2, 4, 8],
+                           help="Total number of MPI processes. Default: 1 2 4 8.")
+    p_scaling.add_argument('--omp', dest="omp_threads", nargs="+", type=int, default=[1],
+                           help="Number of OpenMP threads. Default: 1.")
+    p_scaling.add_argument('--cores-per-node', type=int, default=None,
+                           help="Skip the points that do not fit the nodes.")
+    p_scaling.add_argument('--paral', dest="paral_vars", nargs="+", default=[],
+                           help="Variables set in each point e.g. `npband={mpi}` `npkpt=1`. "
+                                "Can use {nodes}, {mpi}, {omp}, {ncores} and {ranks_per_node}.")
+    p_scaling.add_argument('--weak', nargs="+", default=[],
+                           help="Weak scaling: variables scaled with the number of cores e.g. `nband=64` "
+                                "(value for the smallest point).")
+    p_scaling.add_argument('--walltime', default="01:00:00", help="Wall time of each job. Default: 01:00:00.")
+    p_scaling.add_argument('--mpirun', default="mpirun -np {mpi}", help="MPI launcher. Default: `mpirun -np {mpi}`.")
+    p_scaling.add_argument('--abinit', default="abinit", help="ABINIT executable. Default: abinit.")
+    p_scaling.add_argument('--csv', default=None, help="report: export the scaling table to a CSV file.")
 
     # Subparser for convert.
     p_conv = subparsers.add_parser('convert', parents=[copts_parser], help=abiconf_convert.__doc__)
@@ -457,14 +801,68 @@ Options for developers
     # Subparser for bb_cov command.
     p_bbcov = subparsers.add_parser('bbcov', parents=[copts_parser], help=abiconf_bbcov.__doc__)
     p_bbcov.add_argument('paths', nargs="*", default=None, help="ac file or directory with ac files.")
+    p_bbcov.add_argument('-n', '--nprocs', type=int, default=None,
+                         help="Number of workers used to parse the configuration files. Default: number of CPUs.")
+    p_bbcov.add_argument('-i', '--incremental', default=False, action="store_true",
+                         help="Parse only the files that changed since the last run and report the differences.")
+    p_bbcov.add_argument('--state', default=None,
+                         help="File with the coverage state used in incremental mode. Default: file in ~/.abiconf.")
+
+    # Subparser for index command.
+    p_index = subparsers.add_parser('index', parents=[copts_parser], help=abiconf_index.__doc__)
+    p_index.add_argument('top', nargs="?", default=None,
+                         help="Directory with ac files. Default: abiconfig clusters directory.")
+
+    # Subparser for timing command.
+    p_timing = subparsers.add_parser('timing', parents=[copts_parser], help=abiconf_timing.__doc__)
+    p_timing.add_argument('paths', nargs="+",
+                          help="Build directories or json files with the timing report. "
+                               "Differences are given with respect to the first one.")
+    p_timing.add_argument('--json', default=False, action="store_true", help="Print the reports in json format.")
 
     # Subparser for workon command.
     p_workon = subparsers.add_parser('workon', parents=[copts_parser, bb_parser], help=abiconf_workon.__doc__)
-    p_workon.add_argument('confname', nargs="?", default=None,
-                          help="Configuration file to be used. Either abiconf basename or local file.")
+    p_workon.add_argument('confnames', nargs="*", default=[],
+                          help="Configuration file(s) to be used. Either abiconf basename or local file. "
+                               "The builds are executed concurrently if more than one configuration is given.")
+    p_workon.add_argument("-k", '--keywords', nargs="+", default=None,
+                          help="Build all the configuration files with these keywords.")
+    p_workon.add_argument('--max-builds', type=int, default=None,
+                          help="Max number of builds executed at the same time. Default: all.")
     p_workon.add_argument("-m", '--make', action="store_true", default=False, help="Run configure/make. Default: False.")
-    p_workon.add_argument("-j", '--jobs', type=int, default=0, help="Number of threads used to compile/make.")
-    p_workon.add_argument("-r", '--remove', default=False, action="store_true", help="Remove build directory.")
+    p_workon.add_argument("-j", '--jobs', type=parse_jobs, default=0,
+                          help="Number of threads used to compile/make. Shared by the builds if more than one configuration. "
+                               "`auto` to use the CPUs available to the process (affinity, cgroup quota) "
+                               "and the available memory (see --mem-per-job). Default: half of the CPUs.")
+    p_workon.add_argument('--mem-per-job', type=float, default=2.0,
+                          help="Estimate of the memory (GB) used by a compilation job. Used by `-j auto`. Default: 2.")
+    p_workon.add_argument('--compiler-cache', default=None, choices=["ccache", "sccache"],
+                          help="Wrap FC, CC and CXX with a compiler cache shared by the build directories.")
+    p_workon.add_argument('--compiler-cache-dir', default=None,
+                          help="Directory of the compiler cache. Default: ~/.abiconf/<tool>.")
+    p_workon.add_argument('--autoconf-cache', default=False, action="store_true",
+                          help="Share the results of configure among the builds with the same toolchain "
+                               "(compilers, flags, modules and compiler versions).")
+    p_workon.add_argument('--autoconf-cache-dir', default=None,
+                          help="Directory with the autoconf cache files. Default: ~/.abiconf/autoconf.")
+    p_workon.add_argument('--module-env', default=False, action="store_true",
+                          help="Execute the pre_configure commands (module load) once, cache the environment "
+                               "and source it in the generated scripts.")
+    p_workon.add_argument('--module-env-dir', default=None,
+                          help="Directory with the cached environments. Default: ~/.abiconf/module_env.")
+    p_workon.add_argument('--refresh-module-env', default=False, action="store_true",
+                          help="Capture the environment again (e.g. after an update of the modules). "
+                               "Requires --module-env.")
+    p_workon.add_argument('--batch', default=False, action="store_true",
+                          help="Write a queue script (qtype and qkwargs of the metadata) executing the build on a "
+                               "compute node. With -m, the script is submitted. The cores requested are given by -j "
+                               "(`auto`: CPUs and memory available to the process, default: half of the CPUs).")
+    p_workon.add_argument('--walltime', default="02:00:00", help="Wall time of the queue script. Default: 02:00:00.")
+    p_workon.add_argument('--timeout', type=float, default=None,
+                          help="Cancel the build if it takes more than TIMEOUT seconds. Default: no limit.")
+    p_workon.add_argument("-r", '--remove', default=False, action="store_true",
+                          help="Remove the build directory and build from scratch. "
+                               "By default, existing build directories are resumed.")
 
     try:
         options = parser.parse_args()
@@ -473,9 +871,11 @@ Options for developers
 
     if options.no_colors:
         # Disable colors
+        from abiconfig.core import termcolor
         termcolor.enable(False)
 
     if options.command == "doc":
+        from abiconfig.core.options import get_actemplate_string
         template = get_actemplate_string()
         for line in template.splitlines():
             if len(line) > 2 and line[0] == "#" and line[1] != " ":
@@ -0,0 +1,83 @@
+"""
+Generator of synthetic corpora of .ac files used by the benchmarks.
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+
+import os
+import json
+import random
+
+from abiconfig.core.options import AbinitConfigureOptions
+
+KEYWORDS = ["linux", "intel", "gcc", "nag", "mkl", "openblas", "openmpi", "impi", "mpich",
+            "easybuild", "cuda", "hdf5", "netcdf", "libxc", "scalapack", "openmp"]
+
+QTYPES = ["slurm", "pbspro", "shell"]
+
+COMPILERS = [("mpiifort", "mpiicc", "mpiicpc"), ("mpif90", "mpicc", "mpicxx"), ("ftn", "cc", "CC")]
+
+# Number of files per subdirectory.
+FILES_PER_DIR = 500
+
+
+def get_option_values(opt):
+    """Return list of values that can be used for option opt."""
+    if opt.values: return opt.values
+    if opt.name.startswith("enable_"): return ["yes", "no"]
+    return ["${EBROOT%s}" % opt.name.upper(), "-L/opt/%s/lib -l%s" % (opt.name, opt.name), "yes"]
+
+
+def make_acfile_string(i, rng, options, nhosts):
+    """Return string with the i-th synthetic .ac file."""
+    hostname = "host%04d" % rng.randrange(nhosts)
+    qtype = rng.choice(QTYPES)
+    meta = {
+        "hostname": hostname,
+        "author": "J. Doe",
+        "date": "2020-%02d-%02d" % (rng.randint(1, 12), rng.randint(1, 28)),
+        "description": ["Synthetic configuration file #%d" % i, "Generated by benchmarks/corpus.py"],
+        "qtype": qtype,
+        "keywords": rng.sample(KEYWORDS, rng.randint(2, 5)),
+        "pre_configure": ["module load mod%d/%d.%d" % (j, rng.randint(1, 9), rng.randint(0, 9))
+                          for j in range(rng.randint(1, 8))],
+    }
+    if qtype == "slurm":
+        meta["qkwargs"] = {"partition": "batch", "time": "01:00:00", "ntasks_per_node": rng.choice([16, 32, 64])}
+
+    lines = ["#---"]
+    lines.extend("#" + l for l in json.dumps(meta, indent=4).splitlines())
+    lines.append("#---")
+    lines.append("")
+
+    fc, cc, cxx = rng.choice(COMPILERS)
+    lines.extend(['FC="%s"' % fc, 'CC="%s"' % cc, 'CXX="%s"' % cxx,
+                  'FCFLAGS="-O%d -g"' % rng.randint(1, 3), ""])
+
+    for opt in rng.sample(options, rng.randint(10, 30)):
+        lines.append("# %s" % opt.description)
+        lines.append('%s="%s"' % (opt.name, rng.choice(get_option_values(opt))))
+
+    return "\n".join(lines) + "\n"
+
+
+def write_corpus(top, nfiles, seed=0):
+    """
+    Write nfiles synthetic .ac files inside directory top.
+    Metadata and options are drawn from options.conf with a random generator initialized with seed
+    so that the same corpus is produced for the same arguments. Return list of paths.
+    """
+    rng = random.Random(seed)
+    confopts = AbinitConfigureOptions.from_myoptions_conf()
+    options = [opt for opt in confopts.values() if opt.status not in ("dropped", "removed")]
+    nhosts = max(1, nfiles // 10)
+
+    paths = []
+    for i in range(nfiles):
+        dirpath = os.path.join(top, "d%03d" % (i // FILES_PER_DIR))
+        if not os.path.isdir(dirpath): os.makedirs(dirpath)
+        path = os.path.join(dirpath, "synthetic-%05d.ac" % i)
+        with open(path, "wt") as fh:
+            fh.write(make_acfile_string(i, rng, options, nhosts))
+        paths.append(path)
+
+    return paths
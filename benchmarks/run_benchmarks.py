@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+"""
+Benchmark suite for abiconfig. Generate synthetic corpora of .ac files and time the main operations.
+
+Usage example:
+
+    python benchmarks/run_benchmarks.py --sizes 10 100 1000 -o results.json
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+
+import sys
+import os
+import io
+import time
+import json
+import shutil
+import tempfile
+import platform
+import argparse
+import contextlib
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from abiconfig.core import release
+from abiconfig.core.options import AbinitConfigureOptions, ConfigList
+from abiconfig.core.index import ConfigIndex
+from abiconfig.core.coverage import IncrementalCoverage, get_state_path
+
+try:
+    from corpus import write_corpus, KEYWORDS
+except ImportError:
+    from benchmarks.corpus import write_corpus, KEYWORDS
+
+
+class Context(object):
+    """Data shared by the benchmarks executed on the same corpus."""
+
+    def __init__(self, top, nfiles, nprocs):
+        self.top, self.nfiles, self.nprocs = top, nfiles, nprocs
+        self.options = AbinitConfigureOptions.from_myoptions_conf()
+        self.configs = ConfigList.from_dir(top, use_cache=False)
+        self.index = ConfigIndex.from_configs(self.configs)
+        self.hostnames = sorted(self.index.hostnames)
+        # Coverage state used by the incremental benchmark.
+        self.paths = ConfigList._find_acfiles(top)
+        state = IncrementalCoverage.from_file(get_state_path(top), self.options)
+        state.update(self.paths)
+        state.save()
+
+
+def bench_from_dir(ctx):
+    ConfigList.from_dir(ctx.top, use_cache=False)
+    return ctx.nfiles
+
+def bench_from_dir_cached(ctx):
+    ConfigList.from_dir(ctx.top, use_cache=True)
+    return ctx.nfiles
+
+def bench_from_dir_lazy(ctx):
+    ConfigList.from_dir(ctx.top, use_cache=False, lazy=True)
+    return ctx.nfiles
+
+def bench_from_dir_parallel(ctx):
+    ConfigList.from_dir(ctx.top, use_cache=False, nprocs=ctx.nprocs)
+    return ctx.nfiles
+
+def bench_buildbot_coverage(ctx):
+    with contextlib.redirect_stdout(io.StringIO()):
+        ctx.configs.buildbot_coverage(ctx.options)
+    return ctx.nfiles
+
+def bench_buildbot_coverage_incremental(ctx):
+    # No file changed since the last run: the cost should be well below the one of from_dir_cached.
+    state = IncrementalCoverage.from_file(get_state_path(ctx.top), ctx.options)
+    with contextlib.redirect_stdout(io.StringIO()):
+        state.update(ctx.paths)
+        state.matrix.print_report()
+    return ctx.nfiles
+
+def bench_index_build(ctx):
+    ConfigIndex.from_configs(ctx.configs)
+    return ctx.nfiles
+
+def bench_keyword_lookup(ctx):
+    for i, key in enumerate(KEYWORDS):
+        ctx.index.find_keywords([key])
+        ctx.index.find_keywords([key, KEYWORDS[i - 1]])
+    return 2 * len(KEYWORDS)
+
+def bench_hostname_lookup(ctx):
+    for hostname in ctx.hostnames:
+        ctx.index.find_hostname(hostname)
+    return len(ctx.hostnames)
+
+def bench_get_script_str(ctx):
+    for conf in ctx.configs:
+        conf.get_script_str()
+    return ctx.nfiles
+
+def bench_get_runtests_script_str(ctx):
+    for conf in ctx.configs:
+        conf.get_runtests_script_str()
+    return ctx.nfiles
+
+
+# List of (name, function) with the benchmarks in the order they are executed.
+BENCHMARKS = [
+    ("from_dir", bench_from_dir),
+    ("from_dir_cached", bench_from_dir_cached),
+    ("from_dir_lazy", bench_from_dir_lazy),
+    ("from_dir_parallel", bench_from_dir_parallel),
+    ("buildbot_coverage", bench_buildbot_coverage),
+    ("buildbot_coverage_incremental", bench_buildbot_coverage_incremental),
+    ("index_build", bench_index_build),
+    ("keyword_lookup", bench_keyword_lookup),
+    ("hostname_lookup", bench_hostname_lookup),
+    ("get_script_str", bench_get_script_str),
+    ("get_runtests_script_str", bench_get_runtests_script_str),
+]
+
+
+def run_benchmark(func, ctx, repeat, trace_memory=True):
+    """
+    Execute func(ctx) repeat times. Return dictionary with the best wall time,
+    the throughput (items per second) and the peak of the memory allocated by Python (tracemalloc).
+    """
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        nitems = func(ctx)
+        times.append(time.perf_counter() - start)
+
+    peak = None
+    if trace_memory:
+        # Separate run since tracemalloc slows down the code.
+        tracemalloc.start()
+        func(ctx)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    best = min(times)
+    return dict(nitems=nitems, time=best, times=times,
+                throughput=nitems / best if best > 0 else None, peak_memory=peak)
+
+
+def run_suite(sizes, benchmarks=None, repeat=3, nprocs=2, trace_memory=True, workdir=None, verbose=1):
+    """
+    Run the benchmarks for each corpus size in sizes. Return list of dictionaries with the results.
+
+    Args:
+        sizes: List with the number of .ac files in the corpus.
+        benchmarks: List with the names of the benchmarks to execute. None for all.
+        repeat: Number of repetitions (the best time is reported).
+        nprocs: Number of workers used in from_dir_parallel.
+        trace_memory: True if the peak memory should be measured.
+        workdir: Directory where the corpora are generated. None to use a temporary directory.
+    """
+    selected = [(n, f) for n, f in BENCHMARKS if benchmarks is None or n in benchmarks]
+    rmtree = workdir is None
+    workdir = tempfile.mkdtemp(prefix="abiconf_bench_") if workdir is None else workdir
+
+    # Use a private cache so that the user cache is not polluted.
+    old_cache_dir = os.environ.get("ABICONF_CACHE_DIR")
+    os.environ["ABICONF_CACHE_DIR"] = os.path.join(workdir, "cache")
+
+    results = []
+    try:
+        for nfiles in sizes:
+            top = os.path.join(workdir, "corpus_%d" % nfiles)
+            if not os.path.isdir(top): write_corpus(top, nfiles)
+            ctx = Context(top, nfiles, nprocs)
+            # Populate the cache used by from_dir_cached.
+            ConfigList.from_dir(top, use_cache=True)
+
+            for name, func in selected:
+                res = run_benchmark(func, ctx, repeat, trace_memory=trace_memory)
+                res.update(name=name, nfiles=nfiles)
+                results.append(res)
+                if verbose: print_result(res)
+    finally:
+        if old_cache_dir is None:
+            os.environ.pop("ABICONF_CACHE_DIR")
+        else:
+            os.environ["ABICONF_CACHE_DIR"] = old_cache_dir
+        if rmtree: shutil.rmtree(workdir, ignore_errors=True)
+
+    return results
+
+
+def print_result(res):
+    peak = "%10.1f KiB" % (res["peak_memory"] / 1024) if res["peak_memory"] is not None else "%14s" % "-"
+    print("%-25s %6d files %10.4f s %12.1f items/s %s" % (
+          res["name"], res["nfiles"], res["time"], res["throughput"] or 0, peak))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-s", "--sizes", nargs="+", type=int, default=[10, 100, 1000, 10000],
+                        help="Number of .ac files in the synthetic corpora.")
+    parser.add_argument("-b", "--benchmarks", nargs="+", choices=[n for n, _ in BENCHMARKS], default=None,
+                        help="Benchmarks to execute. Default: all.")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Number of repetitions.")
+    parser.add_argument("-n", "--nprocs", type=int, default=2, help="Number of workers for from_dir_parallel.")
+    parser.add_argument("--no-memory", action="store_true", default=False, help="Don't measure peak memory.")
+    parser.add_argument("-w", "--workdir", default=None,
+                        help="Directory for the corpora (reused if already present). Default: temporary directory.")
+    parser.add_argument("-o", "--output", default=None, help="Write results to this file in json format.")
+    options = parser.parse_args()
+
+    results = run_suite(options.sizes, benchmarks=options.benchmarks, repeat=options.repeat,
+                        nprocs=options.nprocs, trace_memory=not options.no_memory, workdir=options.workdir)
+
+    if options.output is not None:
+        data = dict(
+            abiconfig=release.__version__,
+            python=platform.python_version(),
+            platform=platform.platform(),
+            date=time.strftime("%Y-%m-%dT%H:%M:%S"),
+            repeat=options.repeat,
+            results=results,
+        )
+        with open(options.output, "wt") as fh:
+            json.dump(data, fh, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -43,6 +43,6 @@ setup(name='abiconfig',
       scripts=glob(os.path.join("abiconfig", "scripts", "*.py")),
       package_data={
             "abiconfig.core": ["*.conf", "*.ac"],
-            "abiconfig.clusters": ["*.ac"],
+            "abiconfig.clusters": ["*.ac", "index.json"],
         },
       )
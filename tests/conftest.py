@@ -0,0 +1,13 @@
+# coding: utf-8
+"""Fixtures shared by the tests."""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def abiconf_cache_dir(tmpdir_factory, monkeypatch):
+    """Use a temporary cache directory so that the tests do not write to ~/.abiconf."""
+    path = str(tmpdir_factory.mktemp("abiconf_cache"))
+    monkeypatch.setenv("ABICONF_CACHE_DIR", path)
+    return path
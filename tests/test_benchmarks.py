@@ -0,0 +1,34 @@
+# coding: utf-8
+"""Tests for the synthetic corpus and the benchmark suite."""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "benchmarks")))
+
+from abiconfig.core.options import ConfigList
+from corpus import write_corpus
+from run_benchmarks import run_suite, BENCHMARKS
+
+
+class TestBenchmarks(object):
+
+    def test_corpus(self, tmpdir):
+        """The synthetic .ac files should be valid and reproducible."""
+        paths = write_corpus(str(tmpdir.join("a")), 20, seed=1)
+        assert len(paths) == 20
+        configs = ConfigList.from_dir(str(tmpdir.join("a")), use_cache=False)
+        assert len(configs) == 20
+        for conf in configs:
+            assert not conf.meta.validate()
+            assert conf["FC"]
+
+        other = write_corpus(str(tmpdir.join("b")), 20, seed=1)
+        assert all(open(p1).read() == open(p2).read() for p1, p2 in zip(paths, other))
+
+    def test_run_suite(self, tmpdir):
+        results = run_suite([10], repeat=1, workdir=str(tmpdir), verbose=0)
+        assert [r["name"] for r in results] == [n for n, _ in BENCHMARKS]
+        for res in results:
+            assert res["nfiles"] == 10 and res["time"] >= 0 and res["peak_memory"] > 0
@@ -0,0 +1,359 @@
+# coding: utf-8
+"""Tests for the objects used to parse the configuration files."""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import shutil
+
+from abiconfig.core.options import Config, ConfigList
+from abiconfig.core.cache import ConfigCache
+
+clusters_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "abiconfig", "clusters"))
+
+
+class TestConfigCache(object):
+
+    def test_cache(self, tmpdir, monkeypatch):
+        """Testing ConfigCache."""
+        monkeypatch.setenv("ABICONF_CACHE_DIR", str(tmpdir.join("cache")))
+        top = str(tmpdir.join("acfiles"))
+        shutil.copytree(clusters_dir, top)
+
+        ref = ConfigList.from_dir(top, use_cache=False)
+        first = ConfigList.from_dir(top)
+        assert os.path.exists(str(tmpdir.join("cache", "configs.json")))
+        second = ConfigList.from_dir(top)
+        assert len(ref) == len(first) == len(second)
+        for c0, c1, c2 in zip(ref, first, second):
+            assert c0.path == c2.path
+            assert list(c0.items()) == list(c2.items())
+            assert c0.meta == c1.meta == c2.meta
+            assert str(c0) == str(c2)
+
+        # Modify one file: the entry must be invalidated.
+        path = ref[0].path
+        with open(path, "at") as fh:
+            fh.write('\nenable_foo="yes"\n')
+
+        cache = ConfigCache.from_file()
+        assert path in cache
+        conf = cache.get_config(path)
+        assert cache.modified and conf["enable_foo"] == "yes"
+
+        # Touch without changing the content: entry is still valid.
+        cache.save()
+        os.utime(path, (0, 0))
+        cache = ConfigCache.from_file()
+        assert cache.get_config(path)["enable_foo"] == "yes"
+        assert cache[path]["mtime"] == 0
+
+        # Entries written by a previous version of the parser are not reused.
+        import json
+        filepath = str(tmpdir.join("cache", "configs.json"))
+        with open(filepath, "rt") as fh:
+            data = json.load(fh)
+        data["version"] = ConfigCache.VERSION - 1
+        with open(filepath, "wt") as fh:
+            json.dump(data, fh)
+        assert not ConfigCache.from_file()
+
+    def test_lazy_cache(self, tmpdir, monkeypatch):
+        """Lazy loading with the cache: entries store only the metadata until a full parse."""
+        monkeypatch.setenv("ABICONF_CACHE_DIR", str(tmpdir.join("cache")))
+        top = str(tmpdir.join("acfiles"))
+        shutil.copytree(clusters_dir, top)
+
+        ref = ConfigList.from_dir(top, use_cache=False)
+        for nprocs in (1, 2):
+            lazy = ConfigList.from_dir(top, lazy=True, nprocs=nprocs)
+            cache = ConfigCache.from_file()
+            assert len(cache) == len(ref)
+            assert all(cache[c.path]["options"] is None for c in ref)
+            assert [c.meta for c in lazy] == [c.meta for c in ref]
+            assert [list(c.items()) for c in lazy] == [list(c.items()) for c in ref]
+
+        # A full parse upgrades the metadata-only entries.
+        full = ConfigList.from_dir(top)
+        assert [list(c.items()) for c in full] == [list(c.items()) for c in ref]
+        cache = ConfigCache.from_file()
+        assert all(cache[c.path]["options"] is not None for c in ref)
+        conf = cache.get_config(ref[0].path, lazy=True)
+        assert list(conf.items()) == list(ref[0].items())
+
+
+class TestConfig(object):
+
+    def test_lazy(self, tmpdir):
+        """Testing Config.from_file with lazy=True."""
+        path = os.path.join(clusters_dir, "nic5-intel-easybuild.ac")
+        ref = Config.from_file(path)
+        conf = Config.from_file(path, lazy=True)
+        assert conf.meta == ref.meta
+        assert conf["FC"] == "mpiifort"
+        assert list(conf.items()) == list(ref.items())
+        assert str(conf) == str(ref)
+
+        conf = Config.from_file(path, lazy=True)
+        assert len(conf) == len(ref) and "FC" in conf
+
+        # The options are read on first access and the file is not read again.
+        path = str(tmpdir.join("lazy.ac"))
+        shutil.copy(ref.path, path)
+        conf = Config.from_file(path, lazy=True)
+        with open(path, "at") as fh:
+            fh.write('\nenable_foo="yes"\n')
+        assert conf["enable_foo"] == "yes"
+        with open(path, "at") as fh:
+            fh.write('\nenable_bar="yes"\n')
+        assert "enable_bar" not in conf and len(conf) == len(ref) + 1
+
+        # A lazy object shared by several threads is loaded consistently.
+        from concurrent.futures import ThreadPoolExecutor
+        conf = Config.from_file(ref.path, lazy=True)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(lambda _: list(conf.items()), range(32)))
+        assert all(r == list(ref.items()) for r in results)
+
+
+class TestConfigIndex(object):
+
+    def test_index(self, tmpdir):
+        """Testing ConfigIndex."""
+        from abiconfig.core.index import ConfigIndex
+        top = str(tmpdir.join("acfiles"))
+        shutil.copytree(clusters_dir, top)
+        configs = ConfigList.from_dir(top, use_cache=False)
+        index = ConfigIndex.from_configs(configs)
+
+        conf = index.find_basename("nic5-intel-easybuild.ac")
+        assert conf.meta["hostname"] == "nic5"
+        assert index.find_basename(conf.path) is conf
+        assert index.find_basename("foo.ac") is None
+
+        assert [c.path for c in index.find_hostname("lemaitre")] == \
+               [c.path for c in configs if "lemaitre" in c.meta["hostname"]]
+        assert [c.path for c in index.find_keywords(["intel", "easybuild"])] == \
+               [c.path for c in configs if {"intel", "easybuild"}.issubset(c.meta["keywords"])]
+        assert index.find_keywords(["intel", "nokeyword"]) == []
+        assert [c.path for c in index.find_options(["FC=mpiifort", "with_mpi"])] == \
+               [c.path for c in configs if c.get("FC") == "mpiifort" and "with_mpi" in c]
+
+        # Write the index, read it back and check that the prebuilt file is used.
+        index.write(os.path.join(top, ConfigIndex.FILENAME))
+        same = ConfigIndex.from_dir(top)
+        assert same.paths == index.paths and same.keywords == index.keywords
+        assert same.optvals == index.optvals
+        assert same.find_basename("nic5-intel-easybuild.ac")["FC"] == "mpiifort"
+
+        # The metadata are taken from the prebuilt index (the .ac files are not parsed).
+        import json
+        with open(os.path.join(top, ConfigIndex.FILENAME), "rt") as fh:
+            data = json.load(fh)
+        data["files"][0]["meta"]["hostname"] = "from_index"
+        with open(os.path.join(top, ConfigIndex.FILENAME), "wt") as fh:
+            json.dump(data, fh)
+        assert ConfigIndex.from_dir(top).metas[0]["hostname"] == "from_index"
+
+        # Adding a new file invalidates the prebuilt index.
+        shutil.copy(conf.path, os.path.join(top, "new.ac"))
+        new = ConfigIndex.from_dir(top, use_cache=False)
+        assert len(new) == len(index) + 1
+        assert "from_index" not in [m["hostname"] for m in new.metas]
+
+
+class TestConfigList(object):
+
+    def test_parallel(self, tmpdir):
+        """Testing ConfigList.from_dir with nprocs != 1."""
+        top = str(tmpdir.join("acfiles"))
+        shutil.copytree(clusters_dir, top)
+        with open(os.path.join(top, "broken.ac"), "wt") as fh:
+            fh.write("#---\n#{\n#\"hostname\": \n#}\n#---\n")
+
+        ref = ConfigList.from_files([p for p in ConfigList._find_acfiles(top) if "broken" not in p],
+                                    use_cache=False)
+        for nprocs in (None, 2):
+            configs = ConfigList.from_dir(top, use_cache=False, nprocs=nprocs)
+            assert [c.path for c in configs] == [c.path for c in ref]
+            assert len(configs.parse_errors) == 1
+            assert configs.parse_errors[0][0].endswith("broken.ac")
+            assert configs.print_parse_errors() == 1
+
+
+class TestAbinitConfigureOptions(object):
+
+    def test_snapshot(self, tmpdir):
+        """Testing AbinitConfigureOptions.from_snapshot."""
+        from abiconfig.core.options import AbinitConfigureOptions
+        options_conf = os.path.join(os.path.dirname(clusters_dir), "core", "options.conf")
+        path = str(tmpdir.join("options.conf"))
+        shutil.copy(options_conf, path)
+        snapshot = str(tmpdir.join("snapshot.json"))
+
+        ref = AbinitConfigureOptions.from_file(path)
+        first = AbinitConfigureOptions.from_snapshot(path, snapshot)
+        assert os.path.exists(snapshot)
+        second = AbinitConfigureOptions.from_snapshot(path, snapshot)
+        assert list(ref) == list(first) == list(second)
+        for name, opt in ref.items():
+            assert type(second[name]) is type(opt)
+            assert vars(opt) == vars(second[name])
+            assert str(opt) == str(second[name])
+
+        # Snapshot is regenerated if options.conf changes.
+        with open(path, "at") as fh:
+            fh.write("\n[enable_foobar]\ndescription = Foo\ngroup = group_foo\n")
+        assert "enable_foobar" in AbinitConfigureOptions.from_snapshot(path, snapshot)
+
+
+class TestAcParser(object):
+
+    def test_iter_ac_tokens(self):
+        """Testing iter_ac_tokens."""
+        import io
+        import pytest
+        from abiconfig.core.acparser import iter_ac_tokens, AcSyntaxError
+        s = """\
+# comment
+#---
+#{"hostname": "foo"}
+#---
+#---
+FC=mpif90
+CC = "mpicc"   # inline comment
+CFLAGS="-O2 " #-march=native "
+with_linalg_libs="-L${MKLROOT}/lib \\
+    -lmkl_core"
+FFT_LIBS=-L/usr/lib\\
+ -lfftw3
+opt1=""value""
+opt2='a "b" \\ c'
+opt3="multi
+line"
+opt4=a#b
+"""
+        tokens = list(iter_ac_tokens(io.StringIO(s)))
+        assert tokens[0] == ("meta", 2, '{"hostname": "foo"}\n')
+        options = [t[2] for t in tokens[1:]]
+        assert [t[1] for t in tokens[1:]] == [6, 7, 8, 9, 11, 13, 14, 15, 17]
+        assert options == [
+            ("FC", "mpif90"),
+            ("CC", "mpicc"),
+            ("CFLAGS", "-O2"),
+            ("with_linalg_libs", "-L${MKLROOT}/lib     -lmkl_core"),
+            ("FFT_LIBS", "-L/usr/lib -lfftw3"),
+            ("opt1", "value"),
+            ("opt2", 'a "b" \\ c'),
+            ("opt3", "multi\nline"),
+            ("opt4", "a#b"),
+        ]
+
+        for s, lineno in [("#---\n#{}\n#---\n\nfoo bar\n", 5),
+                          ("#---\n#{}\n#---\nfoo=\"bar\n", 4),
+                          ("#---\n#{}\n", 1),
+                          ("#---\n#{}\n#---\nfoo bar=1\n", 4)]:
+            with pytest.raises(AcSyntaxError) as excinfo:
+                list(iter_ac_tokens(io.StringIO(s), path="foo.ac"))
+            assert excinfo.value.lineno == lineno
+            assert str(excinfo.value).startswith("foo.ac:%d:" % lineno)
+
+
+class TestCoverageMatrix(object):
+
+    def test_coverage(self, capsys):
+        """Testing CoverageMatrix queries and buildbot_coverage."""
+        from abiconfig.core.options import AbinitConfigureOptions
+        options = AbinitConfigureOptions.from_myoptions_conf()
+        configs = ConfigList()
+        for i, items in enumerate([
+                [("FC", "mpif90"), ("enable_mpi", "yes"), ("with_linalg_flavor", "mkl+scalapack")],
+                [("enable_mpi", "no"), ("with_linalg_flavor", "openblas")],
+                [("enable_mpi", "yes"), ("enable_foo", "yes")]]):
+            conf = Config(items)
+            conf.path = "conf%d.ac" % i
+            configs.append(conf)
+
+        matrix = configs.get_coverage_matrix(options)
+        assert matrix.count("enable_mpi") == 3
+        assert matrix.count("enable_mpi", "yes") == 2
+        assert matrix.users("enable_mpi", "no") == ["conf1.ac"]
+        assert matrix.users("with_linalg_flavor", "scalapack") == ["conf0.ac"]
+        assert "enable_mpi" not in matrix.unused_options()
+        assert "enable_debug" in matrix.unused_options()
+        assert "auto" in matrix.unused_values()["enable_mpi"]
+        assert "enable_debug" not in matrix.unused_values()
+        assert matrix.config_errors["conf1.ac"] == ["Invalid value `openblas` for option: with_linalg_flavor"]
+        assert matrix.config_errors["conf2.ac"] == ["Unknown option: enable_foo"]
+        assert "conf0.ac" not in matrix.config_errors
+
+        assert matrix.contributions() == [2, 1, 0]
+        assert matrix.overlap(0, 2) == 2
+        mat = matrix.overlap_matrix()
+        assert mat[0][2] == mat[2][0] == 2 and mat[0][1] == 2 and mat[0][0] == 5
+
+        # Remove the first configuration.
+        matrix.clear_column(0)
+        assert matrix.count("with_linalg_flavor", "mkl") == 0 and matrix.count("enable_mpi") == 2
+
+        retcode = configs.buildbot_coverage(options)
+        out = capsys.readouterr()[0]
+        assert "Found 2 erroneous configuration files" in out
+        nunused = len(configs.get_coverage_matrix(options).unused_options())
+        assert retcode == 2 + 1 + nunused + 1
+
+
+class TestIncrementalCoverage(object):
+
+    def test_incremental(self, tmpdir, capsys):
+        """Testing IncrementalCoverage."""
+        from abiconfig.core.options import AbinitConfigureOptions
+        from abiconfig.core.coverage import IncrementalCoverage
+        options = AbinitConfigureOptions.from_myoptions_conf()
+        top = str(tmpdir.join("acfiles"))
+        shutil.copytree(clusters_dir, top)
+        state_path = str(tmpdir.join("state.json"))
+
+        def full_coverage():
+            configs = ConfigList.from_dir(top, use_cache=False)
+            return configs.buildbot_coverage(options)
+
+        state = IncrementalCoverage.from_file(state_path, options)
+        assert state.previous is None
+        paths = ConfigList._find_acfiles(top)
+        added, modified, removed, errors = state.update(paths, use_cache=False)
+        assert added == paths and not modified and not removed and not errors
+        state.save()
+        assert state.matrix.print_report() == full_coverage()
+
+        # Nothing changed.
+        state = IncrementalCoverage.from_file(state_path, options)
+        assert state.update(paths, use_cache=False) == ([], [], [], [])
+
+        # Modify one file, remove another one.
+        alps = os.path.join(top, "alps-gcc-openmpi.ac")
+        with open(alps, "rt") as fh:
+            s = fh.read()
+        with open(alps, "wt") as fh:
+            fh.write(s.replace('with_linalg_flavor="openblas"', 'with_linalg_flavor="elpa"'))
+        os.remove(os.path.join(top, "archer2-cray.ac"))
+        paths = ConfigList._find_acfiles(top)
+
+        state = IncrementalCoverage.from_file(state_path, options)
+        added, modified, removed, errors = state.update(paths, use_cache=False)
+        assert not added and modified == [alps] and removed == [os.path.join(top, "archer2-cray.ac")]
+        lines = state.matrix.diff(state.previous)
+        assert "value netlib of option with_linalg_flavor lost its last user" in lines
+        assert "value elpa of option with_linalg_flavor is now used" in lines
+        capsys.readouterr()
+        assert state.matrix.print_report() == full_coverage()
+
+        # Removing several columns at once is equivalent to removing them one by one.
+        from abiconfig.core.coverage import CoverageMatrix
+        configs = ConfigList.from_dir(top, use_cache=False)
+        ref = CoverageMatrix.from_configs(configs, options)
+        for i in (7, 3, 0):
+            ref.remove_column(i)
+        matrix = CoverageMatrix.from_configs(configs, options)
+        matrix.remove_columns([0, 3, 7])
+        assert matrix.as_dict() == ref.as_dict()
+        assert matrix.paths == [c.path for i, c in enumerate(configs) if i not in (0, 3, 7)]
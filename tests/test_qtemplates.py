@@ -0,0 +1,69 @@
+# coding: utf-8
+"""Tests for the templates of the resource managers."""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+from abiconfig.core.options import Config
+from abiconfig.core.qtemplates import QueueTemplate
+
+AC_TEMPLATE = """\
+#---
+#{
+#"hostname": "localhost",
+#"author": "J. Doe",
+#"date": "2020-01-01",
+#"description": ["Fake configuration file"],
+#"qtype": "slurm",
+#"qkwargs": %(qkwargs)s,
+#"keywords": ["gcc"]
+#}
+#---
+FC="mpif90"
+"""
+
+
+class TestQueueTemplate(object):
+
+    def test_substitute(self):
+        for c in QueueTemplate.__subclasses__():
+            s = QueueTemplate.from_qtype(c.QTYPE).substitute({})
+            assert "$$" not in s
+
+        template = QueueTemplate.from_qtype("slurm")
+        s = template.substitute(dict(partition="debug", ntasks=4, mem=None, time=""))
+        assert "#SBATCH --partition=debug" in s
+        assert "#SBATCH --ntasks=4" in s
+        assert "--mem" not in s and "--time" not in s
+        assert s.startswith("#!/bin/bash")
+
+        # The template is parsed once.
+        assert QueueTemplate.from_qtype("slurm")._compile() is template._compile()
+        assert "partition" in template.supported_qparams
+
+    def test_validate(self, tmpdir):
+        template = QueueTemplate.from_qtype("slurm")
+        assert not template.validate_qkwargs(dict(partition="debug", ntasks=2))
+        errors = template.validate_qkwargs(dict(partiton="debug"))
+        assert len(errors) == 1 and "Did you mean: partition" in errors[0]
+
+        path = tmpdir.join("foo.ac")
+        path.write(AC_TEMPLATE % dict(qkwargs='{"ntasks": 2}'))
+        assert "--ntasks=2" in Config.from_file(str(path)).get_script_str()
+        assert not Config.from_file(str(path)).meta.get_warnings()
+
+        # Unknown parameters are reported as warnings, the file can still be used.
+        path.write(AC_TEMPLATE % dict(qkwargs='{"partiton": "debug"}'))
+        conf = Config.from_file(str(path))
+        warnings = conf.meta.get_warnings()
+        assert len(warnings) == 1 and "Did you mean: partition" in warnings[0]
+        assert "partiton" not in conf.get_script_str()
+
+    def test_database(self, tmpdir):
+        """A database with a misspelled qkwargs parameter in one file should still load."""
+        from abiconfig.core.options import ConfigList
+        from abiconfig.core.index import ConfigIndex
+        for i, qkwargs in enumerate(['{"partition": "debug"}', '{"partiton": "debug"}', '{}']):
+            tmpdir.join("conf%d.ac" % i).write(AC_TEMPLATE % dict(qkwargs=qkwargs))
+        configs = ConfigList.from_dir(str(tmpdir))
+        assert len(configs) == 3 and not configs.parse_errors
+        assert [bool(c.meta.get_warnings()) for c in configs] == [False, True, False]
+        assert len(ConfigIndex.from_dir(str(tmpdir)).find_keywords(["gcc"])) == 3
@@ -0,0 +1,186 @@
+# coding: utf-8
+"""Tests for the runtests scripts."""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import pytest
+
+from abiconfig.core.options import Config
+from abiconfig.core.runtests import pack_waves, get_runtests_lines, RuntestsJobs, collect_runs
+
+AC_TEMPLATE = """\
+#---
+#{
+#"hostname": "localhost",
+#"author": "J. Doe",
+#"date": "2020-01-01",
+#"description": ["Fake configuration file"],
+#"qtype": "%(qtype)s",
+#"keywords": ["gcc"],
+#"runtests": {"ncores": 8, "mpi_procs": [1, 4], "omp_threads": [2]}
+#}
+#---
+FC="mpif90"
+"""
+
+
+def make_config(tmpdir, qtype="shell"):
+    path = tmpdir.join("foo.ac")
+    path.write(AC_TEMPLATE % dict(qtype=qtype))
+    return Config.from_file(str(path))
+
+
+class TestPackWaves(object):
+
+    def test_pack(self):
+        """Testing the packing of the MPI x OpenMP combinations."""
+        combos = [(1, 1), (2, 1), (4, 1), (8, 1), (1, 2), (2, 2), (4, 2), (8, 2)]
+        waves = pack_waves(combos, 16)
+        assert sum(len(w) for w in waves) == len(combos)
+        for wave in waves:
+            assert sum(n * o * j for n, o, j in wave) <= 16
+        # 16 + (8 + 8) + (4 + 4 + 4 + 2 + 2 + 1 + ...) cores.
+        assert len(waves) == 3
+        assert waves[0] == [(8, 2, 1)]
+        assert sorted(waves[1]) == [(4, 2, 1), (8, 1, 1)]
+
+        # Leftover cores increase the number of tests executed by runtests.
+        assert pack_waves([(2, 1)], 8) == [[(2, 1, 4)]]
+        assert pack_waves([(4, 1), (1, 1)], 7) == [[(4, 1, 1), (1, 1, 3)]]
+
+        # Combinations larger than the allocation run alone.
+        assert pack_waves([(16, 2), (1, 1)], 8) == [[(16, 2, 1)], [(1, 1, 8)]]
+        assert pack_waves([(1, 1), (4, 1)], 4, order="given") == [[(1, 1, 4)], [(4, 1, 1)]]
+
+        with pytest.raises(ValueError):
+            pack_waves(combos, 16, order="random")
+
+    def test_lines(self):
+        """Testing the runtests section of the script."""
+        lines = get_runtests_lines(4, mpi_procs=[1, 2], omp_threads=[1])
+        assert lines[2] == "# Wave 1: 4 cores out of 4"
+        assert "$RUNTESTS -n2 -o1 -j1 -w Test_suite_MPI2_OMP1 > runtests_MPI2_OMP1.stdout" \
+               " 2> runtests_MPI2_OMP1.stderr &" in lines
+        assert "$RUNTESTS -n1 -o1 -j2 -w Test_suite_MPI1_OMP1 > runtests_MPI1_OMP1.stdout" \
+               " 2> runtests_MPI1_OMP1.stderr &" in lines
+        assert lines[-1] == "wait" and lines.count("wait") == 1
+
+    def test_config(self, tmpdir):
+        """The options of the runtests script are read from the metadata."""
+        conf = make_config(tmpdir)
+        s = conf.get_runtests_script_str()
+        assert "# Wave 1: 8 cores out of 8" in s
+        assert "$RUNTESTS -n4 -o2 -j1" in s and "$RUNTESTS -n1 -o2 -j4" in s
+        assert "$RUNTESTS -n1 -o2 -j3" in conf.get_runtests_script_str(ncores=14)
+
+
+class TestRuntestsJobs(object):
+
+    def test_scripts(self, tmpdir):
+        """Per-combination scripts executed with the shell qtype and collection of the results."""
+        runtests = tmpdir.join("runtests.py")
+        runtests.write("#!/bin/bash\necho running $@ with $OMP_NUM_THREADS threads\n[ $1 != -n4 ]\n")
+        runtests.chmod(0o755)
+        jobs = RuntestsJobs(make_config(tmpdir), omp_threads=[1, 2], runtests=str(runtests))
+        assert jobs.combos == [(1, 1), (1, 2), (4, 1), (4, 2)]
+        outdir = tmpdir.mkdir("runs")
+        driver = jobs.write(str(outdir), mode="scripts")
+        assert os.system("bash %s" % driver) == 0
+        assert outdir.join("runtests_MPI4_OMP2.stdout").read() == "running -n4 -o2 -j1 -w Test_suite_MPI4_OMP2 with 2 threads\n"
+
+        report = collect_runs(str(outdir))
+        assert report.splitlines()[:4] == ["MPI1_OMP1: ok", "MPI1_OMP2: ok", "MPI4_OMP1: failed (1)", "MPI4_OMP2: failed (1)"]
+        assert outdir.join("runtests_report.txt").read() == report
+
+        with pytest.raises(ValueError):
+            jobs.write(str(outdir), mode="array")
+
+    def test_array(self, tmpdir):
+        """Testing the job array and the driver for slurm and pbspro."""
+        jobs = RuntestsJobs(make_config(tmpdir, qtype="slurm"), mpi_procs=[1, 2, 4], omp_threads=[1, 2])
+        assert jobs.get_groups() == [(1, 0, 0), (2, 1, 2), (4, 3, 4), (8, 5, 5)]
+        s = jobs.get_array_script_str(str(tmpdir))
+        assert "MPI_PROCS=(1 1 2 2 4 4)" in s and "OMP_THREADS=(1 2 1 2 1 2)" in s
+        assert "#SBATCH --time=01:00:00" in s and "$$" not in s
+        driver = jobs.get_driver_str().splitlines()
+        assert "sbatch --array=1-2 --ntasks=2 runtests_array.sh" in driver
+        assert "sbatch --array=5 --ntasks=8 runtests_array.sh" in driver
+
+        jobs = RuntestsJobs(make_config(tmpdir, qtype="pbspro"), mpi_procs=[1, 2], omp_threads=[1, 2])
+        driver = jobs.get_driver_str().splitlines()
+        assert ("qsub -v ABICONF_ARRAY_INDEX=0 -l select=1:ncpus=1:mpiprocs=1 "
+                "-o runtests_array_0.qout -e runtests_array_0.qerr runtests_array.sh") in driver
+        assert "qsub -J 1-2 -l select=1:ncpus=2:mpiprocs=2 runtests_array.sh" in driver
+        s = jobs.get_array_script_str(str(tmpdir))
+        assert "#PBS -o %s" % tmpdir.join("runtests_array_^array_index^.qout") in s
+
+        # The scripts are executable.
+        jobs.write(str(tmpdir.join("pbs")))
+        for fname in ("runtests_array.sh", "submit_runtests.sh"):
+            assert os.access(str(tmpdir.join("pbs", fname)), os.X_OK)
+
+
+class TestRuntestsResults(object):
+
+    @staticmethod
+    def write_run(workdir, mpi, omp, etimes, status="succeeded"):
+        lines = ["Running tests with %d MPI procs" % mpi]
+        for i, t in enumerate(etimes):
+            lines.append("[v1][t%02d][np=%d]: %s: absolute error: 1.0e-10 [run_etime: %.2f s]" % (i + 1, mpi, status, t))
+        lines.append("Test suite completed in %.2f s (average time for test = 1.0 s)" % sum(etimes))
+        workdir.join("runtests_MPI%d_OMP%d.stdout" % (mpi, omp)).write("\n".join(lines) + "\n")
+
+    def test_parse(self):
+        """Testing the parser of the runtests output."""
+        from abiconfig.core.runtests import parse_runtests_output
+        tests, total = parse_runtests_output([
+            "[v1][t01][np=1]: succeeded: absolute error: 0.0 [run_etime: 1.50 s]",
+            "[v1][t02]: failed: absolute error: 1.0",
+            "[paral][t51][np=4][rank 0]: passed: relative error: 1e-5",
+            "Summary of the results",
+            "Test suite completed in 12.30 s (average time for test = 2.1 s, stdev = 0.3 s)",
+        ])
+        assert [(t["suite"], t["test"], t["status"], t["run_etime"]) for t in tests] == [
+            ("v1", "t01", "succeeded", 1.5), ("v1", "t02", "failed", None), ("paral", "t51", "passed", None)]
+        assert total == 12.3
+
+    def test_report(self, tmpdir):
+        """Testing speedup, efficiency and the exports."""
+        import csv
+        import json
+        from abiconfig.core.runtests import RuntestsResults, compare_results, write_csv, write_json
+        a = tmpdir.mkdir("a")
+        self.write_run(a, 1, 1, [4.0, 8.0])
+        self.write_run(a, 2, 1, [2.0, 4.0])
+        self.write_run(a, 4, 1, [2.0, 2.0, 1.0], status="failed")
+        b = tmpdir.mkdir("b")
+        self.write_run(b, 1, 1, [6.0, 6.0])
+        # json summary takes precedence over the stdout.
+        self.write_run(b, 2, 2, [1.0, 1.0])
+        b.mkdir("Test_suite_MPI2_OMP2").join("results.json").write(json.dumps({"tests": [
+            {"suite": "v1", "name": "t01", "status": "succeeded", "run_etime": 2.0},
+            {"suite": "v1", "name": "t02", "status": "succeeded", "run_etime": 2.0}]}))
+
+        res_a = RuntestsResults.from_dir(str(a))
+        summary = res_a.get_summary()
+        assert [(d["mpi"], d["passed"], d["failed"]) for d in summary] == [(1, 2, 0), (2, 2, 0), (4, 0, 3)]
+        assert summary[1]["speedup"] == 2.0 and summary[1]["efficiency"] == 1.0
+        assert summary[2]["speedup"] is None and summary[2]["time"] == 5.0
+
+        res_b = RuntestsResults.from_dir(str(b), name="cluster_b")
+        d = res_b.get_summary()[1]
+        assert (d["mpi"], d["omp"], d["speedup"], d["efficiency"]) == (2, 2, 3.0, 0.75)
+
+        table = compare_results([res_a, res_b]).splitlines()
+        assert table[0].split() == ["MPIxOMP", "a", "cluster_b"]
+        assert table[3].startswith("2x1") and "x2.00 (100%)" in table[3] and table[3].endswith("-")
+
+        write_csv([res_a, res_b], str(tmpdir.join("out.csv")))
+        with open(str(tmpdir.join("out.csv")), "rt") as fh:
+            rows = list(csv.DictReader(fh))
+        assert len(rows) == 2 + 2 + 3 + 2 + 2
+        assert rows[2]["test"] == "t01" and float(rows[2]["speedup"]) == 2.0
+
+        write_json([res_a, res_b], str(tmpdir.join("out.json")))
+        with open(str(tmpdir.join("out.json")), "rt") as fh:
+            assert [d["name"] for d in json.load(fh)] == ["a", "cluster_b"]
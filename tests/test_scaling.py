@@ -0,0 +1,118 @@
+# coding: utf-8
+"""Tests for the scaling studies."""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import pytest
+
+from abiconfig.core.options import Config
+from abiconfig.core.scaling import ScalingStudy, ScalingResults, set_abinit_vars, parse_abinit_timing
+
+AC_TEMPLATE = """\
+#---
+#{
+#"hostname": "localhost",
+#"author": "J. Doe",
+#"date": "2020-01-01",
+#"description": ["Fake configuration file"],
+#"qtype": "%(qtype)s",
+#"keywords": ["gcc"],
+#"pre_configure": ["module load abinit"],
+#"qkwargs": %(qkwargs)s
+#}
+#---
+FC="mpif90"
+"""
+
+INPUT = """\
+# Silicon
+ecut 8
+nband 8
+ngkpt 4 4 4
+"""
+
+
+def make_config(tmpdir, qtype="slurm", qkwargs="{}"):
+    path = tmpdir.join("foo.ac")
+    path.write(AC_TEMPLATE % dict(qtype=qtype, qkwargs=qkwargs))
+    return Config.from_file(str(path))
+
+
+class TestScaling(object):
+
+    def test_vars(self):
+        """Testing the modification of the ABINIT input."""
+        s = set_abinit_vars(INPUT, dict(nband="16"))
+        assert "nband 16\n" in s and "nband 8" not in s
+        s = set_abinit_vars("ecut 8", dict(npkpt="2"))
+        assert s == "ecut 8\nnpkpt 2\n"
+
+    def test_timing(self):
+        """Testing the parser of the timing reported by ABINIT."""
+        lines = ["- Proc.   0 individual time (sec): cpu=          2.1  wall=          2.2",
+                 "+Overall time at end (sec) : cpu=        154.3  wall=         40.1"]
+        assert parse_abinit_timing(lines) == dict(cpu=154.3, wall=40.1)
+        assert parse_abinit_timing(lines[:1]) is None
+
+    def test_study(self, tmpdir):
+        """Testing the generation of the jobs and the analysis of the results."""
+        input_path = tmpdir.join("run.abi")
+        input_path.write(INPUT)
+        study = ScalingStudy(make_config(tmpdir), str(input_path), nodes=[1, 2], mpi_procs=[1, 2, 4, 8],
+                             omp_threads=[1, 2], cores_per_node=4, paral_vars={"npband": "{mpi}"})
+        assert (2, 8, 1) in study.points and (1, 8, 1) not in study.points and (2, 1, 1) not in study.points
+        assert study.points[0] == (1, 1, 1)
+
+        top = tmpdir.join("scaling")
+        study.write(str(top))
+        job = top.join("scaling_N2_MPI4_OMP2", "job.sh").read()
+        assert "#SBATCH --nodes=2" in job and "#SBATCH --ntasks-per-node=2" in job
+        assert "#SBATCH --cpus-per-task=2" in job and "$$" not in job
+        assert "module load abinit" in job and "export OMP_NUM_THREADS=2" in job
+        assert "mpirun -np 4 abinit run.abi > run.log 2> run.err" in job
+        assert "npband 4\n" in top.join("scaling_N2_MPI4_OMP2", "run.abi").read()
+        assert os.access(str(top.join("scaling_N2_MPI4_OMP2", "job.sh")), os.X_OK)
+        assert os.access(str(top.join("submit_scaling.sh")), os.X_OK)
+
+        for (n, mpi, omp), wall in [((1, 1, 1), 100.0), ((1, 2, 1), 50.0), ((1, 4, 1), 40.0)]:
+            d = top.join("scaling_N%d_MPI%d_OMP%d" % (n, mpi, omp))
+            d.join("run.abo").write("+Overall time at end (sec) : cpu= %.1f  wall= %.1f\n" % (wall * mpi, wall))
+
+        results = ScalingResults.from_dir(str(top))
+        assert not results.weak
+        table = dict(((r["nodes"], r["mpi"], r["omp"]), r) for r in results.get_table())
+        assert table[(1, 2, 1)]["speedup"] == 2.0 and table[(1, 2, 1)]["efficiency"] == 1.0
+        assert table[(1, 4, 1)]["efficiency"] == 0.625
+        assert table[(2, 8, 1)]["wall"] is None and table[(2, 8, 1)]["efficiency"] is None
+        assert "Strong scaling" in str(results)
+
+        results.write_csv(str(tmpdir.join("scaling.csv")))
+        assert tmpdir.join("scaling.csv").read().splitlines()[0] == "nodes,mpi,omp,ncores,wall,cpu,speedup,efficiency"
+
+    def test_site_qkwargs(self, tmpdir):
+        """The site parameters of the metadata are merged with the layout of the point."""
+        input_path = tmpdir.join("run.abi")
+        input_path.write(INPUT)
+        conf = make_config(tmpdir, qtype="pbspro",
+                           qkwargs='{"queue": "large", "account": "proj", "select": "4:ncpus=128"}')
+        study = ScalingStudy(conf, str(input_path), mpi_procs=[4], omp_threads=[2])
+        job = study.get_script_str(1, 4, 2, workdir=str(tmpdir))
+        assert "#PBS -q large" in job and "#PBS -A proj" in job
+        assert "#PBS -l select=1:ncpus=8:mpiprocs=4:ompthreads=2" in job and "ncpus=128" not in job
+
+        conf = make_config(tmpdir, qtype="slurm", qkwargs='{"partition": "batch", "ntasks": 64}')
+        job = ScalingStudy(conf, str(input_path), mpi_procs=[1]).get_script_str(1, 1, 1, workdir=str(tmpdir))
+        assert "#SBATCH --partition=batch" in job and "#SBATCH --ntasks=1" in job and "--ntasks=64" not in job
+
+    def test_weak(self, tmpdir):
+        """Weak scaling: the variables are scaled with the number of cores."""
+        input_path = tmpdir.join("run.abi")
+        input_path.write(INPUT)
+        study = ScalingStudy(make_config(tmpdir, qtype="shell"), str(input_path), mpi_procs=[2, 4], weak_vars={"nband": 8})
+        top = tmpdir.join("weak")
+        study.write(str(top))
+        assert "nband 16\n" in top.join("scaling_N1_MPI4_OMP1", "run.abi").read()
+        assert ScalingResults.from_dir(str(top)).weak
+
+        with pytest.raises(ValueError):
+            ScalingStudy(make_config(tmpdir), str(input_path), nodes=[4], mpi_procs=[1, 2])
@@ -42,6 +42,23 @@ class TestAbiconf(object):
         # Test opts
         env.run(self.script, "opts", self.verbose)
 
+        # Test script
+        env.run(self.script, "script", "zenobe-intel-impi-mkl.ac", self.verbose)
+        env.run(self.script, "script", "-o", "scripts", "-k", "intel", self.verbose)
+        # Files selected both by path and by keyword are generated once.
+        r = env.run(self.script, "script", "-o", "scripts_j4", "-j", "4", "nic5-intel-easybuild.ac",
+                    "-k", "easybuild", self.verbose)
+        ndirs = len(os.listdir(os.path.join(env.base_path, "scripts_j4")))
+        assert "%d file(s) written, 0 unchanged" % (3 * ndirs) in r.stdout
+        with open(os.path.join(env.base_path, "scripts_j4", "nic5-intel-easybuild.ac",
+                               "workon_nic5-intel-easybuild.ac.sh"), "rt") as fh:
+            assert "|| echo 4)" in fh.read()
+
+        # Test runtests
+        env.run(self.script, "runtests", "jobs", "nic5-intel-easybuild.ac", "-o", "rtjobs", self.verbose)
+        env.run(self.script, "runtests", "collect", "rtjobs", self.verbose)
+        env.run(self.script, "runtests", "report", "rtjobs", "--csv", "rt.csv", self.verbose)
+
         # Test load
         #env.run(self.script, "load", "acfile", self.verbose)
 
@@ -0,0 +1,100 @@
+# coding: utf-8
+"""
+Startup-time benchmark for the abiconf.py script based on `python -X importtime`.
+Run with `py.test -s tests/test_startup.py` to see the timings.
+"""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import sys
+import subprocess
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+script = os.path.join(root, "abiconfig", "scripts", "abiconf.py")
+
+# Budgets in microseconds for the cumulative import time of the modules imported by the script
+# on top of the ones already imported by the bare interpreter (warm run).
+# Measured: ~18 ms for --version (mostly argparse) and ~36 ms for hostname.
+# The margin (~1.7x) absorbs the noise on loaded machines without hiding a new heavy import.
+VERSION_BUDGET_US = 30000
+HOSTNAME_BUDGET_US = 60000
+
+# Modules that must not be imported by `import abiconfig.scripts.abiconf`:
+# the subcommands import them on demand.
+HEAVY_MODULES = (
+    "argparse", "configparser", "json", "socket", "pprint", "tempfile", "hashlib", "shutil",
+    "subprocess", "threading", "concurrent.futures", "multiprocessing", "difflib",
+    "abiconfig.core.options", "abiconfig.core.index", "abiconfig.core.cache",
+    "abiconfig.core.qtemplates", "abiconfig.core.workon", "abiconfig.core.coverage",
+)
+
+
+def importtime(args, env=None):
+    """
+    Run `python -X importtime` with arguments args.
+    Return dictionary: module_name --> (self_us, cumulative_us, depth)
+    """
+    p = subprocess.run([sys.executable, "-X", "importtime"] + args, env=env,
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    assert p.returncode == 0, p.stderr
+
+    modules = {}
+    for line in p.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line: continue
+        self_us, cumul_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules[name.strip()] = (int(self_us), int(cumul_us), depth)
+    return modules
+
+
+def script_imports(*args, **kwargs):
+    """
+    Return the modules imported by abiconf.py and not by the bare interpreter.
+    The script is executed twice so that the second run does not include the compilation of pyc files.
+    """
+    baseline = importtime(["-c", "pass"], **kwargs)
+    importtime([script] + list(args), **kwargs)
+    return {k: v for k, v in importtime([script] + list(args), **kwargs).items() if k not in baseline}
+
+
+def report(title, modules):
+    """Print the modules sorted by cumulative time. Return total time in microseconds."""
+    total = sum(cumul for _, cumul, depth in modules.values() if depth == 0)
+    print("\n%s: %.1f ms" % (title, total / 1000))
+    for name, (self_us, cumul_us, depth) in sorted(modules.items(), key=lambda t: -t[1][1])[:10]:
+        print("%8.1f ms  %s" % (cumul_us / 1000, name))
+    return total
+
+
+class TestStartup(object):
+
+    def test_module_imports(self):
+        """
+        Importing the script module should not import the heavy modules.
+        Unlike the timings, this does not depend on the load of the machine or on the pyc files.
+        """
+        code = ("import sys; import abiconfig.scripts.abiconf; "
+                "print(' '.join(n for n in %r if n in sys.modules))" % (HEAVY_MODULES,))
+        p = subprocess.run([sys.executable, "-c", code], env=dict(os.environ, PYTHONPATH=root), cwd=root,
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        assert p.returncode == 0, p.stderr
+        assert p.stdout.split() == []
+
+    def test_version(self):
+        """abiconf.py --version should not import the modules required by the subcommands."""
+        modules = script_imports("--version")
+        total = report("abiconf.py --version", modules)
+        # NB: shutil is not in the list since argparse uses it to get the terminal size.
+        for name in ("configparser", "json", "socket", "pprint", "tempfile", "hashlib",
+                     "abiconfig.core.options", "abiconfig.core.index"):
+            assert name not in modules
+        assert total < VERSION_BUDGET_US
+
+    def test_hostname(self, tmpdir):
+        """abiconf.py hostname should not import configparser and the modules used by workon."""
+        env = dict(os.environ, ABICONF_CACHE_DIR=str(tmpdir))
+        modules = script_imports("hostname", "-s", env=env)
+        total = report("abiconf.py hostname -s", modules)
+        for name in ("configparser", "tempfile", "hashlib"):
+            assert name not in modules
+        assert total < HOSTNAME_BUDGET_US
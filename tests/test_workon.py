@@ -0,0 +1,441 @@
+# coding: utf-8
+"""Tests for the objects used by abiconf.py workon."""
+from __future__ import print_function, division, unicode_literals, absolute_import
+
+import os
+import pytest
+
+from abiconfig.core.options import Config
+from abiconfig.core.workon import Build, BuildScheduler
+
+AC_TEMPLATE = """\
+#---
+#{
+#"hostname": "localhost",
+#"author": "J. Doe",
+#"date": "2020-01-01",
+#"description": ["Fake configuration file"],
+#"qtype": "shell",
+#"keywords": ["gcc", "%(name)s"],
+#"pre_configure": ["echo pre_configure %(name)s"],
+#"post_make": ["echo post_make %(name)s"]
+#}
+#---
+
+FC="mpif90"
+"""
+
+CONFIGURE = """\
+#!/bin/bash
+printf 'all:\\n\\t@echo building $(MAKEFLAGS)\\n\\t@test ! -f ../fail_$(notdir $(CURDIR))\\n' > Makefile
+"""
+
+
+@pytest.fixture
+def abinit_tree(tmpdir):
+    """Fake Abinit source tree with a configure script that generates a Makefile."""
+    top = tmpdir.mkdir("abinit")
+    configure = top.join("configure")
+    configure.write(CONFIGURE)
+    configure.chmod(0o755)
+    return top
+
+
+def make_build(top, name):
+    path = top.join(name + ".ac")
+    path.write(AC_TEMPLATE % dict(name=name))
+    build = Build.from_conf(Config.from_file(str(path)), top=str(top))
+    build.prepare()
+    return build
+
+
+class TestWorkon(object):
+
+    def test_script(self, abinit_tree):
+        """Testing Build.get_script_str."""
+        build = make_build(abinit_tree, "foo")
+        assert build.workdir == str(abinit_tree.join("_build_foo.ac"))
+        assert os.path.exists(build.acfile)
+        s = build.get_script_str(jobs=3)
+        assert "echo pre_configure foo" in s and "echo post_make foo" in s
+        assert "../configure --with-config-file='foo.ac'" in s
+        assert "|| echo 3" in s
+
+    def test_resume(self, abinit_tree):
+        """Existing build directories are resumed from the first stage whose inputs changed."""
+        abinit_tree.join("configure").write(CONFIGURE + "echo run >> configure_runs\n")
+        build = make_build(abinit_tree, "foo")
+        build.write_script(1)
+        assert BuildScheduler([build], ncores=1, poll_interval=0.05).run(echo=False) == 0
+        build.write_job_scripts()
+
+        def nruns():
+            with open(os.path.join(build.workdir, "configure_runs"), "rt") as fh:
+                return len(fh.readlines())
+
+        # Nothing changed: configure is skipped and the files produced by make are kept.
+        abinit_tree.join("_build_foo.ac", "main.o").write("")
+        plan = build.prepare()
+        assert list(plan.values()) == ["up-to-date", "up-to-date", "run", "run", "up-to-date"]
+        build.write_script(1)
+        assert BuildScheduler([build], ncores=1, poll_interval=0.05).run(echo=False) == 0
+        assert nruns() == 1
+
+        # Changing the .ac file triggers configure but the object files are not removed.
+        abinit_tree.join("foo.ac").write(AC_TEMPLATE % dict(name="foo") + "\nFCFLAGS='-O3'\n")
+        build = Build.from_conf(Config.from_file(str(abinit_tree.join("foo.ac"))), top=str(abinit_tree))
+        plan = build.prepare()
+        assert plan["prepare"] == plan["configure"] == plan["scripts"] == "run"
+        assert Config.from_file(build.acfile)["FCFLAGS"] == "-O3"
+        build.write_script(1)
+        assert BuildScheduler([build], ncores=1, poll_interval=0.05).run(echo=False) == 0
+        assert nruns() == 2
+        assert os.path.exists(os.path.join(build.workdir, "main.o"))
+
+        # A new configure script invalidates the configure stage only.
+        abinit_tree.join("configure").write(CONFIGURE + "echo run >> configure_runs # new\n")
+        plan = build.prepare()
+        assert plan["prepare"] == "up-to-date" and plan["configure"] == "run"
+        assert not os.path.exists(os.path.join(build.workdir, "__configure_done__"))
+
+        # -r removes the directory.
+        build.prepare(remove=True)
+        assert not os.path.exists(os.path.join(build.workdir, "main.o"))
+
+    def test_scheduler(self, abinit_tree, capsys):
+        """Testing concurrent builds with BuildScheduler."""
+        builds = [make_build(abinit_tree, name) for name in ("foo", "bar", "baz")]
+        abinit_tree.join("fail__build_baz.ac").write("")
+        for build in builds:
+            build.write_script(1)
+
+        scheduler = BuildScheduler(builds, ncores=5, max_builds=2, poll_interval=0.05)
+        assert scheduler.run() == 1
+        assert [b.retcode for b in builds] == [0, 0, 2]
+        assert all(b.wall_time > 0 for b in builds)
+        assert sum(b.jobs for b in builds[:2]) == 5
+        assert [b.status for b in builds] == ["ok", "ok", "failed"]
+        with open(os.path.join(builds[0].workdir, "workon.stdout")) as fh:
+            log = fh.read()
+        assert "pre_configure foo" in log and "post_make foo" in log
+        scheduler.print_summary()
+
+        # Timing reports.
+        from abiconfig.core.timing import TimingReport, compare_reports
+        reports = [TimingReport.from_file(b.workdir) for b in builds]
+        assert reports[0].phase_names == ["module_load", "configure", "make", "post_make"]
+        assert reports[2].get_phase("make")["exit_code"] == 2 and reports[2]["retcode"] == 2
+        assert all(p["duration"] >= 0 for p in reports[0]["phases"])
+        table = compare_reports(reports)
+        assert "foo.ac" in table and "post_make" in table and "total" in table
+
+        # Report built from the events if the script is executed by hand.
+        os.remove(os.path.join(builds[1].workdir, "timing.json"))
+        report = TimingReport.from_file(builds[1].workdir)
+        assert report["name"] == "bar.ac" and report.phase_names == reports[0].phase_names
+
+        # Events that cannot be parsed (e.g. `date +%N` not supported) are reported.
+        from abiconfig.core.timing import read_events
+        path = os.path.join(builds[1].workdir, "abiconf_timing.jsonl")
+        with open(path, "at") as fh:
+            fh.write('{"phase": "make", "start": 1700000000.%N, "end": 1700000001.%N, "exit_code": 0}\n')
+            fh.write('{"phase": "post_make", "start"')
+        capsys.readouterr()
+        assert [p["phase"] for p in read_events(path)] == reports[0].phase_names
+        assert "Cannot parse 1 event(s)" in capsys.readouterr().out
+
+    def test_split_cores(self, abinit_tree):
+        """Builds that started make keep their number of jobs."""
+        builds = [make_build(abinit_tree, name) for name in ("foo", "bar", "baz")]
+        scheduler = BuildScheduler(builds, ncores=8)
+        scheduler.split_cores(builds)
+        assert [b.jobs for b in builds] == [3, 3, 2]
+        abinit_tree.join("_build_foo.ac", "__make_started__").write("")
+        scheduler.split_cores(builds[:2])
+        assert [b.jobs for b in builds[:2]] == [3, 5]
+
+    def test_batch(self, abinit_tree, monkeypatch):
+        """Testing the submission of the build with the shell qtype."""
+        build = make_build(abinit_tree, "foo")
+        build.write_script(1)
+        build.write_batch_script(4)
+        assert build.batch_retcode is None
+        assert build.submit() == 0
+        assert build.batch_retcode == 0
+        from abiconfig.core.timing import TimingReport
+        report = TimingReport.from_file(os.path.join(build.workdir, "timing.json"))
+        assert report["name"] == "foo.ac" and "make" in report.phase_names
+        with open(os.path.join(build.workdir, "workon.stdout"), "rt") as fh:
+            assert "post_make foo" in fh.read()
+
+        build.conf.meta["qtype"] = "slurm"
+        build.conf.meta["qkwargs"] = dict(partition="debug", ntasks_per_node=8)
+        s = build.get_batch_script_str(16, walltime="01:00:00")
+        assert "#SBATCH --cpus-per-task=16" in s and "#SBATCH --time=01:00:00" in s
+        assert "#SBATCH --partition=debug" in s and "ntasks-per-node" not in s and "$$" not in s
+        assert "#SBATCH --job-name=build_foo.ac" in s
+
+        # Submission command not available on this machine.
+        from abiconfig.core import workon
+        monkeypatch.setitem(workon.SUBMIT_CMDS, "slurm", "abiconf_no_such_sbatch")
+        build.write_batch_script(4)
+        assert build.submit() == 127
+
+        # Unsupported qtype: reported by abiconf.py before creating the build directory.
+        import sys
+        import subprocess
+        script = os.path.join(os.path.dirname(__file__), "..", "abiconfig", "scripts", "abiconf.py")
+        abinit_tree.join("lsf.ac").write((AC_TEMPLATE % dict(name="lsf")).replace('"shell"', '"lsf"'))
+        p = subprocess.run([sys.executable, script, "workon", "--no-colors", "--batch", "-m", "lsf.ac"],
+                           cwd=str(abinit_tree), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                           universal_newlines=True)
+        assert p.returncode == 1 and "Traceback" not in p.stderr
+        assert "Cannot submit the build of lsf.ac with qtype: lsf" in p.stdout
+        assert not abinit_tree.join("_build_lsf.ac").exists()
+
+
+class TestProcess(object):
+
+    def test_streaming(self, tmpdir, capsys):
+        """Testing Process with output redirected to files and terminal."""
+        from abiconfig.core.runner import Process
+        cwd = os.getcwd()
+        script = "for i in $(seq 1 20000); do echo out$i; echo err$i >&2; done; pwd; exit 3"
+        p = Process(["bash", "-c", script], cwd=str(tmpdir), stdout_path=str(tmpdir.join("out.log")),
+                    stderr_path=str(tmpdir.join("err.log")), prefix="[foo] ")
+        assert p.run() == 3
+        assert os.getcwd() == cwd
+        out, err = capsys.readouterr()
+        assert "[foo] out20000" in out and "[foo] err20000" in err
+        lines = tmpdir.join("out.log").read().splitlines()
+        assert len(lines) == 20001 and lines[-1] == str(tmpdir)
+        assert tmpdir.join("err.log").read().splitlines()[-1] == "err20000"
+        assert not p.timed_out and not p.cancelled
+
+    def test_timeout_cancel(self, tmpdir):
+        """Process should be killed with its children after timeout."""
+        from abiconfig.core.runner import Process
+        p = Process(["bash", "-c", "sleep 60 & sleep 60; echo done"], echo=False)
+        assert p.run(timeout=0.5) == 128 + 15
+        assert p.timed_out and p.cancelled
+
+        p = Process(["bash", "-c", "sleep 60"], echo=False).start()
+        p.cancel()
+        assert p.wait() == 128 + 15 and p.cancelled
+
+
+class TestCompilerCache(object):
+
+    def test_wrap(self, abinit_tree, monkeypatch):
+        """Testing the wrapping of the compilers in the .ac file."""
+        from abiconfig.core.compiler_cache import CompilerCache
+        bindir = abinit_tree.mkdir("bin")
+        monkeypatch.setenv("PATH", str(bindir))
+        with pytest.raises(ValueError) as excinfo:
+            CompilerCache("ccache")
+        assert "not found" in str(excinfo.value)
+
+        # Fake ccache executable.
+        bindir.join("ccache").write("#!/bin/sh\nexec \"$@\"\n")
+        bindir.join("ccache").chmod(0o755)
+        cache = CompilerCache("ccache", cache_dir=str(abinit_tree.join("ccache")), basedir=str(abinit_tree))
+        s, wrapped = cache.wrap_acfile_string('FC="mpif90"\nCC=mpicc\n  CXX=\'mpicxx -std=c++11\'\nFCFLAGS="-O2"')
+        assert wrapped == ["FC", "CC", "CXX"]
+        assert s == 'FC="ccache mpif90"\nCC=ccache mpicc\n  CXX=\'ccache mpicxx -std=c++11\'\nFCFLAGS="-O2"'
+        assert cache.wrap_acfile_string(s) == (s, [])
+
+        path = abinit_tree.join("foo.ac")
+        path.write(AC_TEMPLATE % dict(name="foo"))
+        build = Build.from_conf(Config.from_file(str(path)), top=str(abinit_tree), compiler_cache=cache)
+        build.prepare()
+        assert Config.from_file(build.acfile)["FC"] == "ccache mpif90"
+        script = build.get_script_str(jobs=2)
+        assert "export CCACHE_DIR=%s" % cache.cache_dir in script
+        assert "export CCACHE_BASEDIR=%s" % abinit_tree in script
+
+        with pytest.raises(ValueError):
+            CompilerCache("distcc")
+
+    def test_stats(self):
+        """Testing the parsers of the statistics."""
+        from abiconfig.core.compiler_cache import parse_ccache_statslog, diff_sccache_stats, format_stats
+        log = ["# /abinit/src/a.c", "direct_cache_hit", "local_storage_read_hit", "local_storage_hit",
+               "# /abinit/src/b.c", "cache_miss", "local_storage_miss", "local_storage_write",
+               "# /abinit/src/c.F90", "unsupported_source_language",
+               "# /abinit/src/d.c", "preprocessed_cache_hit"]
+        stats = parse_ccache_statslog(log)
+        assert stats == dict(hits=2, misses=1, uncacheable=1)
+        assert format_stats(stats) == "2 hits, 1 misses, 1 uncacheable (hit rate 67%)"
+
+        start = {"stats": {"cache_hits": {"counts": {"C/C++": 2}}, "cache_misses": {"counts": {}},
+                           "requests_not_cacheable": 1}}
+        end = {"stats": {"cache_hits": {"counts": {"C/C++": 10}}, "cache_misses": {"counts": {"C/C++": 3}},
+                         "requests_not_cacheable": 5}}
+        assert diff_sccache_stats(start, end) == dict(hits=8, misses=3, uncacheable=4)
+
+
+class TestAutoconfCache(object):
+
+    def test_shared_cache(self, abinit_tree):
+        """Builds with the same toolchain should reuse the autoconf cache file."""
+        from abiconfig.core.workon import AutoconfCache
+        abinit_tree.join("configure").write(CONFIGURE + """\
+for arg in "$@"; do case $arg in --cache-file=*) cache=${arg#--cache-file=};; esac; done
+[ -s $cache ] && echo cached > used_cache
+echo "ac_cv_foo=yes" >> $cache
+""")
+        cache = AutoconfCache(cache_dir=str(abinit_tree.join("autoconf")))
+        builds = []
+        for name in ("foo", "bar", "baz"):
+            path = abinit_tree.join(name + ".ac")
+            s = (AC_TEMPLATE % dict(name=name)).replace("echo pre_configure " + name, "echo pre_configure")
+            if name == "baz": s = s.replace('"pre_configure": [', '"pre_configure": ["echo module load gcc",')
+            path.write(s)
+            conf = Config.from_file(str(path))
+            builds.append(Build.from_conf(conf, top=str(abinit_tree), autoconf_cache=cache))
+            builds[-1].prepare()
+            builds[-1].write_script(1)
+
+        # foo and bar have the same toolchain, baz loads different modules.
+        assert (AutoconfCache.get_static_fingerprint(builds[0].conf) ==
+                AutoconfCache.get_static_fingerprint(builds[1].conf))
+        assert (AutoconfCache.get_static_fingerprint(builds[0].conf) !=
+                AutoconfCache.get_static_fingerprint(builds[2].conf))
+
+        assert BuildScheduler(builds, ncores=1, max_builds=1, poll_interval=0.05).run(echo=False) == 0
+        used = [os.path.exists(os.path.join(b.workdir, "used_cache")) for b in builds]
+        assert used == [False, True, False]
+        assert len(os.listdir(cache.cache_dir)) == 2
+        assert all(os.path.exists(os.path.join(b.workdir, "__configure_done__")) for b in builds)
+
+    def test_linalg(self, tmpdir):
+        """Configurations that differ only in the linear algebra library should not share the cache."""
+        from abiconfig.core.workon import AutoconfCache
+        fps = []
+        for name, linalg in [("mkl", 'with_linalg_flavor="mkl"\nLINALG_LIBS="-lmkl_rt"\n'),
+                             ("openblas", 'with_linalg_flavor="openblas"\nLINALG_LIBS="-lopenblas"\n'),
+                             ("openblas2", 'with_linalg_flavor="openblas"\nLINALG_LIBS="-L/opt/lib -lopenblas"\n')]:
+            path = tmpdir.join(name + ".ac")
+            path.write(AC_TEMPLATE % dict(name="gcc") + linalg)
+            fps.append(AutoconfCache.get_static_fingerprint(Config.from_file(str(path))))
+        assert len(set(fps)) == 3
+
+
+class TestResources(object):
+
+    def test_probe(self, tmpdir):
+        """Testing the cgroup v2 limits and the number of jobs."""
+        from abiconfig.core.resources import Resources
+        tmpdir.mkdir("proc").mkdir("self").join("cgroup").write("0::/user.slice/job_1\n")
+        tmpdir.join("proc", "meminfo").write("MemTotal:       32000000 kB\nMemAvailable:   16777216 kB\n")
+        job = tmpdir.mkdir("sys").mkdir("fs").mkdir("cgroup").mkdir("user.slice").mkdir("job_1")
+        job.join("cpu.max").write("150000 100000\n")
+        job.join("memory.max").write("%d\n" % (6 * 1024 ** 3))
+        job.join("memory.current").write("%d\n" % (1024 ** 3))
+        tmpdir.join("sys", "fs", "cgroup", "user.slice", "memory.max").write("max\n")
+
+        res = Resources.probe(root=str(tmpdir))
+        assert res.cgroup_cpus == 1.5
+        assert res.mem_available == 16 * 1024 ** 3 and res.cgroup_mem_available == 5 * 1024 ** 3
+        assert res.ncpus == min(2, res.affinity)
+        assert res.get_jobs(mem_per_job=2) == min(2, res.ncpus)
+        assert res.get_jobs(mem_per_job=4) == 1
+        assert "jobs" in str(res)
+
+    def test_cgroup_v1(self, tmpdir):
+        """Testing the cgroup v1 limits."""
+        from abiconfig.core.resources import Resources
+        tmpdir.mkdir("proc").mkdir("self").join("cgroup").write(
+            "4:memory:/slurm/job_2\n3:cpu,cpuacct:/slurm/job_2\n")
+        cpu = tmpdir.mkdir("sys").mkdir("fs").mkdir("cgroup").mkdir("cpu,cpuacct")
+        cpu.mkdir("slurm").mkdir("job_2").join("cpu.cfs_quota_us").write("400000\n")
+        cpu.join("slurm", "job_2", "cpu.cfs_period_us").write("100000\n")
+        mem = tmpdir.join("sys", "fs", "cgroup").mkdir("memory")
+        mem.join("memory.limit_in_bytes").write("9223372036854771712\n")
+        mem.mkdir("slurm").mkdir("job_2").join("memory.limit_in_bytes").write("%d\n" % (8 * 1024 ** 3))
+
+        res = Resources(ncpus_online=64, affinity=16)
+        probed = Resources.probe(root=str(tmpdir))
+        res.cgroup_cpus, res.cgroup_mem_available = probed.cgroup_cpus, probed.cgroup_mem_available
+        assert res.ncpus == 4 and res.mem_available is None
+        assert res.get_jobs(mem_per_job=3) == 2
+        assert Resources(ncpus_online=8).get_jobs() == 8
+
+
+class TestScriptGenerator(object):
+
+    def test_generate(self, abinit_tree):
+        """Unchanged scripts should not be rewritten."""
+        from abiconfig.core.batch import ScriptGenerator
+        configs = []
+        for name in ("foo", "bar"):
+            path = abinit_tree.join(name + ".ac")
+            path.write(AC_TEMPLATE % dict(name=name))
+            configs.append(Config.from_file(str(path)))
+
+        outdir = str(abinit_tree.join("scripts"))
+        gen = ScriptGenerator(outdir, build_top=str(abinit_tree))
+        assert gen.generate(configs, nprocs=2) == 0
+        assert len(gen.written) == 6 and not gen.unchanged
+        assert sorted(os.listdir(os.path.join(outdir, "foo.ac"))) == [
+            "launch_runtests_job.sh", "template_job.sh", "workon_foo.ac.sh"]
+        with open(os.path.join(outdir, "foo.ac", "workon_foo.ac.sh"), "rt") as fh:
+            assert "cd %s" % abinit_tree.join("_build_foo.ac") in fh.read()
+
+        # The scripts are readable by the other users and executable (same permissions as with open()).
+        from abiconfig.core.cache import _UMASK
+        for fname in os.listdir(os.path.join(outdir, "foo.ac")):
+            mode = os.stat(os.path.join(outdir, "foo.ac", fname)).st_mode & 0o777
+            assert mode == 0o777 & ~_UMASK
+
+        # The generation timestamp of the workon script is ignored.
+        gen = ScriptGenerator(outdir, build_top=str(abinit_tree))
+        assert gen.generate(configs) == 0
+        assert not gen.written and len(gen.unchanged) == 6
+
+        abinit_tree.join("bar.ac").write((AC_TEMPLATE % dict(name="bar")).replace("post_make bar", "post_make baz"))
+        configs[1] = Config.from_file(str(abinit_tree.join("bar.ac")))
+        gen = ScriptGenerator(outdir, build_top=str(abinit_tree))
+        gen.generate(configs)
+        assert [os.path.basename(p) for p in gen.written] == ["workon_bar.ac.sh"]
+        assert not [f for f in os.listdir(os.path.join(outdir, "bar.ac")) if f.startswith(".tmp")]
+
+
+class TestModuleEnvironment(object):
+
+    def test_capture(self, tmpdir, monkeypatch):
+        """Testing the cache of the environment produced by the pre_configure commands."""
+        import subprocess
+        from abiconfig.core.module_env import ModuleEnvironment
+        monkeypatch.setenv("ABICONF_UNSET", "1")
+        commands = ["export ABICONF_FOO='a b'", "export PATH=/opt/fake/bin:$PATH", "unset ABICONF_UNSET"]
+        module_env = ModuleEnvironment(cache_dir=str(tmpdir.join("env")))
+        path = module_env.get_env_file(commands)
+        assert path == module_env.get_path(commands) and os.path.exists(path)
+        with open(path, "rt") as fh:
+            s = fh.read()
+        assert "unset ABICONF_UNSET" in s and "SHLVL" not in s
+
+        out = subprocess.check_output(["bash", "-c", 'source %s; echo "$ABICONF_FOO:${ABICONF_UNSET-none}:$PATH"' % path])
+        assert out.decode("utf-8").startswith("a b:none:/opt/fake/bin:")
+
+        with pytest.raises(RuntimeError):
+            module_env.capture(["false"])
+
+    def test_build(self, abinit_tree):
+        """The workon script should source the cached environment."""
+        from abiconfig.core.module_env import ModuleEnvironment
+        module_env = ModuleEnvironment(cache_dir=str(abinit_tree.join("env")))
+        path = abinit_tree.join("foo.ac")
+        path.write(AC_TEMPLATE % dict(name="foo"))
+        conf = Config.from_file(str(path))
+        build = Build.from_conf(conf, top=str(abinit_tree), module_env=module_env)
+        build.prepare()
+        module_env.get_env_file(conf.meta["pre_configure"])
+        build.write_script(1)
+        assert "source %s" % module_env.get_path(conf.meta["pre_configure"]) in build.get_script_str(1)
+        assert "source" in conf.get_script_str(module_env=module_env)
+
+        assert BuildScheduler([build], ncores=1, poll_interval=0.05).run(echo=False) == 0
+        with open(os.path.join(build.workdir, "workon.stdout"), "rt") as fh:
+            assert "pre_configure foo" not in fh.read()